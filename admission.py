@@ -0,0 +1,394 @@
+"""
+Client-side admission control for Gemini calls.
+
+google-genai retries 429s on its own (agent.retry_config), but every worker
+of every pod does so independently, so a quota storm gets amplified instead
+of absorbed. Every extraction that reaches Gemini (ExtractionCache misses)
+is admitted here first, against state shared by all workers:
+
+- a token bucket refilled at GEMINI_RPM per minute with room for
+  GEMINI_BURST calls, sized to the Vertex quota;
+- an adaptive limit on concurrent calls (AIMD): it grows by 1/limit per call
+  that succeeds within GEMINI_LATENCY_TARGET and is halved when Gemini
+  answers 429 (including 429s that retry_config retried); slow calls shrink
+  it by 10%. A 429 also pauses all admissions for GEMINI_THROTTLE_BACKOFF;
+- two priorities: 'interactive' (POST /api/ocr/extract) may use everything,
+  'batch' (OCR jobs and /api/ocr/extract/batch) only GEMINI_BATCH_SHARE of
+  the concurrency limit and the tokens above the rest of the burst, so
+  single extractions keep a reserve while batches run.
+
+A call that cannot be admitted within its priority's max wait raises
+SaturatedError right away (when the expected wait is already longer) with a
+Retry-After hint; the routes answer 503 with that header instead of tying up
+a worker.
+
+The state lives in a pluggable store (GEMINI_ADMISSION_STORE):
+
+- 'local': this worker process only;
+- 'file': a JSON file locked with flock, shared by the workers of a pod
+  (GEMINI_RPM is then per pod: divide the quota by the maximum replicas);
+- 'postgres': a row of the gemini_admission table on the primary, locked
+  with SELECT ... FOR UPDATE, shared by every pod. Costs two short
+  transactions per extraction.
+
+Each call holds a lease until it finishes; leases of crashed workers expire
+after LEASE_TTL seconds.
+
+An extraction can make more than one model call: the tiered engine adds Pro
+calls and KTP_VALIDATION_LLM_FALLBACK a search-grounded check. agent.py
+calls `charge_model_call` before each of them; the first is paid for by the
+extraction's admission, every further one takes another token, so GEMINI_RPM
+counts model calls whatever the engine. Those tokens are taken without
+waiting (the bucket may go negative and later admissions wait for it to
+refill) so an extraction is never failed halfway through.
+"""
+import asyncio
+import contextlib
+import contextvars
+import fcntl
+import functools
+import json
+import math
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+import metrics
+from models import db
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+LEASE_TTL = 300
+# Latency EWMA weight for new samples; the EWMA estimates when a slot frees up
+_LATENCY_WEIGHT = 0.2
+
+_priority = contextvars.ContextVar('gemini_priority', default=INTERACTIVE)
+# Statuses of retried calls of the current extraction, see metrics.on_genai_retry
+_retries = contextvars.ContextVar('gemini_retries', default=None)
+# Admission and model call count of the current extraction, see charge_model_call
+_calls = contextvars.ContextVar('gemini_calls', default=None)
+
+
+class SaturatedError(Exception):
+    """Raised when a Gemini call cannot be admitted in time."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ----------------------------------------------------------------------
+# Stores: atomic read-modify-write of one JSON state dict
+# ----------------------------------------------------------------------
+
+class LocalStore:
+    """State of this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def transact(self, fn):
+        with self._lock:
+            return fn(self._state)
+
+
+class FileStore:
+    """State shared by the processes that can see `path` (the workers of a pod)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def transact(self, fn):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    # Torn write from a killed worker; start over
+                    state = {}
+                result = fn(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class PostgresStore:
+    """State shared by every pod, in a gemini_admission row on the primary."""
+
+    def __init__(self, app, key='gemini'):
+        self.app = app
+        self.key = key
+
+    def transact(self, fn):
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                params = {'key': self.key}
+                conn.execute(text(
+                    "INSERT INTO gemini_admission (key, state) VALUES (:key, '{}') ON CONFLICT (key) DO NOTHING"
+                ), params)
+                state = conn.execute(text(
+                    'SELECT state FROM gemini_admission WHERE key = :key FOR UPDATE'
+                ), params).scalar_one()
+                if isinstance(state, str):
+                    state = json.loads(state)
+                result = fn(state)
+                conn.execute(text(
+                    'UPDATE gemini_admission SET state = :state, updated_at = now() WHERE key = :key'
+                ), {'key': self.key, 'state': json.dumps(state)})
+                return result
+
+
+# ----------------------------------------------------------------------
+
+class GeminiAdmission:
+
+    def __init__(self, app=None, store=None):
+        self.app = None
+        self.store = store
+        self._lock = threading.Lock()
+        self.counters = {
+            'admitted': 0,
+            'rejected': 0,
+            'throttled': 0,
+            'extra_calls': 0
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('GEMINI_ADMISSION_ENABLED', True)
+        self.rate = app.config.get('GEMINI_RPM', 300) / 60.0
+        self.burst = max(1, app.config.get('GEMINI_BURST', 20))
+        self.min_limit = max(1, app.config.get('GEMINI_MIN_CONCURRENCY', 1))
+        self.max_limit = max(self.min_limit, app.config.get('GEMINI_MAX_CONCURRENCY', 32))
+        self.latency_target = app.config.get('GEMINI_LATENCY_TARGET', 15)
+        self.batch_share = min(1.0, max(0.0, app.config.get('GEMINI_BATCH_SHARE', 0.5)))
+        self.backoff = app.config.get('GEMINI_THROTTLE_BACKOFF', 5)
+        self.max_wait = {
+            INTERACTIVE: app.config.get('GEMINI_INTERACTIVE_MAX_WAIT', 2),
+            BATCH: app.config.get('GEMINI_BATCH_MAX_WAIT', 120)
+        }
+        if self.store is None:
+            kind = app.config.get('GEMINI_ADMISSION_STORE', 'file')
+            if kind == 'postgres':
+                self.store = PostgresStore(app)
+            elif kind == 'file':
+                self.store = FileStore(app.config.get('GEMINI_ADMISSION_FILE', '/tmp/ktp-gemini-admission.json'))
+            else:
+                self.store = LocalStore()
+        metrics.on_genai_retry(_record_retry)
+        app.extensions['gemini_admission'] = self
+
+    def wrap(self, process):
+        """Wraps an async `process_document` so every call is admitted first."""
+        @functools.wraps(process)
+        async def admitted(*args, **kwargs):
+            if not self.enabled:
+                return await process(*args, **kwargs)
+            async with self.slot():
+                return await process(*args, **kwargs)
+        return admitted
+
+    @staticmethod
+    def prioritized(process, priority):
+        """Wraps an async callable so the Gemini calls it makes are admitted with `priority`."""
+        @functools.wraps(process)
+        async def run(*args, **kwargs):
+            token = _priority.set(priority)
+            try:
+                return await process(*args, **kwargs)
+            finally:
+                _priority.reset(token)
+        return run
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=None):
+        """Waits for admission (or raises SaturatedError) and holds a lease while the body runs."""
+        priority = priority or _priority.get()
+        lease = await self._acquire(priority)
+        retries = []
+        # Not reset with a token: a streamed extraction may finish in another task
+        _retries.set(retries)
+        _calls.set({'admission': self, 'priority': priority, 'count': 0})
+        started = time.monotonic()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        except Exception as e:
+            if getattr(e, 'code', None) == 429:
+                outcome = 'throttled'
+            raise
+        finally:
+            _retries.set(None)
+            _calls.set(None)
+            if '429' in retries:
+                outcome = 'throttled'
+            if outcome == 'throttled':
+                self._count('throttled')
+            if lease is not None:
+                await self._release_lease(lease, outcome, time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        try:
+            state = self.store.transact(self._snapshot)
+        except Exception as e:
+            state = {'error': str(e)}
+        stats.update(state)
+        return stats
+
+    # ------------------------------------------------------------------
+
+    async def _acquire(self, priority):
+        started = time.monotonic()
+        deadline = started + self.max_wait.get(priority, 0)
+        while True:
+            try:
+                lease, wait = await asyncio.to_thread(self.store.transact, functools.partial(
+                    self._try_acquire, priority=priority
+                ))
+            except Exception as e:
+                # A broken store must not stop extractions; fall back to retry_config alone
+                print(f"[GeminiAdmission] Store unavailable, admitting without limits: {e}")
+                return None
+            if lease is not None:
+                self._count('admitted')
+                metrics.GENAI_ADMISSION.labels(priority, 'admitted').inc()
+                metrics.GENAI_ADMISSION_WAIT.labels(priority).observe(time.monotonic() - started)
+                return lease
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                self._count('rejected')
+                metrics.GENAI_ADMISSION.labels(priority, 'rejected').inc()
+                raise SaturatedError('Gemini quota is saturated, try again later',
+                                     retry_after=max(1, math.ceil(wait)))
+            await asyncio.sleep(min(wait, 1.0))
+
+    async def _charge(self, priority):
+        self._count('extra_calls')
+        metrics.GENAI_ADMISSION.labels(priority, 'extra_call').inc()
+        try:
+            await asyncio.to_thread(self.store.transact, self._take_token)
+        except Exception as e:
+            print(f"[GeminiAdmission] Could not charge a model call: {e}")
+
+    async def _release_lease(self, lease, outcome, latency):
+        try:
+            await asyncio.to_thread(self.store.transact, functools.partial(
+                self._release, lease=lease, outcome=outcome, latency=latency
+            ))
+        except Exception as e:
+            # The lease expires on its own after LEASE_TTL
+            print(f"[GeminiAdmission] Could not release lease: {e}")
+
+    def _try_acquire(self, state, priority):
+        """Store transaction: (lease id, 0) when admitted, else (None, seconds until it might be)."""
+        now = time.time()
+        self._refill(state, now)
+        leases = state['leases']
+        if state['paused_until'] > now:
+            return None, state['paused_until'] - now
+
+        limit = state['limit']
+        reserve = 0.0
+        if priority != INTERACTIVE:
+            limit = max(1.0, limit * self.batch_share)
+            reserve = self.burst * (1 - self.batch_share)
+        if len(leases) >= int(limit):
+            # Roughly when the next running call finishes
+            return None, max(0.05, state['latency'] / max(1, len(leases)))
+        if state['tokens'] < reserve + 1:
+            return None, (reserve + 1 - state['tokens']) / self.rate if self.rate else LEASE_TTL
+
+        lease = uuid.uuid4().hex
+        state['tokens'] -= 1
+        leases[lease] = now + LEASE_TTL
+        return lease, 0
+
+    def _take_token(self, state):
+        """Store transaction: one token for a further model call of an admitted extraction."""
+        self._refill(state, time.time())
+        state['tokens'] = max(-float(self.burst), state['tokens'] - 1)
+
+    def _release(self, state, lease, outcome, latency):
+        now = time.time()
+        self._refill(state, now)
+        state['leases'].pop(lease, None)
+        limit = state['limit']
+        cooled_down = now - state['decreased_at'] >= self.backoff
+        if outcome == 'throttled':
+            # One decrease per backoff window, however many calls saw the same storm
+            if cooled_down:
+                limit = limit / 2
+                state['decreased_at'] = now
+                state['paused_until'] = now + self.backoff
+                state['tokens'] = min(state['tokens'], 0.0)
+        elif outcome == 'ok':
+            state['latency'] += _LATENCY_WEIGHT * (latency - state['latency'])
+            if latency > self.latency_target:
+                if cooled_down:
+                    limit = limit * 0.9
+                    state['decreased_at'] = now
+            else:
+                limit = limit + 1 / limit
+        state['limit'] = min(self.max_limit, max(self.min_limit, limit))
+        metrics.GENAI_CONCURRENCY_LIMIT.set(state['limit'])
+
+    def _refill(self, state, now):
+        if 'limit' not in state:
+            state.update(
+                tokens=float(self.burst), refilled_at=now, limit=float(self.max_limit), leases={},
+                latency=self.latency_target / 2, decreased_at=0.0, paused_until=0.0
+            )
+        state['tokens'] = min(self.burst, state['tokens'] + max(0.0, now - state['refilled_at']) * self.rate)
+        state['refilled_at'] = now
+        state['leases'] = {lease: expires for lease, expires in state['leases'].items() if expires > now}
+
+    def _snapshot(self, state):
+        now = time.time()
+        self._refill(state, now)
+        return {
+            'tokens': round(state['tokens'], 2),
+            'concurrency_limit': round(state['limit'], 2),
+            'in_flight': len(state['leases']),
+            'latency_ewma': round(state['latency'], 3),
+            'paused_for': round(max(0.0, state['paused_until'] - now), 2)
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+
+async def charge_model_call():
+    """
+    Called before every Gemini call of an extraction. The first call is
+    covered by the extraction's own admission; each further one takes a token
+    (module docstring). Outside an admitted extraction it does nothing.
+    """
+    calls = _calls.get()
+    if calls is None:
+        return
+    calls['count'] += 1
+    if calls['count'] > 1:
+        await calls['admission']._charge(calls['priority'])
+
+
+def _record_retry(status):
+    retries = _retries.get()
+    if retries is not None:
+        retries.append(status)
@@ -1,10 +1,12 @@
 import os
+import json
 import asyncio
 from typing import List, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 from copy import deepcopy
-from datetime import datetime
 import time
+import uuid
+from contextvars import ContextVar
 
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
@@ -19,7 +21,12 @@ from google.genai.types import HttpRetryOptions
 
 from dotenv import load_dotenv
 
-today_date = datetime.today().strftime("%d-%m-%Y")
+from admission import charge_model_call
+from ktp_validator import apply_region_verdict, validate_ktp
+import metrics
+import preprocess
+# Models, engines, instruction and version are defined without the ADK (ocr.py)
+from ocr import EXTRACTION_INSTRUCTION, GEMINI_FLASH, GEMINI_PRO, resolve_engine
 
 load_dotenv()
 
@@ -29,13 +36,22 @@ os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = os.getenv("GOOGLE_GENAI_USE_VERTEXAI")
 
 from google.genai.types import HttpRetryOptions
 
-GEMINI_FLASH = "gemini-2.5-flash"
-GEMINI_PRO = "gemini-2.5-pro"
+# Tiered engine: Flash fields below this confidence are re-read by Pro...
+TIER_MIN_CONFIDENCE = float(os.getenv("OCR_TIER_MIN_CONFIDENCE", 0.8))
+# ...and with more uncertain fields than this, Pro re-reads the whole card
+TIER_DOCUMENT_FIELDS = int(os.getenv("OCR_TIER_DOCUMENT_FIELDS", 5))
 
+# Only call the search-grounded LLM validator when the local rules cannot decide
+LLM_VALIDATION_FALLBACK = os.getenv("KTP_VALIDATION_LLM_FALLBACK", "false").lower() in ("1", "true", "yes")
+
+# Kept short: sustained 429s are handled by admission control (admission.py),
+# which backs off every worker at once instead of each call sleeping on its own
 retry_config= HttpRetryOptions(
-    attempts=5,         # Maximum retry attempts
-    exp_base=7,         # Delay multiplier
+    attempts=3,         # Maximum retry attempts
+    exp_base=2,         # Delay multiplier
     initial_delay=1,    # Initial delay before first retry (in seconds)
+    max_delay=8,        # Cap on a single delay (in seconds)
+    jitter=1,           # Random extra delay so workers do not retry in lockstep
     http_status_codes=[
         429, # Too Many Requests
         500, # Internal Server Error
@@ -44,65 +60,44 @@ retry_config= HttpRetryOptions(
         ] # Retry on these HTTP errors
 )
 
-def validate_ktp_callback(
-    callback_context: CallbackContext, llm_response: LlmResponse
-) -> Optional[LlmResponse]:
+# Retries show up as ktp_genai_retries_total on /metrics
+metrics.count_genai_retries()
+
+def strip_code_fences(text: str) -> str:
+    """Removes a surrounding ```json ... ``` markdown block if the model added one."""
+    if "```json" in text:
+        return text.split("```json")[1].split("```")[0]
+    if "```" in text:
+        return text.split("```")[1].split("```")[0]
+    return text
+
+async def llm_validate_ktp(original_text: str) -> Optional[str]:
     """
-    Callback to validate and fix KTP data using an LLM.
-    Specifically enforces NIK format (16 digits) and Date format (DD-MM-YYYY).
+    Search-grounded check of the NIK region code, only used as a fallback
+    when the local rules cannot decide (see KTP_VALIDATION_LLM_FALLBACK).
+    Returns the model's JSON verdict as text, see validate_extraction.
     """
-    agent_name = callback_context.agent_name
-    print(f"[Callback] Validating KTP data for agent: {agent_name}")
-
-    # 1. Extract original text (which should be JSON)
-    original_text = ""
-    if llm_response.content and llm_response.content.parts:
-        if llm_response.content.parts[0].text:
-            original_text = llm_response.content.parts[0].text
-    
-    if not original_text:
-        return None
+    client = get_genai_client()
 
-    # 2. Use LLM to validate and fix the data
-    client = genai.Client()
-    
     # Construct prompt for the validation LLM
     prompt = f"""
     Anda adalah mesin validasi presisi tinggi untuk Kartu Tanda Penduduk (KTP) Indonesia.
 
-    Tanggal hari ini: {today_date}
-
-    Tinjau objek JSON di bawah ini dan validasi field 'nik' dan 'birth_date' menggunakan aturan berikut:
-
-    1. **Struktur NIK & Validasi Wilayah**:
-    - Field 'nik' harus terdiri dari tepat 16 digit.
-    - **Tindakan**: Gunakan Google Search untuk memverifikasi apakah 6 digit pertama
-        (Provinsi, Kabupaten/Kota, Kecamatan) sesuai dengan wilayah administratif yang valid di Indonesia.
-    - Digit 1-2: Provinsi | 3-4: Kabupaten/Kota | 5-6: Kecamatan.
-
-    2. **Pemeriksaan Silang NIK & Tanggal Lahir**:
-    - Digit ke-7 sampai ke-12 pada NIK merepresentasikan Tanggal Lahir dalam format [DDMMYY].
-    - **Aturan Jenis Kelamin**:
-        - Jika berjenis kelamin perempuan, nilai 'DD' (digit 7-8) ditambah 40.
-        Contoh: tanggal lahir 15 → 55.
-    - **Validasi**: Pastikan field 'birth_date' sesuai dengan 6 digit tengah NIK
-        setelah memperhitungkan aturan jenis kelamin.
+    Tinjau field 'nik' pada objek JSON di bawah ini. 6 digit pertama NIK adalah kode wilayah
+    Kemendagri: digit 1-2 Provinsi | 3-4 Kabupaten/Kota | 5-6 Kecamatan.
 
-    3. **Validasi Usia**:
-    - Hitung usia berdasarkan 'birth_date' dan Tanggal Hari Ini.
-    - **Aturan**: Jika usia < 17 tahun, maka data dinyatakan **TIDAK VALID**
-        dan harus ditandai sebagai invalid pada hasil JSON.
+    **Tindakan**: Gunakan Google Search untuk memverifikasi apakah kode wilayah tersebut
+    merupakan kecamatan yang valid di Indonesia.
 
-    4. **Format Data**:
-    - 'nik': String, 16 digit, tanpa spasi atau karakter khusus.
-    - 'birth_date': String dalam format 'YYYY-MM-DD'.
-    - Jika kode wilayah NIK, logika tanggal, atau usia tidak valid,
-        tandai atau perbaiki berdasarkan sumber paling tepercaya (hasil pencarian).
+    Jawab dengan objek JSON berikut:
+    - "region_valid": true jika kode wilayah terbukti valid, false jika terbukti tidak ada,
+      null jika hasil pencarian tidak cukup untuk memutuskan.
+    - "region": nama Kecamatan, Kabupaten/Kota dan Provinsi dari kode tersebut, atau null.
 
     Input JSON:
     {original_text}
 
-    Return ONLY the valid JSON string, no markdown formatting.
+    Return ONLY the JSON object, no markdown formatting.
     """
 
     tools = [types.Tool(google_search=types.GoogleSearch())]
@@ -114,35 +109,109 @@ def validate_ktp_callback(
     )
 
     try:        
-        response = client.models.generate_content(
+        await charge_model_call()
+        response = await client.aio.models.generate_content(
             model=GEMINI_FLASH,
             contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
             config=config
         )
-
         if response and response.text:
-            validated_json = response.text.strip()
-            
-            # Optional: Strip markdown code blocks if the LLM added them
-            if validated_json.startswith("```"):
-                validated_json = validated_json.strip("`").replace("json\n", "").strip()
-
-            print(f"[Callback] KTP Data validated and formatted.")
-            
-            # 3. Return modified response
-            modified_parts = [deepcopy(part) for part in llm_response.content.parts]
-            modified_parts[0].text = validated_json
-
-            return LlmResponse(
-                content=types.Content(role="model", parts=modified_parts),
-                grounding_metadata=llm_response.grounding_metadata
-            )
+            return strip_code_fences(response.text.strip()).strip()
     except Exception as e:
-        print(f"[Callback] Error during KTP validation: {e}")
-        return None 
+        print(f"[Callback] Error during LLM KTP validation: {e}")
+    return None
 
+# Set by before_model_callback, read when the response reaches validate_ktp_callback
+_model_call_started: ContextVar[Optional[float]] = ContextVar("model_call_started", default=None)
+
+async def mark_model_call_start(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    await charge_model_call()
+    _model_call_started.set(time.perf_counter())
     return None
 
+async def validate_ktp_callback(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    """
+    Callback to validate and normalize KTP data with the local rule engine
+    (ktp_validator). Enforces NIK format (16 digits, region prefix, DDMMYY
+    birth date), birth_date as YYYY-MM-DD and the minimum age, and attaches
+    the resulting flags under 'validation'. The search-grounded LLM check is
+    only used when KTP_VALIDATION_LLM_FALLBACK is enabled and the rules
+    cannot decide.
+    """
+    started = _model_call_started.get()
+    if started is not None:
+        metrics.OCR_STAGE_DURATION.labels("model_call").observe(time.perf_counter() - started)
+        _model_call_started.set(None)
+
+    with metrics.stage("validate_callback"):
+        return await _validate_ktp_response(callback_context, llm_response)
+
+async def _validate_ktp_response(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    agent_name = callback_context.agent_name
+    print(f"[Callback] Validating KTP data for agent: {agent_name}")
+
+    # 1. Extract original text (which should be JSON)
+    original_text = ""
+    if llm_response.content and llm_response.content.parts:
+        if llm_response.content.parts[0].text:
+            original_text = llm_response.content.parts[0].text
+    
+    if not original_text:
+        return None
+
+    try:
+        data = json.loads(strip_code_fences(original_text))
+    except ValueError as e:
+        print(f"[Callback] Extraction is not valid JSON, skipping validation: {e}")
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    # 2. Apply the rules and the optional LLM fallback
+    validated = await validate_extraction(data)
+
+    # 3. Return modified response
+    modified_parts = [deepcopy(part) for part in llm_response.content.parts]
+    modified_parts[0].text = json.dumps(validated, ensure_ascii=False)
+
+    return LlmResponse(
+        content=types.Content(role="model", parts=modified_parts),
+        grounding_metadata=llm_response.grounding_metadata
+    )
+
+async def validate_extraction(data: dict) -> dict:
+    """
+    Applies the local rules (and, if enabled, the LLM fallback) to an
+    extracted record and returns it with the report under 'validation'.
+    Shared by the ADK callback and the direct engine.
+    """
+    # 1. Apply the deterministic rules
+    validated, report = validate_ktp(data)
+    report['source'] = 'rules'
+
+    # 2. Optional LLM fallback for what the rules cannot settle (the region
+    # code); only an explicit true/false verdict decides the record
+    if not report['decided'] and LLM_VALIDATION_FALLBACK:
+        llm_text = await llm_validate_ktp(json.dumps(validated, ensure_ascii=False))
+        try:
+            verdict = json.loads(llm_text) if llm_text else None
+        except ValueError:
+            verdict = None
+        region_valid = verdict.get('region_valid') if isinstance(verdict, dict) else None
+        if isinstance(region_valid, bool):
+            report = apply_region_verdict(report, validated['nik'], region_valid, verdict.get('region'))
+            report['source'] = 'rules+llm'
+
+    validated['validation'] = report
+    print(f"[Callback] KTP Data validated (valid={report['valid']}, flags={len(report['flags'])}).")
+    return validated
+
 class KTPExtractionResult(BaseModel):
     nik: str = Field(description="Nomor Induk Kependudukan (16 digits)")
     full_name: str = Field(description="Nama lengkap (Full Name)")
@@ -167,50 +236,95 @@ extraction_agent = LlmAgent(
     ),
     name='extraction_agent',
     description='Asisten yang membantu mengekstrak data identitas terstruktur dari dokumen KTP Indonesia.',
-    instruction=(
-    "Anda adalah asisten OCR dan ekstraksi data yang ahli untuk Kartu Tanda Penduduk (KTP) Indonesia. "
-    "Tujuan Anda adalah mengekstrak field tertentu dari gambar atau teks KTP yang diberikan.\n\n"
-    "1. Analisis dokumen KTP yang disediakan.\n"
-    "2. Ekstrak field yang didefinisikan dalam skema output secara akurat.\n"
-    "3. **Tempat & Tanggal Lahir:** Di KTP, ini tertulis dalam satu baris (contoh: 'JAKARTA, 17-08-1945').\n"
-        "   - Anda WAJIB memisahkan teks ini.\n"
-        "   - Teks sebelum koma/angka adalah 'birth_place'.\n"
-        "   - Angka tanggal (DD-MM-YYYY) adalah 'birth_date'.\n"
-    "4. Pastikan tanggal diformat sebagai YYYY-MM-DD jika memungkinkan.\n"
-    "5. Isi dengan NULL jika informasi tidak tersedia atau tidak dapat diekstrak.\n"
-    "6. Field expiry_date harus SELALU diisi dengan 'SEUMUR HIDUP'.\n"
-    "7. Kembalikan HANYA objek JSON akhir yang sesuai dengan skema KTPExtractionResult."
-),
+    instruction=EXTRACTION_INSTRUCTION,
     output_schema=KTPExtractionResult,
     output_key='extraction_result',
+    before_model_callback=mark_model_call_start,
     after_model_callback=validate_ktp_callback
 )
 
 root_agent = extraction_agent
 
-session_service = InMemorySessionService()
+APP_NAME = "ktp_backend_ocr"
+
+# Sessions are deleted after each run; anything older than this is a leak and swept
+SESSION_TTL = int(os.getenv("OCR_SESSION_TTL", 600))
 
-async def process_document(file_bytes: bytes, mime_type: str, user_id: str = "system"):
+# One session service, runner and genai client per worker process. They are
+# used from the async_runtime background loop, so the HTTP connection pools
+# of the underlying clients survive across requests.
+session_service = InMemorySessionService()
+runner = Runner(agent=extraction_agent, app_name=APP_NAME, session_service=session_service)
+_active_sessions = {}
+
+_genai_client = None
+_genai_client_pid = None
+
+def get_genai_client() -> genai.Client:
+    """Returns the process-wide genai.Client, recreated after fork."""
+    global _genai_client, _genai_client_pid
+    if _genai_client is None or _genai_client_pid != os.getpid():
+        _genai_client = genai.Client()
+        _genai_client_pid = os.getpid()
+    return _genai_client
+
+def active_session_count() -> int:
+    return len(_active_sessions)
+
+async def _sweep_sessions():
+    cutoff = time.monotonic() - SESSION_TTL
+    for (user_id, session_id), started in list(_active_sessions.items()):
+        if started < cutoff:
+            _active_sessions.pop((user_id, session_id), None)
+            await session_service.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+
+async def process_document(file_bytes: bytes, mime_type: str, user_id: str = "system", engine: Optional[str] = None):
     """
-    Runs the ADK agent to extract data from the provided file bytes.
+    Extracts KTP data from the provided file bytes with the given engine
+    (OCR_ENGINE by default): 'adk' runs the ADK agent, 'direct' makes a
+    single structured-output call and 'tiered' escalates uncertain fields
+    from Flash to Pro. All return the same validated record.
     """
-    app_name = "ktp_backend_ocr"
-    session_id = f"{user_id}-{int(time.time())}"
-
-    # Ensure session exists
-    await session_service.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
-
-    runner = Runner(agent=extraction_agent, app_name=app_name, session_service=session_service)
-
+    engine = resolve_engine(engine)
+    try:
+        with metrics.OCR_IN_FLIGHT.track_inprogress():
+            if engine == "direct":
+                return await _run_direct(file_bytes, mime_type)
+            if engine == "tiered":
+                return await _run_tiered(file_bytes, mime_type)
+            return await _run_adk(file_bytes, mime_type, user_id)
+    except genai.errors.APIError as e:
+        metrics.count_genai_error(e)
+        raise
+
+async def _run_adk(file_bytes: bytes, mime_type: str, user_id: str):
+    """Runs the ADK agent. Each call gets its own session, which is deleted once the run finishes."""
+    await _sweep_sessions()
+    session_id = f"{user_id}-{uuid.uuid4().hex}"
+
+    await session_service.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    _active_sessions[(user_id, session_id)] = time.monotonic()
+    try:
+        return await _run_agent(file_bytes, mime_type, user_id, session_id)
+    finally:
+        _active_sessions.pop((user_id, session_id), None)
+        await session_service.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+
+async def _prompt_parts(file_bytes: bytes, mime_type: str) -> List[types.Part]:
     # Construct the prompt
     prompt_text = "Extract informasi identitas dari gambar KTP ini."
     parts = [types.Part(text=prompt_text)]
     
     if file_bytes and mime_type:
+        # Orientation fix, card crop, downscale and re-encode (process pool)
+        with metrics.stage("preprocess"):
+            file_bytes, mime_type = await preprocess.preprocess_document(file_bytes, mime_type)
         file_part = types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
         parts.append(file_part)
+    return parts
 
-    content = types.Content(role='user', parts=parts)
+async def _run_agent(file_bytes: bytes, mime_type: str, user_id: str, session_id: str):
+    content = types.Content(role='user', parts=await _prompt_parts(file_bytes, mime_type))
 
     # Run Agent
     events = runner.run_async(user_id=user_id, session_id=session_id, new_message=content)
@@ -220,17 +334,179 @@ async def process_document(file_bytes: bytes, mime_type: str, user_id: str = "sy
     async for event in events:
         if event.is_final_response():
             try:
-                import json
-                text_response = event.content.parts[0].text
-                # Clean markdown code blocks if present
-                if "```json" in text_response:
-                    text_response = text_response.split("```json")[1].split("```")[0]
-                elif "```" in text_response:
-                    text_response = text_response.split("```")[1].split("```")[0]
-                
-                final_json = json.loads(text_response)
+                with metrics.stage("parse"):
+                    text_response = event.content.parts[0].text
+                    # Clean markdown code blocks if present
+                    text_response = strip_code_fences(text_response)
+                    
+                    final_json = json.loads(text_response)
             except Exception as e:
                 print(f"Error parsing JSON: {e}")
                 final_json = {"error": "Failed to parse agent response"}
 
-    return final_json
\ No newline at end of file
+    return final_json
+
+# The direct engine: the agent's instruction and output schema in one
+# generate_content call, in native JSON mode, without Runner, sessions or events
+_direct_config = types.GenerateContentConfig(
+    system_instruction=extraction_agent.instruction,
+    response_mime_type="application/json",
+    response_schema=KTPExtractionResult,
+    http_options=types.HttpOptions(retry_options=retry_config)
+)
+
+async def _run_direct(file_bytes: bytes, mime_type: str):
+    parts = await _prompt_parts(file_bytes, mime_type)
+    data = await _generate_json(GEMINI_FLASH, parts, _direct_config)
+    if data is None:
+        return {"error": "Failed to parse model response"}
+
+    with metrics.stage("validate_callback"):
+        return await validate_extraction(data)
+
+async def _generate_json(model: str, parts: List[types.Part], config: types.GenerateContentConfig) -> Optional[dict]:
+    """One structured-output call; the JSON object it returned, or None."""
+    await charge_model_call()
+    with metrics.stage("model_call"):
+        response = await get_genai_client().aio.models.generate_content(
+            model=model,
+            contents=[types.Content(role='user', parts=parts)],
+            config=config
+        )
+
+    with metrics.stage("parse"):
+        if isinstance(response.parsed, config.response_schema):
+            return response.parsed.model_dump()
+        # Fields the model returned as null fail the schema's str types
+        try:
+            data = json.loads(response.text or "")
+        except ValueError as e:
+            print(f"Error parsing JSON: {e}")
+            return None
+        return data if isinstance(data, dict) else None
+
+# The tiered engine: Flash also rates how sure it is of every field, and the
+# fields it is unsure of or that fail the local rules are re-read by Pro with
+# a prompt narrowed to just those fields (the whole card if there are many)
+KTPFieldConfidence = create_model(
+    "KTPFieldConfidence",
+    **{name: (float, Field(description=f"Keyakinan 0-1 untuk '{name}'")) for name in KTPExtractionResult.model_fields}
+)
+
+class KTPTieredResult(KTPExtractionResult):
+    confidence: KTPFieldConfidence = Field(
+        description="Seberapa yakin Anda (0-1) setiap field terbaca dengan benar; rendah jika buram, terpotong atau tertutup"
+    )
+
+_tiered_config = _direct_config.model_copy(update={"response_schema": KTPTieredResult})
+
+# Rule flags that point at a misread, and the fields to re-read for each
+_ESCALATION_FLAGS = {
+    "NIK_FORMAT": ("nik",),
+    "NIK_PROVINCE": ("nik",),
+    "NIK_REGION": ("nik",),
+    "NIK_REGENCY": ("nik",),
+    "NIK_DISTRICT": ("nik",),
+    "NIK_SERIAL": ("nik",),
+    "NIK_BIRTH_DATE": ("nik",),
+    "NIK_BIRTH_DATE_MISMATCH": ("nik", "birth_date"),
+    "NIK_GENDER_MISMATCH": ("nik", "gender"),
+    "BIRTH_DATE_FORMAT": ("birth_date",),
+    "BIRTH_DATE_FROM_NIK": ("birth_date",),
+    "BIRTH_DATE_FUTURE": ("birth_date",),
+    "AGE_UNDER_17": ("birth_date",),
+    "RT_RW_FORMAT": ("rt_rw",),
+}
+
+def uncertain_fields(data: dict, confidence: Optional[dict] = None) -> dict:
+    """
+    The fields of a Flash extraction worth a second read, each with the
+    reasons: a confidence below TIER_MIN_CONFIDENCE or a rule flag.
+    """
+    reasons = {}
+    for name, score in (confidence or {}).items():
+        if name in KTPExtractionResult.model_fields and isinstance(score, (int, float)) and score < TIER_MIN_CONFIDENCE:
+            reasons.setdefault(name, []).append(f"keyakinan {score:.2f}")
+    _, report = validate_ktp(data)
+    for flag in report["flags"]:
+        for name in _ESCALATION_FLAGS.get(flag["code"], ()):
+            reasons.setdefault(name, []).append(flag["message"])
+    return reasons
+
+def _reread_parts(parts: List[types.Part], data: dict, reasons: dict) -> List[types.Part]:
+    lines = "\n".join(
+        f"- {name}: {json.dumps(data.get(name), ensure_ascii=False)} ({'; '.join(why)})"
+        for name, why in reasons.items()
+    )
+    prompt = (
+        "Ekstraksi sebelumnya meragukan untuk field berikut. Baca ulang HANYA field ini "
+        "dari gambar KTP dengan teliti dan kembalikan nilai yang tertulis di kartu:\n" + lines
+    )
+    return [types.Part(text=prompt)] + parts[1:]
+
+def _reread_config(names) -> types.GenerateContentConfig:
+    schema = create_model(
+        "KTPReread", **{name: (str, KTPExtractionResult.model_fields[name]) for name in names}
+    )
+    return _direct_config.model_copy(update={"response_schema": schema})
+
+async def _run_tiered(file_bytes: bytes, mime_type: str):
+    # Preprocessed once, the Pro call sends the same image
+    parts = await _prompt_parts(file_bytes, mime_type)
+
+    started = time.perf_counter()
+    data = await _generate_json(GEMINI_FLASH, parts, _tiered_config)
+    metrics.OCR_TIER_DURATION.labels("flash").observe(time.perf_counter() - started)
+
+    reasons = {}
+    if data is not None:
+        confidence = data.pop("confidence", None)
+        reasons = uncertain_fields(data, confidence if isinstance(confidence, dict) else None)
+
+    scope = "none"
+    if data is None or len(reasons) > TIER_DOCUMENT_FIELDS:
+        scope = "document"
+        started = time.perf_counter()
+        data = await _generate_json(GEMINI_PRO, parts, _direct_config)
+        metrics.OCR_TIER_DURATION.labels("pro").observe(time.perf_counter() - started)
+    elif reasons:
+        scope = "fields"
+        started = time.perf_counter()
+        reread = await _generate_json(GEMINI_PRO, _reread_parts(parts, data, reasons), _reread_config(reasons))
+        metrics.OCR_TIER_DURATION.labels("pro").observe(time.perf_counter() - started)
+        # Keep Flash's value for anything Pro could not read either
+        data.update({name: value for name, value in (reread or {}).items() if name in reasons and value})
+
+    metrics.OCR_ESCALATIONS.labels(scope).inc()
+    for name in reasons:
+        metrics.OCR_ESCALATED_FIELDS.labels(name).inc()
+    if data is None:
+        return {"error": "Failed to parse model response"}
+
+    with metrics.stage("validate_callback"):
+        validated = await validate_extraction(data)
+    validated["validation"]["escalation"] = {"scope": scope, "fields": sorted(reasons)}
+    return validated
+
+async def stream_extraction(file_bytes: bytes, mime_type: str):
+    """
+    Text chunks of a direct-engine extraction as the model streams them
+    (JSON, not yet validated; see ocr_stream.py).
+    """
+    content = types.Content(role='user', parts=await _prompt_parts(file_bytes, mime_type))
+    try:
+        with metrics.OCR_IN_FLIGHT.track_inprogress():
+            await charge_model_call()
+            stream = await get_genai_client().aio.models.generate_content_stream(
+                model=GEMINI_FLASH,
+                contents=[content],
+                config=_direct_config
+            )
+            async for chunk in stream:
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+                    text = "".join(part.text or "" for part in chunk.candidates[0].content.parts)
+                    if text:
+                        yield text
+    except genai.errors.APIError as e:
+        metrics.count_genai_error(e)
+        raise
@@ -1,19 +1,56 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+from sqlalchemy import text
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import or_
 import jwt
 import datetime
-import asyncio
-from functools import wraps
+import itertools
+import os
+import tempfile
+import time
+import click
+from functools import partial, wraps
 from config import Config
-from models import db, KtpRecord, User
-from agent import process_document
+import async_runtime
+import metrics
+from models import db, KtpRecord, User, apply_ktp_update, parse_ktp_payload, upsert_ktp_records
+from ocr import ENGINES, EXTRACTION_VERSION, AgentLoader
+from admission import BATCH, GeminiAdmission, SaturatedError
+from extraction_cache import ExtractionCache
+from documents import DocumentError, DocumentSplitter
+from ktp_cache import KtpRecordCache, cache_headers, not_modified, validators
+from jobs import OcrJobQueue, QueueFullError
+from batch import BatchError, collect_batch_items, stream_batch
+import ocr_stream
+from pagination import (CursorError, apply_cursor, apply_order, cursor_values, decode_cursor,
+                        encode_cursor, estimated_count, estimated_total, key_fields, sort_keys)
+from search import apply_search
+from serialization import KTP_FIELDS, OrjsonProvider, parse_fields, projection, row_to_dict, rows_to_dicts
+from export import EXPORT_FORMATS, apply_ktp_filters, stream_export
+from ktp_import import ImportFileError, KtpImporter, detect_format, validate_row
+from ktp_validator import get_region_index
+from stats import KtpStatsFolder, ktp_stats, rebuild_ktp_stats
+from replication import ReplicaRouter
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = OrjsonProvider(app)
 CORS(app)
+metrics.Metrics(app)
 db.init_app(app)
+replica_router = ReplicaRouter(app, db)
+gemini_admission = GeminiAdmission(app)
+# agent.py is imported on first use or as OCR_AGENT_LOAD says (ocr.py)
+ocr_agent = AgentLoader(app)
+ocr_cache = ExtractionCache(app, process=gemini_admission.wrap(ocr_agent.process_document), version=EXTRACTION_VERSION)
+ocr_documents = DocumentSplitter(app, process=ocr_cache.process_document)
+# Jobs and batches yield to single extractions when Gemini capacity is short
+ocr_jobs = OcrJobQueue(app, process=GeminiAdmission.prioritized(ocr_documents.process_document, BATCH))
+ktp_importer = KtpImporter(app)
+ktp_cache = KtpRecordCache(app)
+ktp_stats_folder = KtpStatsFolder(app)
+# Loaded now (in the master with preload) so a missing table shows up at startup, not on the first extraction
+get_region_index(required=app.config['KTP_REGION_TABLE_REQUIRED'])
 
 def token_required(f):
     @wraps(f)
@@ -27,7 +64,9 @@ def token_required(f):
         
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            g.current_user_id = data['user_id'] # Read-your-writes routing (replication.py)
             current_user = User.query.filter_by(id=data['user_id']).first()
+            g.user_last_write_at = current_user.last_write_at if current_user else None
         except:
             return jsonify({'message': 'Token is invalid!'}), 401
         
@@ -73,125 +112,412 @@ def get_all_ktp(current_user):
     # Server-side processing for DataTables
     draw = request.args.get('draw', type=int)
     
+    # Column projection: ?fields=nik,full_name,... (default: every to_dict field)
+    try:
+        fields = parse_fields(request.args.get('fields', type=str))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     # If not a DataTables request, fall back to simple list (backward compatibility)
+    # Loads every row at once; use /api/ktp/export for large tables
     if draw is None:
-        ktp_records = KtpRecord.query.all()
-        output = [ktp.to_dict() for ktp in ktp_records]
-        return jsonify({'ktp_records': output})
+        ktp_records = db.session.query(*projection(fields)).all()
+        return jsonify({'ktp_records': rows_to_dicts(fields, ktp_records)})
 
     start = request.args.get('start', type=int, default=0)
     length = request.args.get('length', type=int, default=10)
     search_value = request.args.get('search[value]', type=str, default='')
-    
-    # Base query
-    query = KtpRecord.query
-    total_records = query.count()
-    
-    # Search/Filtering
-    if search_value:
-        search_pattern = f"%{search_value}%"
-        query = query.filter(or_(
-            KtpRecord.full_name.ilike(search_pattern),
-            KtpRecord.nik.ilike(search_pattern),
-            KtpRecord.address.ilike(search_pattern)
-        ))
-    
-    filtered_records = query.count()
-    
-    # Sorting
-    # Handle DataTables ordering
+    # Keyset mode: ?pagination=keyset for the first page, then ?cursor=<next_cursor>
+    cursor = request.args.get('cursor', type=str)
+    keyset = cursor is not None or request.args.get('pagination') == 'keyset'
+    exact_count = request.args.get('exact_count', type=str, default='').lower() in ('1', 'true', 'yes')
+    exact_below = float('inf') if exact_count else app.config['LISTING_EXACT_COUNT_BELOW']
+    # Handle DataTables ordering (column index -> field mapping lives in pagination.SORT_COLUMNS)
     order_column_index = request.args.get('order[0][column]', type=int)
     order_dir = request.args.get('order[0][dir]', type=str)
+    keys = sort_keys(order_column_index, order_dir)
     
-    # Map column index to model field (adjust indices based on frontend table columns)
-    # 0: nik, 1: full_name, 2: gender, 3: birth_date, 4: address
-    columns = [KtpRecord.nik, KtpRecord.full_name, KtpRecord.gender, KtpRecord.birth_date, KtpRecord.address]
+    # Base query: plain rows of the projected columns (plus the sort keys the next cursor needs)
+    query = db.session.query(*projection(fields, extra=key_fields(keys) if keyset else ()))
+    total_records = estimated_total(exact_below)
     
-    if order_column_index is not None and 0 <= order_column_index < len(columns):
-        order_col = columns[order_column_index]
-        if order_dir == 'desc':
-            query = query.order_by(order_col.desc())
-        else:
-            query = query.order_by(order_col.asc())
+    # Search/Filtering (routed to NIK prefix, trigram or full-text, see search.py)
+    query, ranking = apply_search(query, search_value)
+    if ranking is not None:
+        filtered_records = estimated_count(query, exact_below)
+    else:
+        filtered_records = total_records
+    
+    # Sorting
+    if ranking is not None and order_column_index is None and not keyset:
+        # No explicit column order: most relevant matches first
+        query = query.order_by(*ranking)
     else:
-        # Default sort (Deterministic)
-        query = query.order_by(KtpRecord.updated_at.desc(), KtpRecord.nik.asc())
+        query = apply_order(query, keys)
     
     # Pagination
+    if keyset and cursor:
+        try:
+            query = apply_cursor(query, keys, decode_cursor(keys, cursor))
+        except CursorError as e:
+            return jsonify({'message': str(e)}), 400
+    elif start and not keyset:
+        query = query.offset(start)
     if length != -1: # -1 means show all
-        query = query.offset(start).limit(length)
+        query = query.limit(length)
     
     ktp_records = query.all()
-    data = [ktp.to_dict() for ktp in ktp_records]
+    data = rows_to_dicts(fields, ktp_records)
     
-    return jsonify({
+    response = {
         'draw': draw,
         'recordsTotal': total_records,
         'recordsFiltered': filtered_records,
         'data': data
-    })
+    }
+    if keyset:
+        has_more = length != -1 and len(ktp_records) == length
+        response['next_cursor'] = encode_cursor(keys, cursor_values(keys, ktp_records[-1])) if has_more else None
+    return jsonify(response)
+
+@app.route('/api/ktp/export', methods=['GET'])
+@token_required
+def export_ktp(current_user):
+    # Streams all matching records as NDJSON or CSV (?format=, ?fields=, filters in export.apply_ktp_filters)
+    fmt = request.args.get('format', type=str, default='ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'message': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        fields = parse_fields(request.args.get('fields', type=str))
+        apply_ktp_filters(KtpRecord.query, request.args)   # Validate before the response starts
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    chunks = stream_export(fields, request.args.to_dict(), fmt=fmt, chunk_rows=app.config['EXPORT_CHUNK_ROWS'],
+                           max_seconds=app.config['EXPORT_MAX_SECONDS'])
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename=ktp_records.{fmt}'}
+    )
+
+@app.route('/api/ktp/stats', methods=['GET'])
+@token_required
+def get_ktp_stats(current_user):
+    # Dashboard counts from the trigger-maintained ktp_stats summary (stats.py):
+    # ?district=&village= scope them, ?dimensions=gender,age,... picks breakdowns
+    limit = request.args.get('limit', type=int, default=100)
+    try:
+        stats = ktp_stats(request.args, limit=max(1, limit))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(stats)
+
+@app.route('/api/ktp/import', methods=['POST'])
+@token_required
+def import_ktp(current_user):
+    # Bulk upsert from a CSV/NDJSON 'file' part; runs in the background, poll status_url for progress
+    if 'file' not in request.files:
+        return jsonify({'message': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'message': 'No selected file'}), 400
+    try:
+        fmt = detect_format(file.filename, request.args.get('format', type=str))
+    except ImportFileError as e:
+        return jsonify({'message': str(e)}), 400
+
+    # The upload is spooled to disk so the import can outlive the request
+    fd, path = tempfile.mkstemp(prefix='ktp-import-', suffix=f'.{fmt}')
+    with os.fdopen(fd, 'wb') as f:
+        file.save(f)
+    try:
+        job = ktp_importer.start(path, fmt, user_id=current_user.id, filename=file.filename)
+    except Exception as e:
+        db.session.rollback()
+        os.remove(path)
+        return jsonify({'message': str(e)}), 500
+    return jsonify({
+        'import_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/ktp/import/{job.id}'
+    }), 202
+
+@app.route('/api/ktp/import/<import_id>', methods=['GET'])
+@token_required
+def get_ktp_import(current_user, import_id):
+    job = ktp_importer.get(import_id, current_user.id)
+    if not job:
+        return jsonify({'message': 'No import found!'}), 404
+    return jsonify({'import': job.to_dict()})
 
 @app.route('/api/ktp/<nik>', methods=['GET'])
 @token_required
 def get_one_ktp(current_user, nik):
-    ktp = KtpRecord.query.filter_by(nik=nik).first()
-    if not ktp:
-        return jsonify({'message': 'No KTP found!'}), 404
-    return jsonify({'ktp_record': ktp.to_dict()})
+    try:
+        fields = parse_fields(request.args.get('fields', type=str))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Read-through cache of the full row; any projection is cut from it
+    ktp = ktp_cache.get(nik)
+    if ktp is None:
+        read_at = time.time()
+        row = db.session.query(*projection(KTP_FIELDS)).filter(KtpRecord.nik == nik).first()
+        if not row:
+            return jsonify({'message': 'No KTP found!'}), 404
+        ktp = row_to_dict(KTP_FIELDS, row)
+        ktp_cache.put(nik, ktp, read_at)
+    
+    # Conditional GET: answer If-None-Match / If-Modified-Since before serializing anything
+    etag, last_modified = validators(ktp, fields)
+    headers = cache_headers(etag, last_modified)
+    if not_modified(etag, last_modified, request.headers.get('If-None-Match'),
+                    request.headers.get('If-Modified-Since')):
+        ktp_cache.count_not_modified()
+        return Response(status=304, headers=headers)
+    return jsonify({'ktp_record': {f: ktp[f] for f in fields}}), 200, headers
 
 @app.route('/api/ocr/extract', methods=['POST'])
 @token_required
 def extract_ktp_data(current_user):
-    if 'file' not in request.files:
+    # The multipart body is read off the socket when request.files is first touched
+    with metrics.stage('upload_read'):
+        file = request.files.get('file')
+        file_bytes = file.read() if file else None
+    if file is None:
         return jsonify({'message': 'No file part'}), 400
     
-    file = request.files['file']
     if file.filename == '':
         return jsonify({'message': 'No selected file'}), 400
 
+    # Extraction engine (ocr.ENGINES), OCR_ENGINE when not given
+    engine = request.args.get('engine')
+    if engine is not None and engine not in ENGINES:
+        return jsonify({'message': f"engine must be one of: {', '.join(ENGINES)}"}), 400
+
     if file:
+        # Job mode: queue the upload and return immediately with a job id
+        if request.args.get('mode') == 'job':
+            try:
+                job = ocr_jobs.submit(
+                    file_bytes=file_bytes,
+                    mime_type=file.mimetype,
+                    user_id=current_user.id,
+                    filename=file.filename,
+                    engine=engine
+                )
+            except QueueFullError as e:
+                return jsonify({'message': str(e)}), 503
+            return jsonify({
+                'message': 'Extraction queued',
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/api/ocr/jobs/{job.id}'
+            }), 202
+
         try:
-            # Read file into bytes
-            file_bytes = file.read()
             mime_type = file.mimetype
 
-
-            extracted_data = asyncio.run(process_document(
+            # PDFs and TIFFs with several cards come back as {'pages', 'cards'} (documents.py)
+            extracted_data = async_runtime.run(ocr_documents.process_document(
                 file_bytes=file_bytes, 
                 mime_type=mime_type, 
-                user_id=str(current_user.id)
+                user_id=str(current_user.id),
+                engine=engine
             ))
             
             return jsonify({'message': 'Extraction successful', 'data': extracted_data})
+        except DocumentError as e:
+            return jsonify({'message': str(e)}), 400
+        except SaturatedError as e:
+            return jsonify({'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
         except Exception as e:
             return jsonify({'message': f'Processing error: {str(e)}'}), 500
 
+@app.route('/api/ocr/extract/stream', methods=['POST'])
+@token_required
+def extract_ktp_stream(current_user):
+    # Same upload as /api/ocr/extract; fields arrive as Server-Sent Events (ocr_stream.py)
+    with metrics.stage('upload_read'):
+        file = request.files.get('file')
+        file_bytes = file.read() if file else None
+    if file is None:
+        return jsonify({'message': 'No file part'}), 400
+    if file.filename == '':
+        return jsonify({'message': 'No selected file'}), 400
+    try:
+        # One record per stream: multi-card PDFs and TIFFs go through /api/ocr/extract
+        async_runtime.run(ocr_documents.check_single_card(file_bytes, file.mimetype))
+    except DocumentError as e:
+        return jsonify({'message': str(e)}), 400
+
+    events = ocr_stream.extraction_events(file_bytes, file.mimetype, ocr_agent, cache=ocr_cache, admission=gemini_admission)
+    lines = ocr_stream.iterate_sync(ocr_stream.sse_events(events), async_runtime.submit)
+    try:
+        # Admission and the first field happen before the response starts
+        first = next(lines)
+    except SaturatedError as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        return jsonify({'message': f'Processing error: {str(e)}'}), 500
+    return Response(
+        stream_with_context(itertools.chain([first], lines)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/ocr/extract/batch', methods=['POST'])
+@token_required
+def extract_ktp_batch(current_user):
+    # Accepts several 'file' parts and/or zip archives, streams one NDJSON line per file (PDF/TIFF cards in 'cards')
+    files = request.files.getlist('file')
+    if not files:
+        return jsonify({'message': 'No file part'}), 400
+
+    try:
+        items = collect_batch_items(files, max_files=app.config['OCR_BATCH_MAX_FILES'],
+                                    max_bytes=app.config['OCR_BATCH_MAX_BYTES'])
+    except BatchError as e:
+        return jsonify({'message': str(e)}), 400
+    if not items:
+        return jsonify({'message': 'No selected file'}), 400
+
+    save = request.args.get('save', type=str, default='').lower() in ('1', 'true', 'yes')
+    concurrency = request.args.get('concurrency', type=int, default=app.config['OCR_BATCH_CONCURRENCY'])
+    concurrency = max(1, min(concurrency, app.config['OCR_BATCH_CONCURRENCY']))
+    engine = request.args.get('engine')
+    if engine is not None and engine not in ENGINES:
+        return jsonify({'message': f"engine must be one of: {', '.join(ENGINES)}"}), 400
+
+    lines = stream_batch(
+        items,
+        submit=async_runtime.submit,
+        process=GeminiAdmission.prioritized(partial(ocr_documents.process_document, engine=engine), BATCH),
+        user_id=str(current_user.id),
+        concurrency=concurrency,
+        max_rps=app.config['OCR_BATCH_MAX_RPS'],
+        save=_save_batch_results if save else None,
+        timeout=app.config['OCR_BATCH_ITEM_TIMEOUT']
+    )
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+def _save_batch_results(results):
+    """
+    Upserts successful batch extractions into ktp_records, every card of a
+    multi-card document on its own. Rows are checked against the column
+    constraints first (ktp_import.validate_row); if the upsert still fails,
+    every row is retried in its own savepoint so one bad row only skips itself.
+    """
+    cards = []
+    for index, data in results:
+        if 'cards' in data:
+            cards.extend(({'index': index, 'page': card['page'], 'card': card['card']}, card['data'])
+                         for card in data['cards'])
+        else:
+            cards.append(({'index': index}, data))
+
+    rows, skipped = [], []
+    for key, data in cards:
+        if 'error' in data:
+            skipped.append(dict(key, message=data['error']))
+        elif (data.get('validation') or {}).get('valid') is False:
+            skipped.append(dict(key, message='Validation failed'))
+        else:
+            try:
+                rows.append((key, validate_row(data)))
+            except ValueError as e:
+                skipped.append(dict(key, message=str(e)))
+
+    try:
+        saved = upsert_ktp_records([row for _, row in rows])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Batch] Upsert of {len(rows)} rows failed, saving row by row: {e}")
+        saved, failed = 0, set()
+        for i, (key, row) in enumerate(rows):
+            try:
+                with db.session.begin_nested():
+                    upsert_ktp_records([row])
+                saved += 1
+            except Exception as e:
+                failed.add(i)
+                skipped.append(dict(key, message=str(getattr(e, 'orig', None) or e)))
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return {'saved': 0, 'save_error': str(e), 'save_skipped': skipped}
+        rows = [entry for i, entry in enumerate(rows) if i not in failed]
+
+    ktp_cache.invalidate(*[row['nik'] for _, row in rows])
+    skipped.sort(key=lambda item: (item['index'], item.get('page', 0), item.get('card', 0)))
+    return {'saved': saved, 'save_skipped': skipped}
+
+@app.route('/api/ocr/cache/stats', methods=['GET'])
+@token_required
+def get_ocr_cache_stats(current_user):
+    return jsonify({'cache': ocr_cache.stats(), 'admission': gemini_admission.stats()})
+
+@app.route('/api/db/stats', methods=['GET'])
+@token_required
+def get_db_stats(current_user):
+    # Per-bind statement counters, read routing decisions and replica lag for this worker
+    return jsonify({'db': replica_router.stats(), 'ktp_cache': ktp_cache.stats()})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the worker answers; no database or agent calls
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: every bind answers SELECT 1. Only the primary is required,
+    # reads fall back to it when replicas are down (replication.py)
+    binds = {}
+    for bind, engine in db.engines.items():
+        try:
+            with engine.connect().execution_options(replica_probe=True) as conn:
+                conn.execute(text('SELECT 1'))
+            binds[bind or 'primary'] = 'ok'
+        except Exception as e:
+            binds[bind or 'primary'] = str(e).strip().splitlines()[0]
+    ready = binds.get('primary') == 'ok'
+    return jsonify({'status': 'ok' if ready else 'unavailable', 'db': binds}), 200 if ready else 503
+
+@app.route('/api/ocr/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_ocr_job(current_user, job_id):
+    # Optional long-poll: ?wait=<seconds> blocks until the job finishes
+    wait = request.args.get('wait', type=float, default=0)
+    if wait > 0:
+        job = ocr_jobs.wait(job_id, current_user.id, timeout=min(wait, app.config['OCR_JOB_MAX_WAIT']))
+    else:
+        job = ocr_jobs.get(job_id, current_user.id)
+    if not job:
+        return jsonify({'message': 'No OCR job found!'}), 404
+    return jsonify({'job': job.to_dict()})
+
+@app.route('/api/ocr/jobs/<job_id>/wait', methods=['GET'])
+@token_required
+def wait_ocr_job(current_user, job_id):
+    timeout = request.args.get('timeout', type=float, default=app.config['OCR_JOB_MAX_WAIT'])
+    job = ocr_jobs.wait(job_id, current_user.id, timeout=min(timeout, app.config['OCR_JOB_MAX_WAIT']))
+    if not job:
+        return jsonify({'message': 'No OCR job found!'}), 404
+    return jsonify({'job': job.to_dict()})
+
 @app.route('/api/ktp', methods=['POST'])
 @token_required
 def create_ktp(current_user):
     data = request.get_json()
     
     try:
-        new_ktp = KtpRecord(
-            nik=data['nik'],
-            full_name=data['full_name'],
-            birth_place=data['birth_place'],
-            birth_date=datetime.datetime.strptime(data['birth_date'], '%Y-%m-%d').date(),
-            gender=data.get('gender'),
-            blood_type=data.get('blood_type'),
-            address=data['address'],
-            rt_rw=data.get('rt_rw'),
-            village_kelurahan=data.get('village_kelurahan'),
-            district_kecamatan=data.get('district_kecamatan'),
-            religion=data.get('religion'),
-            marital_status=data.get('marital_status'),
-            occupation=data.get('occupation'),
-            citizenship=data.get('citizenship', 'WNI'),
-            expiry_date=data.get('expiry_date', 'SEUMUR HIDUP'),
-            registration_date=datetime.datetime.strptime(data['registration_date'], '%Y-%m-%d').date() if data.get('registration_date') else None
-        )
+        new_ktp = KtpRecord(**parse_ktp_payload(data))
         db.session.add(new_ktp)
         db.session.commit()
+        ktp_cache.invalidate(new_ktp.nik)
         return jsonify({'message': 'KTP record created!', 'ktp_record': new_ktp.to_dict()}), 201
     except Exception as e:
         db.session.rollback()
@@ -207,26 +533,9 @@ def update_ktp(current_user, nik):
     data = request.get_json()
     
     try:
-        ktp.full_name = data.get('full_name', ktp.full_name)
-        ktp.birth_place = data.get('birth_place', ktp.birth_place)
-        if 'birth_date' in data:
-            ktp.birth_date = datetime.datetime.strptime(data['birth_date'], '%Y-%m-%d').date()
-        ktp.gender = data.get('gender', ktp.gender)
-        ktp.blood_type = data.get('blood_type', ktp.blood_type)
-        ktp.address = data.get('address', ktp.address)
-        ktp.rt_rw = data.get('rt_rw', ktp.rt_rw)
-        ktp.village_kelurahan = data.get('village_kelurahan', ktp.village_kelurahan)
-        ktp.district_kecamatan = data.get('district_kecamatan', ktp.district_kecamatan)
-        ktp.religion = data.get('religion', ktp.religion)
-        ktp.marital_status = data.get('marital_status', ktp.marital_status)
-        ktp.occupation = data.get('occupation', ktp.occupation)
-        ktp.citizenship = data.get('citizenship', ktp.citizenship)
-        ktp.expiry_date = data.get('expiry_date', ktp.expiry_date)
-        if 'registration_date' in data:
-            val = data['registration_date']
-            ktp.registration_date = datetime.datetime.strptime(val, '%Y-%m-%d').date() if val else None
-        
+        apply_ktp_update(ktp, data)
         db.session.commit()
+        ktp_cache.invalidate(nik)
         return jsonify({'message': 'KTP record updated!', 'ktp_record': ktp.to_dict()})
     except Exception as e:
         db.session.rollback()
@@ -241,8 +550,36 @@ def delete_ktp(current_user, nik):
     
     db.session.delete(ktp)
     db.session.commit()
+    ktp_cache.invalidate(nik)
     return jsonify({'message': 'KTP record deleted!'})
 
+@app.cli.command('import-ktp')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension')
+def import_ktp_command(path, fmt):
+    """Bulk upsert KTP records from a CSV or NDJSON file."""
+    try:
+        fmt = detect_format(path, fmt)
+    except ImportFileError as e:
+        raise click.UsageError(str(e))
+
+    def progress(summary):
+        click.echo(f"{summary['progress']:6.1%}  {summary['rows_processed']} rows, {summary['inserted']} inserted, "
+                   f"{summary['updated']} updated, {summary['failed']} failed")
+
+    try:
+        summary = ktp_importer.run(path, fmt, progress=progress)
+    except ImportFileError as e:
+        raise click.ClickException(str(e))
+    for error in summary['errors']:
+        click.echo(f"line {error['line']}: {error['message']}", err=True)
+
+@app.cli.command('rebuild-ktp-stats')
+def rebuild_ktp_stats_command():
+    """Installs the ktp_stats triggers and recomputes the summary from ktp_records."""
+    total = rebuild_ktp_stats()
+    click.echo(f"ktp_stats rebuilt from {total} records")
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
@@ -0,0 +1,450 @@
+"""
+ASGI serving mode.
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 asgi:app            # :8005, gunicorn.conf.py
+    uvicorn asgi:app --port 5000                      # local
+
+The hot routes are served natively on the event loop with the same URLs and
+JSON contract as app.py: /auth/login, /auth/register, /api/ktp (listing and
+create), /api/ktp/<nik> (get, update, delete), /api/ocr/extract and
+/api/ocr/extract/stream.
+KTP reads and writes use asyncpg pools (async_db.py), routed by the same
+ReplicaRouter as the sync app, and OCR requests await the agent directly
+on the server loop, so a worker holds hundreds of slow extractions without
+a thread each. Every other route is passed through to the Flask app.
+"""
+import asyncio
+import contextlib
+import datetime
+import time
+from functools import wraps
+
+import jwt
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import async_runtime
+import metrics
+import ocr_stream
+from admission import SaturatedError
+from documents import DocumentError
+from app import (app as flask_app, gemini_admission, ktp_cache, ktp_stats_folder, ocr_agent, ocr_cache,
+                 ocr_documents, ocr_jobs, replica_router)
+from async_db import AsyncDatabase
+from jobs import QueueFullError
+from ktp_cache import cache_headers, not_modified, validators
+from models import KtpRecord, User, apply_ktp_update, parse_ktp_payload, user_wrote
+from ocr import ENGINES
+from pagination import (CursorError, apply_cursor, apply_order, cursor_values, decode_cursor,
+                        encode_cursor, estimated_count_async, estimated_total_async, key_fields, sort_keys)
+from replication import LAST_WRITE_COOKIE
+from search import apply_search
+from serialization import KTP_FIELDS, dumps, parse_fields, projection, row_to_dict, rows_to_dicts
+
+async_db = AsyncDatabase(flask_app)
+flask_asgi = WSGIMiddleware(flask_app)
+
+
+class OrjsonResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def _json(payload, status=200, headers=None):
+    # Same CORS policy as CORS(app) in app.py
+    return OrjsonResponse(payload, status_code=status, headers={'Access-Control-Allow-Origin': '*', **(headers or {})})
+
+
+def _arg(request, name, type=str, default=None):
+    # Like Flask's request.args.get(name, type=..., default=...)
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        return type(value)
+    except ValueError:
+        return default
+
+
+async def _body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def _route(path, endpoint, methods):
+    # Same request metrics as the Flask hooks, labelled with the Flask rule (/api/ktp/<nik>)
+    rule = path.replace('{', '<').replace('}', '>')
+
+    @wraps(endpoint)
+    async def timed(request):
+        started = time.perf_counter()
+        status = 500
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            metrics.observe_request(request.method, rule, status, time.perf_counter() - started)
+
+    return Route(path, timed, methods=methods)
+
+
+def _read_session(request, user_id=None):
+    # last_write_at of the authenticated user, see token_required
+    return async_db.session(replica_router.read_bind(
+        user_id, getattr(request.state, 'last_write_at', None), request.cookies.get(LAST_WRITE_COOKIE)
+    ))
+
+
+def _wrote(response, user_id=None):
+    # Read-your-writes: keep this client's reads on the primary for a while
+    last_write_at = replica_router.note_write(user_id)
+    response.set_cookie(LAST_WRITE_COOKIE, f'{last_write_at:.3f}', max_age=int(replica_router.sticky_window),
+                        httponly=True, samesite='lax')
+    return response
+
+
+def token_required(f):
+    @wraps(f)
+    async def decorated(request):
+        token = None
+        if 'Authorization' in request.headers:
+            parts = request.headers['Authorization'].split(" ")
+            token = parts[1] if len(parts) > 1 else None
+
+        if not token:
+            return _json({'message': 'Token is missing!'}, 401)
+
+        try:
+            data = jwt.decode(token, flask_app.config['SECRET_KEY'], algorithms=["HS256"])
+            # From the primary: last_write_at routes this user's reads (replication.py)
+            async with async_db.session() as session:
+                current_user = await session.get(User, data['user_id'])
+        except Exception:
+            return _json({'message': 'Token is invalid!'}, 401)
+        if current_user is None:
+            return _json({'message': 'Token is invalid!'}, 401)
+        request.state.last_write_at = current_user.last_write_at
+
+        return await f(request, current_user)
+
+    return decorated
+
+
+async def login(request):
+    data = await _body(request)
+    if not data or not data.get('username') or not data.get('password'):
+        return _json({'message': 'Could not verify'}, 401)
+
+    async with _read_session(request) as session:
+        user = (await session.execute(select(User).filter_by(username=data['username']))).scalars().first()
+
+    # Password hashing is CPU bound, keep it off the event loop
+    if user and await run_in_threadpool(check_password_hash, user.password, data['password']):
+        token = jwt.encode({
+            'user_id': user.id,
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+        }, flask_app.config['SECRET_KEY'], algorithm="HS256")
+
+        return _json({'token': token})
+
+    return _json({'message': 'Invalid credentials'}, 401)
+
+
+async def register(request):
+    data = await _body(request) or {}
+    try:
+        hashed_password = await run_in_threadpool(generate_password_hash, data['password'], method='pbkdf2:sha256')
+        new_user = User(username=data['username'], password=hashed_password)
+    except (KeyError, TypeError):
+        return _json({'message': 'username and password are required'}, 400)
+
+    async with async_db.session() as session:
+        session.add(new_user)
+        try:
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            return _json({'message': 'User already exists'}, 400)
+    return _wrote(_json({'message': 'New user created!'}))
+
+
+@token_required
+async def get_all_ktp(request, current_user):
+    # Same contract as app.get_all_ktp (DataTables server-side processing)
+    draw = _arg(request, 'draw', int)
+    try:
+        fields = parse_fields(_arg(request, 'fields'))
+    except ValueError as e:
+        return _json({'message': str(e)}, 400)
+
+    async with _read_session(request, current_user.id) as session:
+        if draw is None:
+            ktp_records = (await session.execute(select(*projection(fields)))).all()
+            return _json({'ktp_records': rows_to_dicts(fields, ktp_records)})
+
+        length = _arg(request, 'length', int, 10)
+        start = _arg(request, 'start', int, 0)
+        search_value = _arg(request, 'search[value]', str, '')
+        cursor = _arg(request, 'cursor', str)
+        keyset = cursor is not None or _arg(request, 'pagination') == 'keyset'
+        exact_count = _arg(request, 'exact_count', str, '').lower() in ('1', 'true', 'yes')
+        exact_below = float('inf') if exact_count else flask_app.config['LISTING_EXACT_COUNT_BELOW']
+        order_column_index = _arg(request, 'order[0][column]', int)
+        order_dir = _arg(request, 'order[0][dir]', str)
+        keys = sort_keys(order_column_index, order_dir)
+
+        total_records = await estimated_total_async(session, exact_below)
+        query = select(*projection(fields, extra=key_fields(keys) if keyset else ()))
+        query, ranking = apply_search(query, search_value)
+        if ranking is not None:
+            filtered_records = await estimated_count_async(session, query, exact_below)
+        else:
+            filtered_records = total_records
+
+        if ranking is not None and order_column_index is None and not keyset:
+            query = query.order_by(*ranking)
+        else:
+            query = apply_order(query, keys)
+
+        if keyset and cursor:
+            try:
+                query = apply_cursor(query, keys, decode_cursor(keys, cursor))
+            except CursorError as e:
+                return _json({'message': str(e)}, 400)
+        elif start and not keyset:
+            query = query.offset(start)
+        if length != -1:
+            query = query.limit(length)
+
+        ktp_records = (await session.execute(query)).all()
+
+    response = {
+        'draw': draw,
+        'recordsTotal': total_records,
+        'recordsFiltered': filtered_records,
+        'data': rows_to_dicts(fields, ktp_records)
+    }
+    if keyset:
+        has_more = length != -1 and len(ktp_records) == length
+        response['next_cursor'] = encode_cursor(keys, cursor_values(keys, ktp_records[-1])) if has_more else None
+    return _json(response)
+
+
+@token_required
+async def create_ktp(request, current_user):
+    data = await _body(request)
+
+    async with async_db.session() as session:
+        try:
+            new_ktp = KtpRecord(**parse_ktp_payload(data))
+            session.add(new_ktp)
+            await session.execute(user_wrote(current_user.id))
+            await session.commit()
+            await session.refresh(new_ktp)   # Server defaults (created_at, updated_at)
+        except Exception as e:
+            await session.rollback()
+            return _json({'message': str(e)}, 400)
+    # The invalidation backend may publish over the network
+    await run_in_threadpool(ktp_cache.invalidate, new_ktp.nik)
+    return _wrote(_json({'message': 'KTP record created!', 'ktp_record': new_ktp.to_dict()}, 201), current_user.id)
+
+
+@token_required
+async def get_one_ktp(request, current_user):
+    try:
+        fields = parse_fields(_arg(request, 'fields'))
+    except ValueError as e:
+        return _json({'message': str(e)}, 400)
+    nik = request.path_params['nik']
+
+    ktp = ktp_cache.get(nik)
+    if ktp is None:
+        read_at = time.time()
+        async with _read_session(request, current_user.id) as session:
+            query = select(*projection(KTP_FIELDS)).filter(KtpRecord.nik == nik)
+            row = (await session.execute(query)).first()
+        if not row:
+            return _json({'message': 'No KTP found!'}, 404)
+        ktp = row_to_dict(KTP_FIELDS, row)
+        ktp_cache.put(nik, ktp, read_at)
+
+    etag, last_modified = validators(ktp, fields)
+    headers = cache_headers(etag, last_modified)
+    if not_modified(etag, last_modified, request.headers.get('If-None-Match'),
+                    request.headers.get('If-Modified-Since')):
+        ktp_cache.count_not_modified()
+        return Response(status_code=304, headers={'Access-Control-Allow-Origin': '*', **headers})
+    return _json({'ktp_record': {f: ktp[f] for f in fields}}, headers=headers)
+
+
+@token_required
+async def update_ktp(request, current_user):
+    async with async_db.session() as session:
+        ktp = await session.get(KtpRecord, request.path_params['nik'])
+        if not ktp:
+            return _json({'message': 'No KTP found!'}, 404)
+
+        data = await _body(request)
+
+        try:
+            apply_ktp_update(ktp, data)
+            await session.execute(user_wrote(current_user.id))
+            await session.commit()
+            await session.refresh(ktp)   # updated_at is set by the database
+        except Exception as e:
+            await session.rollback()
+            return _json({'message': str(e)}, 400)
+    await run_in_threadpool(ktp_cache.invalidate, ktp.nik)
+    return _wrote(_json({'message': 'KTP record updated!', 'ktp_record': ktp.to_dict()}), current_user.id)
+
+
+@token_required
+async def delete_ktp(request, current_user):
+    async with async_db.session() as session:
+        ktp = await session.get(KtpRecord, request.path_params['nik'])
+        if not ktp:
+            return _json({'message': 'No KTP found!'}, 404)
+
+        await session.delete(ktp)
+        await session.execute(user_wrote(current_user.id))
+        await session.commit()
+    await run_in_threadpool(ktp_cache.invalidate, ktp.nik)
+    return _wrote(_json({'message': 'KTP record deleted!'}), current_user.id)
+
+
+def _submit_ocr_job(file_bytes, mime_type, user_id, filename, engine):
+    with flask_app.app_context():
+        job = ocr_jobs.submit(file_bytes=file_bytes, mime_type=mime_type, user_id=user_id, filename=filename,
+                              engine=engine)
+        return job.id, job.status
+
+
+@token_required
+async def extract_ktp_data(request, current_user):
+    with metrics.stage('upload_read'):
+        form = await request.form()
+        file = form.get('file')
+        file_bytes = await file.read() if isinstance(file, UploadFile) else None
+    if not isinstance(file, UploadFile):
+        return _json({'message': 'No file part'}, 400)
+    if not file.filename:
+        return _json({'message': 'No selected file'}, 400)
+
+    # Extraction engine (ocr.ENGINES), OCR_ENGINE when not given
+    engine = request.query_params.get('engine')
+    if engine is not None and engine not in ENGINES:
+        return _json({'message': f"engine must be one of: {', '.join(ENGINES)}"}, 400)
+
+    mime_type = file.content_type
+
+    # Job mode: queue the upload and return immediately with a job id
+    if request.query_params.get('mode') == 'job':
+        try:
+            job_id, status = await run_in_threadpool(
+                _submit_ocr_job, file_bytes, mime_type, current_user.id, file.filename, engine
+            )
+        except QueueFullError as e:
+            return _json({'message': str(e)}, 503)
+        return _json({
+            'message': 'Extraction queued',
+            'job_id': job_id,
+            'status': status,
+            'status_url': f'/api/ocr/jobs/{job_id}'
+        }, 202)
+
+    try:
+        # PDFs and TIFFs with several cards come back as {'pages', 'cards'} (documents.py)
+        extracted_data = await async_runtime.run_async(ocr_documents.process_document(
+            file_bytes=file_bytes,
+            mime_type=mime_type,
+            user_id=str(current_user.id),
+            engine=engine
+        ))
+        return _json({'message': 'Extraction successful', 'data': extracted_data})
+    except DocumentError as e:
+        return _json({'message': str(e)}, 400)
+    except SaturatedError as e:
+        return _json({'message': str(e)}, 503, headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        return _json({'message': f'Processing error: {str(e)}'}, 500)
+
+
+@token_required
+async def extract_ktp_stream(request, current_user):
+    with metrics.stage('upload_read'):
+        form = await request.form()
+        file = form.get('file')
+        file_bytes = await file.read() if isinstance(file, UploadFile) else None
+    if not isinstance(file, UploadFile):
+        return _json({'message': 'No file part'}, 400)
+    if not file.filename:
+        return _json({'message': 'No selected file'}, 400)
+    try:
+        # One record per stream: multi-card PDFs and TIFFs go through /api/ocr/extract
+        await async_runtime.run_async(ocr_documents.check_single_card(file_bytes, file.content_type))
+    except DocumentError as e:
+        return _json({'message': str(e)}, 400)
+
+    events = ocr_stream.extraction_events(file_bytes, file.content_type, ocr_agent, cache=ocr_cache, admission=gemini_admission)
+    lines = ocr_stream.sse_events(events)
+    try:
+        # Admission and the first field happen before the response starts
+        first = await lines.__anext__()
+    except SaturatedError as e:
+        return _json({'message': str(e)}, 503, headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        return _json({'message': f'Processing error: {str(e)}'}, 500)
+
+    async def body():
+        yield first
+        async for line in lines:
+            yield line
+
+    return StreamingResponse(body(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Agent calls, OCR jobs and cache lookups all run on the server's loop
+    async_runtime.adopt(asyncio.get_running_loop())
+    async_db.start()
+    for bind, engine in async_db.engines.items():
+        await run_in_threadpool(replica_router.watch_engine, bind, engine.sync_engine)
+    # Loads the agent in the background unless inherited from a preloading master (ocr.py)
+    ocr_agent.worker_started()
+    ktp_stats_folder.start()
+    yield
+    await async_db.dispose()
+
+
+app = Starlette(
+    routes=[
+        _route('/auth/login', login, ['POST']),
+        _route('/auth/register', register, ['POST']),
+        _route('/api/ktp', get_all_ktp, ['GET']),
+        _route('/api/ktp', create_ktp, ['POST']),
+        # Flask-only routes that would otherwise match /api/ktp/{nik}
+        Route('/api/ktp/export', flask_asgi),
+        Route('/api/ktp/import', flask_asgi),
+        Route('/api/ktp/stats', flask_asgi),
+        _route('/api/ktp/{nik}', get_one_ktp, ['GET']),
+        _route('/api/ktp/{nik}', update_ktp, ['PUT']),
+        _route('/api/ktp/{nik}', delete_ktp, ['DELETE']),
+        _route('/api/ocr/extract', extract_ktp_data, ['POST']),
+        _route('/api/ocr/extract/stream', extract_ktp_stream, ['POST']),
+        Mount('/', flask_asgi)
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,65 @@
+"""
+asyncpg engines for the ASGI mode (asgi.py).
+
+One SQLAlchemy AsyncEngine per bind (primary plus every replica bind), built
+from the same URLs as the sync engines and sharing their pool recycle and
+pre-ping settings, with larger pools since one ASGI worker serves many
+concurrent requests. Which bind a read goes to is decided by ReplicaRouter.
+"""
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+
+def async_url(url):
+    """postgresql://...?sslmode=require -> postgresql+asyncpg://...?ssl=require"""
+    url = make_url(url).set(drivername='postgresql+asyncpg')
+    query = dict(url.query)
+    sslmode = query.pop('sslmode', None)
+    if sslmode:
+        query['ssl'] = sslmode
+    return url.set(query=query)
+
+
+class AsyncDatabase:
+
+    def __init__(self, app=None):
+        self.app = None
+        self.engines = {}
+        self._sessions = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['async_db'] = self
+
+    def start(self):
+        """Creates the engines; call from the serving loop (e.g. the ASGI lifespan)."""
+        config = self.app.config
+        urls = {None: config['SQLALCHEMY_DATABASE_URI']}
+        urls.update(config.get('SQLALCHEMY_BINDS', {}))
+        for bind, url in urls.items():
+            engine = create_async_engine(
+                async_url(url),
+                pool_size=config.get('ASYNC_DB_POOL_SIZE', 20),
+                max_overflow=config.get('ASYNC_DB_MAX_OVERFLOW', 20),
+                pool_timeout=config.get('DB_POOL_TIMEOUT', 10),
+                pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+                pool_pre_ping=config.get('DB_POOL_PRE_PING', True),
+                connect_args={
+                    'command_timeout': config.get('ASYNC_DB_COMMAND_TIMEOUT', 30),
+                    'server_settings': {'application_name': 'ktp-backend-asgi'}
+                }
+            )
+            self.engines[bind] = engine
+            self._sessions[bind] = async_sessionmaker(engine, expire_on_commit=False)
+
+    def session(self, bind=None):
+        """AsyncSession on `bind` (None = primary); use as `async with db.session(...) as session`."""
+        return self._sessions[bind]()
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+        self.engines = {}
+        self._sessions = {}
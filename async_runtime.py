@@ -0,0 +1,81 @@
+"""
+Per-process background event loop shared by everything async in a worker.
+
+Sync Flask handlers used to call `asyncio.run(...)` for each OCR request,
+which creates and tears down a loop every time and with it the HTTP
+connection pools of the Gemini clients bound to that loop. Instead, one
+daemon thread per worker process runs a long-lived loop; handlers block on
+`run()` and background work is scheduled with `submit()`.
+
+In ASGI mode (asgi.py) the server's own loop is adopted instead, so OCR
+requests, queued jobs and the Gemini clients all share one loop.
+"""
+import asyncio
+import os
+import threading
+
+_loop = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """Returns the running background loop, starting it on first use (and again after fork)."""
+    global _loop, _pid
+    if _loop is not None and _pid == os.getpid():
+        return _loop
+    with _lock:
+        if _loop is not None and _pid == os.getpid():
+            return _loop
+        ready = threading.Event()
+        holder = {}
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            holder['loop'] = loop
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name='async-runtime', daemon=True).start()
+        ready.wait()
+        _loop = holder['loop']
+        _pid = os.getpid()
+        return _loop
+
+
+def adopt(loop):
+    """Uses `loop` (e.g. uvicorn's) as this process's runtime loop unless one is already running."""
+    global _loop, _pid
+    with _lock:
+        if _loop is not None and _pid == os.getpid():
+            return _loop is loop
+        _loop = loop
+        _pid = os.getpid()
+        return True
+
+
+def submit(coro):
+    """Schedules `coro` on the background loop, returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """Runs `coro` on the background loop and blocks the calling thread for its result."""
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+def call_soon(callback, *args):
+    get_loop().call_soon_threadsafe(callback, *args)
+
+
+async def run_async(coro):
+    """Awaits `coro` on the runtime loop from async code: directly when that is the caller's loop."""
+    if get_loop() is asyncio.get_running_loop():
+        return await coro
+    return await asyncio.wrap_future(submit(coro))
@@ -0,0 +1,179 @@
+import asyncio
+import io
+import json
+import mimetypes
+import os
+import queue
+import time
+import zipfile
+
+ZIP_MIME_TYPES = ('application/zip', 'application/x-zip-compressed')
+# Put on the results queue once run_batch is over, however it ended
+_DONE = object()
+
+
+class BatchError(Exception):
+    """Raised for batch uploads that cannot be processed at all."""
+
+
+def collect_batch_items(files, max_files, max_bytes=0):
+    """
+    Flattens the uploaded files (and the members of any zip archive) into a
+    list of (filename, file_bytes, mime_type) tuples in upload order.
+
+    `max_bytes` (0 disables) caps what zip members may add up to once
+    uncompressed; it is checked against the sizes the archive declares
+    before anything is extracted, and zipfile refuses members that inflate
+    past their declared size.
+    """
+    items = []
+    extracted = 0
+    for file in files:
+        if not file or file.filename == '':
+            continue
+        data = file.read()
+        if file.mimetype in ZIP_MIME_TYPES or file.filename.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(io.BytesIO(data))
+            except zipfile.BadZipFile:
+                raise BatchError(f'{file.filename} is not a valid zip archive')
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                # Skip directories and macOS resource forks
+                if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX'):
+                    continue
+                extracted += info.file_size
+                if max_bytes and extracted > max_bytes:
+                    raise BatchError(f'Zip archives may hold at most {max_bytes} bytes uncompressed')
+                mime_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                items.append((info.filename, archive.read(info), mime_type))
+                if len(items) > max_files:
+                    break
+        else:
+            items.append((file.filename, data, file.mimetype))
+        if len(items) > max_files:
+            raise BatchError(f'Batch is limited to {max_files} files')
+    return items
+
+
+class _RateLimiter:
+    """Spaces out call starts to at most `max_rps` per second (0 disables)."""
+
+    def __init__(self, max_rps):
+        self.interval = 1.0 / max_rps if max_rps else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+async def run_batch(items, process, user_id, concurrency, max_rps, emit, done=None):
+    """
+    Runs `process` for every item with at most `concurrency` calls in flight
+    and at most `max_rps` call starts per second. `emit(index, result, error)`
+    is called as soon as each item finishes, in completion order, and
+    `done()` once after the last one, also when the batch fails or is
+    cancelled.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = _RateLimiter(max_rps)
+
+    async def run_one(index, file_bytes, mime_type):
+        async with semaphore:
+            await limiter.wait()
+            try:
+                result = await process(file_bytes=file_bytes, mime_type=mime_type, user_id=user_id)
+            except Exception as e:
+                emit(index, None, str(e))
+                return
+            if isinstance(result, dict) and 'error' in result:
+                emit(index, None, result['error'])
+            else:
+                emit(index, result, None)
+
+    try:
+        await asyncio.gather(*(
+            run_one(index, file_bytes, mime_type)
+            for index, (_, file_bytes, mime_type) in enumerate(items)
+        ))
+    finally:
+        if done is not None:
+            done()
+
+
+def stream_batch(items, submit, process, user_id, concurrency, max_rps, save=None, timeout=None):
+    """
+    Generator of NDJSON lines, one per item as it completes, then a summary line.
+
+    `submit` schedules a coroutine on a background event loop (see
+    async_runtime.submit). If `save` is given it is called once with the
+    list of (index, result) pairs of successful items and must return a dict
+    that is merged into the summary. Items still unfinished when the batch
+    stops, or when no item finished for `timeout` seconds, are reported as
+    errors.
+    """
+    started = time.monotonic()
+    results = queue.Queue()
+    future = submit(run_batch(
+        items, process, user_id, concurrency, max_rps,
+        emit=lambda index, result, error: results.put((index, result, error)),
+        done=lambda: results.put(_DONE)
+    ))
+
+    succeeded = []
+    failed = 0
+    pending = set(range(len(items)))
+    stopped = False
+    try:
+        while pending:
+            try:
+                entry = results.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is _DONE:
+                stopped = True
+                break
+            index, result, error = entry
+            pending.discard(index)
+            line = {'index': index, 'filename': items[index][0]}
+            if error is None:
+                line.update(status='ok', data=result)
+                succeeded.append((index, result))
+            else:
+                line.update(status='error', message=error)
+                failed += 1
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+
+        if pending:
+            message = f'No result within {timeout:g}s'
+            if stopped:
+                # The batch coroutine itself failed; it resolves right after its finally
+                try:
+                    message = f'Batch failed: {future.exception(timeout=5)}'
+                except Exception:
+                    message = 'Batch stopped'
+            future.cancel()
+            for index in sorted(pending):
+                failed += 1
+                yield json.dumps({'index': index, 'filename': items[index][0], 'status': 'error',
+                                  'message': message}, ensure_ascii=False) + '\n'
+
+        summary = {
+            'total': len(items),
+            'succeeded': len(succeeded),
+            'failed': failed
+        }
+        if save is not None:
+            summary.update(save(sorted(succeeded)))
+        summary['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+        yield json.dumps({'summary': summary}) + '\n'
+    finally:
+        # The client went away (GeneratorExit) or the batch failed: stop the remaining calls
+        future.cancel()
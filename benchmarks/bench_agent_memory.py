@@ -0,0 +1,100 @@
+"""
+Memory regression check for the long-lived agent runtime.
+
+Runs process_document many times on the async_runtime background loop with
+the Gemini model swapped for a canned in-process LLM, then checks that no
+ADK sessions are left behind and that RSS stays flat.
+
+    python -m benchmarks.bench_agent_memory --calls 2000 --max-growth-mb 20
+
+Exits non-zero when sessions leak or RSS grows by more than --max-growth-mb
+between the warm-up and the end of the run. tests/test_agent_memory.py runs
+the session check on every test run with a few dozen calls.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from typing import AsyncGenerator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+
+import agent
+import async_runtime
+
+CANNED = {
+    "nik": "3273015508900001", "full_name": "SITI AMINAH", "birth_place": "BANDUNG",
+    "birth_date": "1990-08-15", "gender": "PEREMPUAN", "blood_type": "O",
+    "address": "JL. MERDEKA NO. 1", "rt_rw": "001/002", "village_kelurahan": "BRAGA",
+    "district_kecamatan": "SUMUR BANDUNG", "religion": "ISLAM", "marital_status": "KAWIN",
+    "occupation": "KARYAWAN SWASTA", "citizenship": "WNI", "expiry_date": "SEUMUR HIDUP",
+}
+
+
+class CannedLlm(BaseLlm):
+    """Answers every request with the same extraction, no network."""
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(0)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=json.dumps(CANNED))]))
+
+
+def rss_mb():
+    # Current RSS from /proc where available, peak RSS otherwise
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_calls(n):
+    """`n` process_document calls with the canned model, spread over 10 users."""
+    agent.extraction_agent.model = CannedLlm(model="canned")
+    for i in range(n):
+        async_runtime.run(agent.process_document(b"", "", user_id=str(i % 10)))
+
+
+def leftover_sessions():
+    """(sessions tracked by agent.py, sessions still in the ADK session service); both 0 when nothing leaks."""
+    stored = sum(len(s) for s in agent.session_service.sessions.get(agent.APP_NAME, {}).values())
+    return agent.active_session_count(), stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--max-growth-mb", type=float, default=20.0)
+    args = parser.parse_args()
+
+    run_calls(args.warmup)
+    before = rss_mb()
+    started = time.perf_counter()
+    run_calls(args.calls)
+    elapsed = time.perf_counter() - started
+    after = rss_mb()
+
+    sessions, stored = leftover_sessions()
+    growth = after - before
+    print(f"calls={args.calls} per_call_ms={1000 * elapsed / args.calls:.2f} "
+          f"rss_before_mb={before:.1f} rss_after_mb={after:.1f} growth_mb={growth:.1f} "
+          f"tracked_sessions={sessions} stored_sessions={stored}")
+
+    if sessions or stored:
+        print("FAIL: sessions were not evicted")
+        sys.exit(1)
+    if growth > args.max_growth_mb:
+        print(f"FAIL: RSS grew by more than {args.max_growth_mb} MB")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+App entry points for benchmarks and load tests.
+
+    gunicorn -w 4 benchmarks.bench_app:wsgi_app
+    gunicorn -k uvicorn.workers.UvicornWorker -w 1 benchmarks.bench_app:asgi_app
+
+BENCH_DATABASE_URL, if set, replaces the primary and replica databases (the
+app's own URLs force sslmode=require, which a local Postgres rarely has).
+Gemini settings come from the environment as usual; benchmarks.loadtest
+points them at benchmarks.stub_gemini.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# agent.py copies these into os.environ at import time
+for name, default in (('GOOGLE_CLOUD_PROJECT', 'bench'), ('GOOGLE_CLOUD_LOCATION', 'us-central1'),
+                      ('GOOGLE_GENAI_USE_VERTEXAI', 'true')):
+    os.environ.setdefault(name, default)
+
+import config
+
+if os.getenv('BENCH_DATABASE_URL'):
+    config.Config.SQLALCHEMY_DATABASE_URI = os.environ['BENCH_DATABASE_URL']
+    config.Config.SQLALCHEMY_BINDS = {'replica': os.environ['BENCH_DATABASE_URL']}
+
+import app as flask_module
+import asgi as asgi_module
+
+wsgi_app = flask_module.app
+asgi_app = asgi_module.app
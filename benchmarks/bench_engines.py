@@ -0,0 +1,180 @@
+"""
+Per-call cost of the two extraction engines on the same stubbed inputs.
+
+    python -m benchmarks.bench_engines --calls 500 --concurrency 8
+    python -m benchmarks.bench_engines --latency 1.5 --image card.jpg --json engines.json
+
+Starts benchmarks.stub_gemini in a subprocess (so its CPU is not counted)
+and points google-genai at it, then runs agent.process_document with
+engine='adk' (LlmAgent through Runner, one session per call) and with
+engine='direct' (one generate_content call in JSON mode) on the same upload
+(add 'tiered' to --engines for the Flash->Pro escalation, which the stub
+triggers on about 10% of the cards):
+
+- latency: p50/p95 per call at --concurrency, on the async_runtime loop;
+- cpu: process CPU time per call (this process only, the stub is excluded);
+- memory: bytes allocated per call (tracemalloc peak over --trace-calls
+  sequential calls) and RSS growth over the run.
+
+With the default --latency 0 the stub answers right away, and with
+preprocessing off unless --preprocess is given, the numbers are pure engine
+overhead. Gemini answers in JSON mode are never fenced, so the
+stub runs with --fenced-ratio 0.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_serving import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_mb():
+    # Same as bench_agent_memory.rss_mb, which cannot be imported before the environment is set
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def start_stub(port, latency):
+    command = [sys.executable, '-m', 'benchmarks.stub_gemini', '--port', str(port),
+               '--latency', str(latency), '--fenced-ratio', '0']
+    process = subprocess.Popen(command, cwd=ROOT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/stats', timeout=1)
+            return process
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise RuntimeError(f'stub exited with {process.returncode}')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('stub did not start')
+
+
+def sample_upload(path):
+    if path:
+        with open(path, 'rb') as f:
+            return f.read(), 'image/png' if path.lower().endswith('.png') else 'image/jpeg'
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (1280, 800), (225, 235, 245))
+    draw = ImageDraw.Draw(image)
+    for i in range(14):
+        draw.text((60, 60 + 45 * i), f'FIELD {i}: 3273015508900001 SITI AMINAH', fill=(20, 20, 20))
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=85)
+    return buf.getvalue(), 'image/jpeg'
+
+
+def run_engine(agent, async_runtime, engine, file_bytes, mime_type, args):
+    async def one(i):
+        started = time.perf_counter()
+        result = await agent.process_document(file_bytes, mime_type, user_id=f'bench-{i % 10}', engine=engine)
+        return time.perf_counter() - started, isinstance(result, dict) and 'error' not in result
+
+    async def many(calls):
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(i):
+            async with semaphore:
+                return await one(i)
+        return await asyncio.gather(*(bounded(i) for i in range(calls)), return_exceptions=True)
+
+    async_runtime.run(many(args.warmup))
+
+    # Allocation per call, sequentially so calls do not overlap
+    tracemalloc.start()
+    peaks = []
+    for i in range(args.trace_calls):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        async_runtime.run(one(i))
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    rss_before = rss_mb()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    outcomes = async_runtime.run(many(args.calls))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    latencies = [o[0] for o in outcomes if not isinstance(o, BaseException) and o[1]]
+    errors = len(outcomes) - len(latencies)
+    return {
+        'calls': args.calls,
+        'errors': errors,
+        'calls_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else 0,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'cpu_ms_per_call': round(cpu * 1000 / args.calls, 2),
+        'alloc_kb_per_call': round(statistics.median(peaks) / 1024, 1) if peaks else 0,
+        'rss_growth_mb': round(rss_mb() - rss_before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=30)
+    parser.add_argument('--trace-calls', type=int, default=30, help='sequential calls traced for allocations')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub median seconds per call')
+    parser.add_argument('--image', help='upload to extract (default: a synthetic 1280x800 JPEG)')
+    parser.add_argument('--preprocess', action='store_true', help='run the preprocessing pool too (same for both)')
+    parser.add_argument('--engines', default='adk,direct')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    # google-genai reads these when the client is created (agent.get_genai_client)
+    os.environ.update(
+        GOOGLE_GENAI_USE_VERTEXAI='false',
+        GOOGLE_API_KEY='stub',
+        GOOGLE_GEMINI_BASE_URL=f'http://127.0.0.1:{args.port}/',
+    )
+    os.environ.setdefault('GOOGLE_CLOUD_PROJECT', 'bench')
+    os.environ.setdefault('GOOGLE_CLOUD_LOCATION', 'us-central1')
+
+    import agent
+    import async_runtime
+    import preprocess
+
+    preprocess.ENABLED = args.preprocess
+
+    file_bytes, mime_type = sample_upload(args.image)
+    stub = start_stub(args.port, args.latency)
+    try:
+        results = {}
+        for engine in args.engines.split(','):
+            results[engine] = run_engine(agent, async_runtime, engine, file_bytes, mime_type, args)
+            print(engine.ljust(8), ' '.join(f'{k}={v}' for k, v in results[engine].items()))
+    finally:
+        stub.terminate()
+
+    if 'adk' in results and 'direct' in results and results['direct']['cpu_ms_per_call']:
+        print(f"cpu per call: direct is {results['adk']['cpu_ms_per_call'] / results['direct']['cpu_ms_per_call']:.1f}x "
+              f"cheaper than adk")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
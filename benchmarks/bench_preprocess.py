@@ -0,0 +1,200 @@
+"""
+Bytes sent to Gemini and latency with and without image preprocessing.
+
+    python -m benchmarks.bench_preprocess                    # synthetic 12 MP phone photo
+    python -m benchmarks.bench_preprocess photo1.jpg ...     # your own KTP photos
+    python -m benchmarks.bench_preprocess --live photo.jpg   # also time process_document end to end
+    python -m benchmarks.bench_preprocess --pool-memory 2 1  # pod memory of the pools per OCR_PREPROCESS_WORKERS
+
+--live calls Gemini through agent.process_document (no extraction cache), so
+it needs the usual GOOGLE_* environment.
+
+--pool-memory forks --gunicorn-workers processes like the Dockerfile's
+gunicorn, each with its own preprocess pool of the given size, and has each
+preprocess --uploads photos and 3-page PDFs with --concurrency in flight. It
+prints the peak and final PSS of those processes and their pools, the part
+of the pod's memory that OCR_PREPROCESS_WORKERS controls.
+"""
+import argparse
+import asyncio
+import io
+import mimetypes
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+import preprocess
+
+
+def synthetic_photo(width=4000, height=3000):
+    """A card-sized light rectangle with text-like noise on a darker desk background."""
+    rng = random.Random(42)
+    image = Image.new("RGB", (width, height), (92, 74, 60))
+    draw = ImageDraw.Draw(image)
+    for _ in range(4000):
+        x, y = rng.randrange(width), rng.randrange(height)
+        shade = rng.randrange(70, 110)
+        draw.point((x, y), fill=(shade, shade - 15, shade - 30))
+    card_w, card_h = 2400, int(2400 / preprocess.CARD_ASPECT)
+    left, top = (width - card_w) // 2, (height - card_h) // 2
+    draw.rectangle((left, top, left + card_w, top + card_h), fill=(170, 205, 230))
+    for row in range(18):
+        y = top + 120 + row * 70
+        x = left + 100
+        while x < left + card_w - 700:
+            w = rng.randrange(20, 90)
+            draw.rectangle((x, y, x + w, y + 40), fill=(30, 30, 40))
+            x += w + rng.randrange(15, 40)
+    # Sensor noise, which is what makes real phone photos so large
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    image = Image.blend(image, noise, 0.12)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def load_inputs(paths):
+    if not paths:
+        return [("synthetic-12mp.jpg", synthetic_photo(), "image/jpeg")]
+    inputs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            inputs.append((os.path.basename(path), f.read(), mimetypes.guess_type(path)[0] or "image/jpeg"))
+    return inputs
+
+
+async def time_process_document(file_bytes, mime_type, enabled):
+    import agent
+    preprocess.ENABLED = enabled
+    started = time.perf_counter()
+    await agent.process_document(file_bytes=file_bytes, mime_type=mime_type, user_id="bench")
+    return time.perf_counter() - started
+
+
+def synthetic_pdf(pages=3):
+    """A pages-long PDF of A4 scans at 200 DPI, each with one card on it."""
+    card = Image.open(io.BytesIO(synthetic_photo())).resize((680, 430))
+    scans = []
+    for _ in range(pages):
+        scan = Image.new("RGB", (1654, 2339), "white")
+        scan.paste(card, (200, 300))
+        scans.append(scan)
+    out = io.BytesIO()
+    scans[0].save(out, format="PDF", save_all=True, append_images=scans[1:])
+    return out.getvalue()
+
+
+def _tree_pss_mb(pid):
+    """PSS of `pid` and all its descendants, from /proc (Linux only)."""
+    total, todo = 0, [pid]
+    while todo:
+        pid = todo.pop()
+        try:
+            # Pool processes are started from event loop threads, so look at every task's children
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    todo.extend(int(child) for child in f.read().split())
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                total += sum(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+        except OSError:
+            continue
+    return total / 1024
+
+
+def _pool_worker(pool_workers, uploads, concurrency, photo, pdf_path, done, release):
+    preprocess.POOL_WORKERS = pool_workers
+
+    async def upload(i):
+        # Same pool calls as preprocess_document and documents.DocumentSplitter
+        if i % 6 == 5:
+            for page in range(await preprocess.run_in_pool(preprocess.page_count, pdf_path, "application/pdf")):
+                await preprocess.run_in_pool(preprocess.render_cards, pdf_path, "application/pdf", page)
+        else:
+            await preprocess.run_in_pool(preprocess.preprocess_image, photo, "image/jpeg")
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(i):
+            async with semaphore:
+                await upload(i)
+        await asyncio.gather(*(limited(i) for i in range(uploads)))
+
+    asyncio.run(run())
+    # Stay up with the idle pool, as a gunicorn worker would, until measured
+    done.release()
+    release.wait()
+    preprocess._get_pool().shutdown()
+
+
+def pool_memory(args):
+    photo, pdf = synthetic_photo(), synthetic_pdf()
+    context = multiprocessing.get_context("fork")
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        f.write(pdf)
+        f.flush()
+        print(f"{args.gunicorn_workers} workers, {args.uploads} uploads each, {args.concurrency} in flight per worker")
+        print(f"{'OCR_PREPROCESS_WORKERS':<24}{'peak MiB':>10}{'idle MiB':>10}{'seconds':>9}")
+        for pool_workers in args.pool_memory:
+            done, release = context.Semaphore(0), context.Event()
+            workers = [context.Process(target=_pool_worker, args=(pool_workers, args.uploads, args.concurrency,
+                                                                  photo, f.name, done, release))
+                       for _ in range(args.gunicorn_workers)]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            finished = 0
+            peak = 0
+            while finished < len(workers):
+                peak = max(peak, sum(_tree_pss_mb(worker.pid) for worker in workers))
+                if done.acquire(timeout=0.1):
+                    finished += 1
+            elapsed = time.perf_counter() - started
+            idle = sum(_tree_pss_mb(worker.pid) for worker in workers)
+            release.set()
+            for worker in workers:
+                worker.join()
+            print(f"{pool_workers:<24}{peak:>10.0f}{idle:>10.0f}{elapsed:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="also time agent.process_document against Gemini")
+    parser.add_argument("--pool-memory", type=int, nargs="+", metavar="WORKERS",
+                        help="measure pod memory for these OCR_PREPROCESS_WORKERS values instead")
+    parser.add_argument("--gunicorn-workers", type=int, default=4)
+    parser.add_argument("--uploads", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    if args.pool_memory:
+        pool_memory(args)
+        return
+
+    print(f"{'file':<24}{'bytes before':>14}{'bytes after':>13}{'ratio':>8}{'preprocess ms':>15}"
+          + (f"{'e2e raw s':>11}{'e2e prep s':>12}" if args.live else ""))
+    for name, data, mime_type in load_inputs(args.images):
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            out, _, info = preprocess.preprocess_image(data, mime_type)
+            timings.append(time.perf_counter() - started)
+        line = (f"{name[:23]:<24}{len(data):>14,}{len(out):>13,}{len(out) / len(data):>8.2f}"
+                f"{1000 * sorted(timings)[len(timings) // 2]:>15.1f}")
+        if args.live:
+            raw = asyncio.run(time_process_document(data, mime_type, enabled=False))
+            prepared = asyncio.run(time_process_document(data, mime_type, enabled=True))
+            line += f"{raw:>11.2f}{prepared:>12.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+DataTables search benchmark: the old ILIKE '%term%' listing vs search.py.
+
+    python -m benchmarks.bench_search --populate 1000000     # load synthetic rows first
+    python -m benchmarks.bench_search --repeat 20 --json results.json
+
+For every query shape it times what one get_all_ktp request costs in the
+database. The legacy path runs count(*) twice plus an ILIKE page. The new
+path reads the pg_class estimate, EXPLAINs the filtered query and fetches a
+ranked page through search.apply_search. Apply migrations/002 (or
+db.create_all()) before running.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, or_, select, text
+
+from benchmarks.synthetic import database_url, populate
+from models import KtpRecord
+from search import apply_search, classify
+
+QUERIES = [
+    ('nik prefix', '3273'),
+    ('nik long prefix', '32730155'),
+    ('name word', 'SISWANTO'),
+    ('common name', 'SITI'),
+    ('short prefix', 'bu'),
+    ('multi word', 'budi merdeka'),
+    ('address word', 'DIPONEGORO'),
+]
+
+
+def legacy_request(conn, term, length=10):
+    pattern = f'%{term}%'
+    base = select(KtpRecord)
+    conn.execute(select(func.count()).select_from(base.subquery())).scalar()
+    filtered = base.filter(or_(
+        KtpRecord.full_name.ilike(pattern),
+        KtpRecord.nik.ilike(pattern),
+        KtpRecord.address.ilike(pattern)
+    ))
+    count = conn.execute(select(func.count()).select_from(filtered.subquery())).scalar()
+    conn.execute(filtered.order_by(KtpRecord.updated_at.desc(), KtpRecord.nik.asc()).limit(length)).all()
+    return count
+
+
+def search_request(conn, term, length=10):
+    conn.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'ktp_records'::regclass")).scalar()
+    filtered, ranking = apply_search(select(KtpRecord), term)
+    compiled = filtered.compile(dialect=conn.dialect)
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    conn.execute(filtered.order_by(*ranking).limit(length)).all()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def timed(fn, conn, term, repeat):
+    fn(conn, term)   # Warm the cache
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(conn, term)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url')
+    parser.add_argument('--populate', type=int, metavar='ROWS', help='truncate and load ROWS synthetic records first')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON')
+    args = parser.parse_args()
+
+    url = database_url(args.database_url)
+    if args.populate:
+        count, elapsed = populate(url, args.populate, truncate=True)
+        print(f'Loaded {count:,} rows in {elapsed:.1f}s')
+
+    engine = create_engine(url)
+    results = []
+    with engine.connect() as conn:
+        rows = conn.execute(text('SELECT count(*) FROM ktp_records')).scalar()
+        print(f'ktp_records: {rows:,} rows\n')
+        print(f"{'query':<16}{'term':<16}{'route':<10}{'legacy ms':>11}{'search ms':>11}{'speedup':>9}"
+              f"{'legacy rows':>13}{'est. rows':>11}")
+        for name, term in QUERIES:
+            legacy_ms, _, legacy_rows = timed(legacy_request, conn, term, args.repeat)
+            try:
+                search_ms, _, estimate = timed(search_request, conn, term, args.repeat)
+            except Exception as e:
+                conn.rollback()
+                print(f'{name:<16}{term:<16}{classify(term):<10} failed: {str(e).splitlines()[0]}')
+                continue
+            results.append({
+                'query': name, 'term': term, 'route': classify(term),
+                'legacy_ms': round(legacy_ms, 2), 'search_ms': round(search_ms, 2),
+                'legacy_rows': legacy_rows, 'estimated_rows': estimate
+            })
+            print(f'{name:<16}{term:<16}{classify(term):<10}{legacy_ms:>11.1f}{search_ms:>11.1f}'
+                  f'{legacy_ms / search_ms:>8.1f}x{legacy_rows:>13,}{estimate:>11,}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': rows, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
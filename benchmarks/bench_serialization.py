@@ -0,0 +1,105 @@
+"""
+Listing serialization benchmark: ORM objects + to_dict() + json vs serialization.py.
+
+    python -m benchmarks.bench_serialization --populate 100000
+    python -m benchmarks.bench_serialization --sizes 1000,10000 --json results.json
+
+For each page size it times fetching and encoding one page the way
+get_all_ktp used to (KtpRecord objects, to_dict(), Flask's default JSON
+provider) and the way it does now (projected rows, rows_to_dicts(), orjson),
+once with every field and once with a five-field `?fields=` projection.
+Peak Python memory per request is measured with tracemalloc in a separate
+pass so it does not skew the timings.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import database_url, populate
+from models import KtpRecord
+from serialization import KTP_FIELDS, dumps, projection, rows_to_dicts
+
+FEW_FIELDS = ['nik', 'full_name', 'birth_date', 'gender', 'updated_at']
+legacy_json = DefaultJSONProvider(Flask(__name__))
+
+
+def legacy_request(session, fields, length):
+    # fields is ignored: the old endpoint always returned every column
+    ktp_records = session.execute(select(KtpRecord).order_by(KtpRecord.nik).limit(length)).scalars().all()
+    body = legacy_json.dumps({'data': [ktp.to_dict() for ktp in ktp_records]})
+    session.expunge_all()
+    return len(body)
+
+
+def projected_request(session, fields, length):
+    rows = session.execute(select(*projection(fields)).order_by(KtpRecord.nik).limit(length)).all()
+    return len(dumps({'data': rows_to_dicts(fields, rows)}))
+
+
+def timed(fn, session, fields, length, repeat):
+    fn(session, fields, length)   # Warm the cache
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = fn(session, fields, length)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    fn(session, fields, length)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(samples), peak / 1024 / 1024, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url')
+    parser.add_argument('--populate', type=int, metavar='ROWS', help='truncate and load ROWS synthetic records first')
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated page sizes')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON')
+    args = parser.parse_args()
+
+    url = database_url(args.database_url)
+    if args.populate:
+        count, elapsed = populate(url, args.populate, truncate=True)
+        print(f'Loaded {count:,} rows in {elapsed:.1f}s')
+
+    engine = create_engine(url)
+    results = []
+    with Session(engine) as session:
+        rows = session.execute(text('SELECT count(*) FROM ktp_records')).scalar()
+        print(f'ktp_records: {rows:,} rows\n')
+        print(f"{'rows':>7}  {'fields':<8}{'legacy ms':>11}{'new ms':>9}{'speedup':>9}"
+              f"{'legacy MiB':>12}{'new MiB':>9}{'legacy KiB':>12}{'new KiB':>9}")
+        for length in [int(size) for size in args.sizes.split(',')]:
+            for label, fields in (('all', KTP_FIELDS), ('5', FEW_FIELDS)):
+                legacy_ms, legacy_mib, legacy_size = timed(legacy_request, session, fields, length, args.repeat)
+                new_ms, new_mib, new_size = timed(projected_request, session, fields, length, args.repeat)
+                results.append({
+                    'rows': length, 'fields': label,
+                    'legacy_ms': round(legacy_ms, 2), 'new_ms': round(new_ms, 2),
+                    'legacy_peak_mib': round(legacy_mib, 2), 'new_peak_mib': round(new_mib, 2),
+                    'legacy_bytes': legacy_size, 'new_bytes': new_size
+                })
+                print(f'{length:>7,}  {label:<8}{legacy_ms:>11.1f}{new_ms:>9.1f}{legacy_ms / new_ms:>8.1f}x'
+                      f'{legacy_mib:>12.1f}{new_mib:>9.1f}{legacy_size / 1024:>12.0f}{new_size / 1024:>9.0f}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': rows, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
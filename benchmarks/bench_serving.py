@@ -0,0 +1,168 @@
+"""
+Side-by-side load test of the sync gunicorn setup and the ASGI mode.
+
+    python -m benchmarks.bench_serving --ocr-requests 200 --ocr-concurrency 200 --ocr-latency 2
+    python -m benchmarks.bench_serving --targets asgi --json results.json
+
+Each target is started as its own gunicorn server on benchmarks.fake_ocr_app,
+where an extraction is a fixed sleep instead of a Gemini call:
+
+- sync: gunicorn -w 4 app:app (the Dockerfile command)
+- asgi: gunicorn -k uvicorn.workers.UvicornWorker -w 1 asgi:app
+
+While the OCR uploads are in flight, CRUD clients loop over the DataTables
+listing and single-record lookups, so the numbers show whether slow
+extractions starve the rest of the API. Point BENCH_DATABASE_URL at a
+database with ktp_records (e.g. loaded with benchmarks.synthetic).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'sync': ['gunicorn', '-w', '{workers}', '-b', '127.0.0.1:{port}', '--timeout', '600',
+             'benchmarks.fake_ocr_app:wsgi_app'],
+    'asgi': ['gunicorn', '-k', 'uvicorn.workers.UvicornWorker', '-w', '{asgi_workers}', '-b', '127.0.0.1:{port}',
+             '--timeout', '600', 'benchmarks.fake_ocr_app:asgi_app'],
+}
+JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 2048 + b'\xff\xd9'
+
+
+def start_server(target, port, args):
+    command = [part.format(port=port, workers=args.workers, asgi_workers=args.asgi_workers)
+               for part in SERVERS[target]]
+    env = dict(os.environ, BENCH_OCR_LATENCY=str(args.ocr_latency))
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/auth/login', timeout=1)
+            return process
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{target} server exited with {process.returncode}')
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f'{target} server did not start')
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else 0,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1) if latencies else 0,
+    }
+
+
+async def run_load(base_url, args):
+    limits = httpx.Limits(max_connections=args.ocr_concurrency + args.crud_concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        await client.post('/auth/register', json={'username': 'bench', 'password': 'bench'})
+        token = (await client.post('/auth/login', json={'username': 'bench', 'password': 'bench'})).json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        listing = (await client.get('/api/ktp', params={'draw': 1, 'length': 50}, headers=headers)).json()
+        niks = [row['nik'] for row in listing.get('data', [])] or ['0']
+
+        ocr_latencies, crud_latencies = [], []
+        errors = {'ocr': 0, 'crud': 0}
+        pending = list(range(args.ocr_requests))
+        done = asyncio.Event()
+
+        async def ocr_client():
+            while pending:
+                pending.pop()
+                started = time.perf_counter()
+                try:
+                    response = await client.post('/api/ocr/extract', headers=headers,
+                                                 files={'file': ('ktp.jpg', JPEG, 'image/jpeg')})
+                    response.raise_for_status()
+                    ocr_latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    errors['ocr'] += 1
+
+        async def crud_client(i):
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    if i % 2:
+                        response = await client.get(f'/api/ktp/{niks[len(crud_latencies) % len(niks)]}',
+                                                    headers=headers)
+                    else:
+                        response = await client.get('/api/ktp', params={'draw': 1, 'length': 10}, headers=headers)
+                    response.raise_for_status()
+                    crud_latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    errors['crud'] += 1
+
+        started = time.perf_counter()
+        crud_tasks = [asyncio.create_task(crud_client(i)) for i in range(args.crud_concurrency)]
+        await asyncio.gather(*[ocr_client() for _ in range(args.ocr_concurrency)])
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*crud_tasks)
+
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'ocr': summarize(ocr_latencies, errors['ocr'], elapsed),
+        'crud': summarize(crud_latencies, errors['crud'], elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default='sync,asgi')
+    parser.add_argument('--ocr-requests', type=int, default=200)
+    parser.add_argument('--ocr-concurrency', type=int, default=200)
+    parser.add_argument('--ocr-latency', type=float, default=2.0, help='seconds per fake extraction')
+    parser.add_argument('--crud-concurrency', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4, help='sync gunicorn workers')
+    parser.add_argument('--asgi-workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for i, target in enumerate(args.targets.split(',')):
+        port = args.port + i
+        process = start_server(target, port, args)
+        try:
+            results[target] = asyncio.run(run_load(f'http://127.0.0.1:{port}', args))
+        finally:
+            process.terminate()
+            process.wait(30)
+
+    print(f"\n{args.ocr_requests} OCR uploads ({args.ocr_concurrency} concurrent, {args.ocr_latency}s each) "
+          f"+ {args.crud_concurrency} CRUD clients\n")
+    print(f"{'target':<8}{'elapsed s':>10}{'ocr rps':>9}{'ocr p50':>9}{'ocr p95':>9}{'ocr err':>8}"
+          f"{'crud rps':>10}{'crud p50':>10}{'crud p95':>10}{'crud err':>9}")
+    for target, r in results.items():
+        print(f"{target:<8}{r['elapsed_s']:>10}{r['ocr']['rps']:>9}{r['ocr']['p50_ms']:>9.0f}{r['ocr']['p95_ms']:>9.0f}"
+              f"{r['ocr']['errors']:>8}{r['crud']['rps']:>10}{r['crud']['p50_ms']:>10.0f}{r['crud']['p95_ms']:>10.0f}"
+              f"{r['crud']['errors']:>9}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Cold start of the app: import time, memory and time to ready per worker.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --workers 4 --runs 3 --json startup.json
+
+import: imports app in a fresh interpreter and reports the import time and
+RSS, then agent_load_s and rss_loaded_mb: what loading agent.py adds (what
+the first extraction of an OCR_AGENT_LOAD=lazy worker waits for, ocr.py).
+
+gunicorn: starts `gunicorn -w N app:app` (the repo's gunicorn.conf.py) with
+GUNICORN_PRELOAD on and off, for every OCR_AGENT_LOAD mode, and reports:
+
+- first_s: from spawn until /healthz first answers;
+- ready_s: until every worker has finished post_worker_init (a wrapper
+  config records when each one did);
+- pss_mb: PSS of master and workers added up (from /proc/<pid>/smaps_rollup)
+  once every worker that loads the agent on its own has done so, the memory
+  the pod really uses;
+- worker_rss_mb / worker_uss_mb: mean per worker, USS being the pages only
+  that worker has (what copy-on-write sharing saves).
+
+The app is never connected to a database or to Gemini; POSTGRES_* get
+placeholder values when unset.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('preload', 'background', 'lazy')
+
+IMPORT_PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+result = {'import_s': imported, 'rss_mb': rss_mb(), 'modules': len(sys.modules)}
+started = time.perf_counter()
+app.ocr_agent.load()
+result['agent_load_s'] = time.perf_counter() - started
+result['rss_loaded_mb'] = rss_mb()
+print(json.dumps(result))
+"""
+
+# Wraps the repo's gunicorn.conf.py to note when each worker is ready
+READY_CONFIG = """
+import os, time
+_path = {conf!r}
+exec(compile(open(_path).read(), _path, 'exec'))
+_post_worker_init = post_worker_init
+
+def post_worker_init(worker):
+    _post_worker_init(worker)
+    with open(os.path.join({markers!r}, str(os.getpid())), 'w') as f:
+        f.write(repr(time.time()))
+"""
+
+
+def environment(mode, preload):
+    env = dict(os.environ, OCR_AGENT_LOAD=mode, GUNICORN_PRELOAD='true' if preload else 'false',
+               PYTHONUNBUFFERED='1')
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    for name, value in (('POSTGRES_USER', 'bench'), ('POSTGRES_PASSWORD', 'bench'), ('POSTGRES_HOST', '127.0.0.1'),
+                        ('POSTGRES_PORT', '5432'), ('POSTGRES_DB', 'bench'), ('GOOGLE_CLOUD_PROJECT', 'bench'),
+                        ('GOOGLE_CLOUD_LOCATION', 'us-central1'), ('GOOGLE_GENAI_USE_VERTEXAI', 'false')):
+        env.setdefault(name, value)
+    return env
+
+
+def measure_import():
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=ROOT, env=environment('lazy', False),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def memory(pid):
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if rest.strip().endswith('kB'):
+                    values[name] = int(rest.split()[0]) / 1024
+    except OSError:
+        return None
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def measure_gunicorn(mode, preload, args):
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as directory:
+        markers = os.path.join(directory, 'ready')
+        os.mkdir(markers)
+        config = os.path.join(directory, 'gunicorn.conf.py')
+        with open(config, 'w') as f:
+            f.write(READY_CONFIG.format(conf=os.path.join(ROOT, 'gunicorn.conf.py'), markers=markers))
+
+        command = [sys.executable, '-m', 'gunicorn', '-c', config, '-w', str(args.workers),
+                   '-b', f'127.0.0.1:{args.port}', 'app:app']
+        started = time.time()
+        process = subprocess.Popen(command, cwd=ROOT, env=environment(mode, preload),
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        loads = []
+        threading.Thread(target=_watch_output, args=(process.stdout, loads), daemon=True).start()
+        try:
+            first = None
+            deadline = started + args.timeout
+            while time.time() < deadline:
+                if process.poll() is not None:
+                    raise RuntimeError(f'gunicorn exited with {process.returncode}')
+                if first is None:
+                    try:
+                        if httpx.get(f'http://127.0.0.1:{args.port}/healthz', timeout=1).status_code == 200:
+                            first = time.time() - started
+                    except httpx.HTTPError:
+                        pass
+                ready = os.listdir(markers)
+                if first is not None and len(ready) >= args.workers:
+                    break
+                time.sleep(0.02)
+            else:
+                raise RuntimeError('workers did not start in time')
+            ready_s = max(float(open(os.path.join(markers, pid)).read()) for pid in ready) - started
+
+            # Workers that load the agent themselves do so after they are ready; wait for them
+            expected = 0 if mode == 'lazy' else 1 if preload and mode == 'preload' else args.workers
+            while len(loads) < expected and time.time() < deadline:
+                time.sleep(0.1)
+            time.sleep(args.settle)
+
+            workers = [memory(pid) for pid in children(process.pid)]
+            workers = [w for w in workers if w]
+            master = memory(process.pid)
+            return {
+                'first_s': round(first, 2),
+                'ready_s': round(ready_s, 2),
+                'pss_mb': round(master['pss'] + sum(w['pss'] for w in workers), 1),
+                'worker_rss_mb': round(statistics.mean(w['rss'] for w in workers), 1),
+                'worker_uss_mb': round(statistics.mean(w['uss'] for w in workers), 1),
+            }
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def _watch_output(stream, loads):
+    for line in stream:
+        if '[AgentLoader] Agent loaded' in line:
+            loads.append(line)
+
+
+def median_of(runs):
+    return {key: round(statistics.median(run[key] for run in runs), 2) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='medians over this many starts')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait before reading memory')
+    parser.add_argument('--timeout', type=float, default=90)
+    parser.add_argument('--port', type=int, default=8093)
+    parser.add_argument('--skip-gunicorn', action='store_true')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    modes = args.modes.split(',')
+
+    results = {'import': median_of([measure_import() for _ in range(args.runs)]), 'gunicorn': {}}
+    print('import  ', ' '.join(f'{k}={v}' for k, v in results['import'].items()))
+
+    if not args.skip_gunicorn:
+        for preload in (False, True):
+            for mode in modes:
+                name = f"{mode} GUNICORN_PRELOAD={'on' if preload else 'off'}"
+                results['gunicorn'][name] = median_of([measure_gunicorn(mode, preload, args) for _ in range(args.runs)])
+                print('gunicorn', name.ljust(32), ' '.join(f'{k}={v}' for k, v in results['gunicorn'][name].items()))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+App entry points for bench_serving with Gemini replaced by a fixed-latency fake.
+
+    gunicorn -w 4 benchmarks.fake_ocr_app:wsgi_app
+    gunicorn -k uvicorn.workers.UvicornWorker -w 1 benchmarks.fake_ocr_app:asgi_app
+
+BENCH_OCR_LATENCY (seconds, default 2) is how long every extraction takes.
+BENCH_DATABASE_URL, if set, replaces the primary and replica databases
+(see benchmarks.bench_app).
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import bench_app
+
+flask_module = bench_app.flask_module
+
+LATENCY = float(os.getenv('BENCH_OCR_LATENCY', 2))
+CANNED = {
+    'nik': '3273014101900001', 'full_name': 'BUDI SANTOSO', 'birth_place': 'BANDUNG',
+    'birth_date': '1990-01-01', 'gender': 'LAKI-LAKI', 'address': 'JL. MERDEKA NO. 1'
+}
+
+
+async def fake_process(file_bytes, mime_type, user_id='system'):
+    await asyncio.sleep(LATENCY)
+    return dict(CANNED)
+
+
+flask_module.ocr_cache.process = fake_process
+flask_module.ocr_cache.enabled = False   # Every request must pay the latency
+
+wsgi_app = bench_app.wsgi_app
+asgi_app = bench_app.asgi_app
@@ -0,0 +1,325 @@
+"""
+Offline load-test suite: the whole API against a local Postgres and a stub Gemini.
+
+    python -m benchmarks.loadtest --populate 100000 --json baseline.json
+    python -m benchmarks.loadtest --target asgi --compare baseline.json
+    python -m benchmarks.loadtest --base-url http://127.0.0.1:5000 --scenarios listing,search,detail
+
+Unless --base-url is given, it starts benchmarks.stub_gemini and the app
+(gunicorn on benchmarks.bench_app, --target sync or asgi) wired to it and to
+BENCH_DATABASE_URL / --database-url, so nothing leaves the machine. The OCR
+extraction cache is switched off so every upload pays the (stubbed) model
+call; the real agent, preprocessing and validation callback still run.
+
+Scenarios run one after another, each with --concurrency clients for
+--duration seconds:
+
+- login     POST /auth/login
+- listing   DataTables page (random page in the first 100)
+- search    DataTables search by name, NIK prefix and address
+- sort      DataTables page ordered by a random column and direction
+- detail    GET /api/ktp/<nik> for random NIKs
+- crud      create, read, update and delete a fresh record
+- ocr       POST /api/ocr/extract with a 12 MP synthetic phone photo
+
+Results (throughput, error count and p50/p95/p99 latency per scenario) are
+printed and, with --json, written as a baseline. --compare checks a run
+against a baseline and exits with status 1 when a scenario's p95 grew or
+its throughput dropped by more than --tolerance.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from benchmarks.bench_serving import percentile
+from benchmarks.synthetic import FIRST_NAMES, LAST_NAMES, STREETS, database_url, populate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ['login', 'listing', 'search', 'sort', 'detail', 'crud', 'ocr']
+SERVERS = {
+    'sync': ['gunicorn', '-w', '{workers}', '-b', '127.0.0.1:{port}', 'benchmarks.bench_app:wsgi_app'],
+    'asgi': ['gunicorn', '-k', 'uvicorn.workers.UvicornWorker', '-w', '{workers}', '-b', '127.0.0.1:{port}',
+             'benchmarks.bench_app:asgi_app'],
+}
+USERNAME = 'loadtest'
+PASSWORD = 'loadtest'
+
+
+# ----------------------------------------------------------------------
+# Servers
+# ----------------------------------------------------------------------
+
+def wait_for(url, process, name, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{name} exited with {process.returncode}')
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f'{name} did not start')
+
+
+def start_stub(args):
+    command = [sys.executable, '-m', 'benchmarks.stub_gemini', '--port', str(args.stub_port),
+               '--latency', str(args.ocr_latency), '--rate-429', str(args.rate_429)]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(f'http://127.0.0.1:{args.stub_port}/stats', process, 'stub_gemini')
+    return process
+
+
+def start_app(args, url):
+    command = [part.format(port=args.port, workers=args.workers) for part in SERVERS[args.target]]
+    env = dict(
+        os.environ,
+        BENCH_DATABASE_URL=url,
+        GOOGLE_GENAI_USE_VERTEXAI='false',
+        GOOGLE_API_KEY='stub',
+        GOOGLE_GEMINI_BASE_URL=f'http://127.0.0.1:{args.stub_port}/',
+        OCR_CACHE_ENABLED='true' if args.ocr_cache else 'false',
+    )
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(f'http://127.0.0.1:{args.port}/healthz', process, args.target)
+    return process
+
+
+# ----------------------------------------------------------------------
+# Scenarios: each issues the requests of one iteration
+# ----------------------------------------------------------------------
+
+class Context:
+
+    def __init__(self, client, headers, niks, photo):
+        self.client = client
+        self.headers = headers
+        self.niks = niks
+        self.photo = photo
+
+
+def _datatables(**params):
+    return dict({'draw': 1, 'start': 0, 'length': 10}, **params)
+
+
+async def login(ctx, rng):
+    return [await ctx.client.post('/auth/login', json={'username': USERNAME, 'password': PASSWORD})]
+
+
+async def listing(ctx, rng):
+    params = _datatables(start=rng.randrange(100) * 10)
+    return [await ctx.client.get('/api/ktp', params=params, headers=ctx.headers)]
+
+
+async def search(ctx, rng):
+    term = rng.choice([
+        rng.choice(FIRST_NAMES),
+        f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+        rng.choice(ctx.niks)[:rng.choice([4, 6, 8])],
+        rng.choice(STREETS).split()[0],
+    ])
+    return [await ctx.client.get('/api/ktp', params=_datatables(**{'search[value]': term}), headers=ctx.headers)]
+
+
+async def sort(ctx, rng):
+    params = _datatables(**{'order[0][column]': rng.randrange(7), 'order[0][dir]': rng.choice(['asc', 'desc'])})
+    return [await ctx.client.get('/api/ktp', params=params, headers=ctx.headers)]
+
+
+async def detail(ctx, rng):
+    return [await ctx.client.get(f'/api/ktp/{rng.choice(ctx.niks)}', headers=ctx.headers)]
+
+
+async def crud(ctx, rng):
+    # 99 prefix keeps test records apart from synthetic ones (real province codes)
+    nik = f'99{rng.randrange(10 ** 14):014d}'
+    record = {
+        'nik': nik, 'full_name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', 'birth_place': 'BANDUNG',
+        'birth_date': '1990-01-01', 'gender': 'LAKI-LAKI', 'address': f'JL. {rng.choice(STREETS)} NO. 1'
+    }
+    responses = [await ctx.client.post('/api/ktp', json=record, headers=ctx.headers)]
+    responses.append(await ctx.client.get(f'/api/ktp/{nik}', headers=ctx.headers))
+    responses.append(await ctx.client.put(f'/api/ktp/{nik}', json={'occupation': 'WIRASWASTA'},
+                                          headers=ctx.headers))
+    responses.append(await ctx.client.delete(f'/api/ktp/{nik}', headers=ctx.headers))
+    return responses
+
+
+async def ocr(ctx, rng):
+    files = {'file': ('ktp.jpg', ctx.photo, 'image/jpeg')}
+    return [await ctx.client.post('/api/ocr/extract', files=files, headers=ctx.headers)]
+
+
+async def run_scenario(ctx, scenario, concurrency, duration, seed):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client(i):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + i)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                responses = await scenario(ctx, rng)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            if any(r.status_code >= 400 for r in responses):
+                errors += 1
+            else:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        'iterations': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+async def run_suite(base_url, args):
+    from benchmarks.bench_preprocess import synthetic_photo
+
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        await client.post('/auth/register', json={'username': USERNAME, 'password': PASSWORD})
+        token = (await client.post('/auth/login', json={'username': USERNAME, 'password': PASSWORD})).json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        page = (await client.get('/api/ktp', params=_datatables(length=500), headers=headers)).json()
+        niks = [row['nik'] for row in page.get('data', [])]
+        if not niks:
+            raise SystemExit('ktp_records is empty; load it with --populate ROWS')
+        ctx = Context(client, headers, niks, synthetic_photo() if 'ocr' in args.scenarios else None)
+
+        results = {}
+        for name in args.scenarios:
+            concurrency = args.ocr_concurrency if name == 'ocr' else args.concurrency
+            results[name] = await run_scenario(ctx, globals()[name], concurrency, args.duration, args.seed)
+            r = results[name]
+            print(f"{name:<9}{concurrency:>6}{r['iterations']:>8}{r['errors']:>7}{r['rps']:>9}"
+                  f"{_ms(r['p50_ms'])}{_ms(r['p95_ms'])}{_ms(r['p99_ms'])}", flush=True)
+        return results
+
+
+def _ms(value):
+    return f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+
+
+# ----------------------------------------------------------------------
+# Baselines
+# ----------------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Prints per-scenario changes against `baseline`; returns the regressed scenario names."""
+    regressions = []
+    print(f"\n{'scenario':<9}{'p95 ms':>10}{'baseline':>10}{'change':>9}{'rps':>9}{'baseline':>10}{'change':>9}")
+    for name, r in results.items():
+        b = baseline.get('scenarios', {}).get(name)
+        if not b or not b.get('p95_ms') or not r.get('p95_ms') or not b.get('rps'):
+            continue
+        p95_change = r['p95_ms'] / b['p95_ms'] - 1
+        rps_change = r['rps'] / b['rps'] - 1
+        regressed = p95_change > tolerance or rps_change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<9}{r['p95_ms']:>10.1f}{b['p95_ms']:>10.1f}{p95_change:>+9.0%}"
+              f"{r['rps']:>9}{b['rps']:>10}{rps_change:>+9.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help='test an already running server instead of starting one')
+    parser.add_argument('--target', choices=sorted(SERVERS), default='sync')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--stub-port', type=int, default=8090)
+    parser.add_argument('--database-url')
+    parser.add_argument('--populate', type=int, metavar='ROWS',
+                        help='truncate and load ROWS synthetic records first (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=20, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--ocr-concurrency', type=int, default=8)
+    parser.add_argument('--ocr-latency', type=float, default=1.5, help='median stub Gemini latency in seconds')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of stub Gemini calls answered with 429')
+    parser.add_argument('--ocr-cache', action='store_true', help='keep the OCR extraction cache on')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed p95/throughput change')
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    url = database_url(args.database_url)
+    if args.populate:
+        count, elapsed = populate(url, args.populate, truncate=True)
+        print(f'Loaded {count:,} rows in {elapsed:.1f}s')
+
+    processes = []
+    try:
+        if args.base_url:
+            base_url = args.base_url
+        else:
+            processes.append(start_stub(args))
+            processes.append(start_app(args, url))
+            base_url = f'http://127.0.0.1:{args.port}'
+        print(f"\n{'scenario':<9}{'conc':>6}{'iters':>8}{'errors':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        results = asyncio.run(run_suite(base_url, args))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(30)
+
+    report = {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('json', 'compare')},
+        'scenarios': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Local stand-in for the Gemini API, so benchmarks never pay for (or wait on) live calls.
+
+    python -m benchmarks.stub_gemini --port 8090 --latency 1.5 --rate-429 0.05
+
+Point the app at it with the Gemini Developer API settings google-genai reads
+from the environment (benchmarks.loadtest does this for the servers it starts):
+
+    GOOGLE_GENAI_USE_VERTEXAI=false GOOGLE_API_KEY=stub GOOGLE_GEMINI_BASE_URL=http://127.0.0.1:8090/
+
+Every `models/<model>:generateContent` (and `:streamGenerateContent`) call
+takes a log-normally distributed latency (median --latency, spread
+--latency-sigma) and answers like Gemini does; streamed answers send their
+first chunk after --first-chunk of that latency and spread the rest over
+the chunks:
+
+- extraction requests (the agent in agent.py) get a KTPExtractionResult JSON
+  for a synthetic card, sometimes wrapped in ```json fences
+  (--fenced-ratio) so strip_code_fences is exercised. Only the fields of
+  the request's response schema are returned; if it asks for per-field
+  confidence (the tiered engine), --low-confidence of the answers rate one
+  field below 0.8. Pro models take --pro-latency times longer;
+- search-grounded validation requests (agent.llm_validate_ktp) get the
+  input JSON echoed back;
+- a fraction of calls fail with 429 RESOURCE_EXHAUSTED (--rate-429) or 503
+  (--rate-503) before the latency, which is what retry_config retries.
+
+GET /stats returns call counts for the run.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from benchmarks.synthetic import generate_rows
+
+EXTRACTION_FIELDS = [
+    'nik', 'full_name', 'birth_place', 'birth_date', 'gender', 'blood_type', 'address', 'rt_rw',
+    'village_kelurahan', 'district_kecamatan', 'religion', 'marital_status', 'occupation',
+    'citizenship', 'expiry_date'
+]
+_INPUT_JSON = re.compile(r'Input JSON:\s*(\{.*\})', re.S)
+
+
+class StubGemini:
+
+    def __init__(self, latency=1.5, latency_sigma=0.35, rate_429=0.0, rate_503=0.0, fenced_ratio=0.3,
+                 seed=42, cards=1000, first_chunk=0.2, low_confidence=0.1, pro_latency=2.5):
+        self.latency = latency
+        self.low_confidence = low_confidence
+        self.pro_latency = pro_latency
+        self.first_chunk = first_chunk
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.fenced_ratio = fenced_ratio
+        self.rng = random.Random(seed)
+        self.cards = [
+            {f: row[f].isoformat() if f == 'birth_date' else row[f] for f in EXTRACTION_FIELDS}
+            for row in generate_rows(cards, seed=seed)
+        ]
+        self.counts = {'calls': 0, 'extraction': 0, 'validation': 0, '429': 0, '503': 0}
+        self.app = Starlette(routes=[
+            Route('/{path:path}:generateContent', self.generate_content, methods=['POST']),
+            Route('/{path:path}:streamGenerateContent', self.stream_generate_content, methods=['POST']),
+            Route('/stats', self.stats, methods=['GET']),
+        ])
+
+    async def generate_content(self, request: Request):
+        error = await self._respond_or_fail(request, self._latency(request.path_params['path']))
+        if error is not None:
+            return error
+        return JSONResponse(self._response(await request.json(), model=request.path_params['path']))
+
+    async def stream_generate_content(self, request: Request):
+        latency = self._latency(request.path_params['path'])
+        error = await self._respond_or_fail(request, latency * self.first_chunk)
+        if error is not None:
+            return error
+        response = self._response(await request.json(), model=request.path_params['path'])
+        text = response['candidates'][0]['content']['parts'][0]['text']
+
+        async def chunks():
+            # A few SSE chunks, like the real stream, with the finish reason on the last one
+            pieces = [text[i:i + 64] for i in range(0, len(text), 64)] or ['']
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(latency * (1 - self.first_chunk) / (len(pieces) - 1))
+                chunk = {'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]}}]}
+                if i == len(pieces) - 1:
+                    chunk['candidates'][0]['finishReason'] = 'STOP'
+                    chunk['usageMetadata'] = response['usageMetadata']
+                yield f'data: {json.dumps(chunk)}\r\n\r\n'
+
+        return StreamingResponse(chunks(), media_type='text/event-stream')
+
+    async def stats(self, request):
+        return JSONResponse(self.counts)
+
+    async def _respond_or_fail(self, request, latency):
+        self.counts['calls'] += 1
+        roll = self.rng.random()
+        if roll < self.rate_429:
+            self.counts['429'] += 1
+            return _error(429, 'RESOURCE_EXHAUSTED', 'Resource exhausted. Please try again later.')
+        if roll < self.rate_429 + self.rate_503:
+            self.counts['503'] += 1
+            return _error(503, 'UNAVAILABLE', 'The model is overloaded. Please try again later.')
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return None
+
+    def _latency(self, model):
+        if self.latency <= 0:
+            return 0.0
+        latency = self.rng.lognormvariate(math.log(self.latency), self.latency_sigma)
+        return latency * self.pro_latency if '-pro' in model else latency
+
+    def _response(self, body, model):
+        parts = [part for content in body.get('contents', []) for part in content.get('parts', [])]
+        prompt = ' '.join(part.get('text', '') for part in parts)
+        match = _INPUT_JSON.search(prompt)
+        if body.get('tools') and match:
+            # agent.llm_validate_ktp: echo the record back as "validated"
+            self.counts['validation'] += 1
+            text = match.group(1)
+        else:
+            self.counts['extraction'] += 1
+            text = json.dumps(self._extraction(body), ensure_ascii=False)
+            if self.rng.random() < self.fenced_ratio:
+                text = f'```json\n{text}\n```'
+        # Roughly what Gemini bills: ~4 characters per token, 258 tokens per image
+        prompt_tokens = len(prompt) // 4 + 258 * sum('inlineData' in part for part in parts)
+        return {
+            'candidates': [{
+                'content': {'role': 'model', 'parts': [{'text': text}]},
+                'finishReason': 'STOP',
+                'index': 0
+            }],
+            'usageMetadata': {
+                'promptTokenCount': prompt_tokens,
+                'candidatesTokenCount': len(text) // 4,
+                'totalTokenCount': prompt_tokens + len(text) // 4
+            },
+            'modelVersion': model.rsplit('/', 1)[-1]
+        }
+
+    def _extraction(self, body):
+        card = self.rng.choice(self.cards)
+        config = body.get('generationConfig') or {}
+        schema = config.get('responseSchema') or config.get('responseJsonSchema') or {}
+        properties = schema.get('properties') or {}
+        answer = {f: v for f, v in card.items() if f in properties} if properties else dict(card)
+        if 'confidence' in properties:
+            answer['confidence'] = {f: round(self.rng.uniform(0.85, 1.0), 2) for f in EXTRACTION_FIELDS}
+            if self.rng.random() < self.low_confidence:
+                answer['confidence'][self.rng.choice(EXTRACTION_FIELDS)] = round(self.rng.uniform(0.3, 0.7), 2)
+        return answer
+
+
+def _error(code, status, message):
+    return JSONResponse({'error': {'code': code, 'message': message, 'status': status}}, status_code=code)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=1.5, help='median seconds per call')
+    parser.add_argument('--latency-sigma', type=float, default=0.35, help='log-normal spread (0 = fixed)')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of calls answered with 429')
+    parser.add_argument('--rate-503', type=float, default=0.0, help='fraction of calls answered with 503')
+    parser.add_argument('--first-chunk', type=float, default=0.2,
+                        help='fraction of the latency before the first streamed chunk')
+    parser.add_argument('--fenced-ratio', type=float, default=0.3, help='fraction of answers in ```json fences')
+    parser.add_argument('--low-confidence', type=float, default=0.1,
+                        help='fraction of confidence-rated answers with one uncertain field')
+    parser.add_argument('--pro-latency', type=float, default=2.5, help='latency multiplier for Pro models')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    stub = StubGemini(latency=args.latency, latency_sigma=args.latency_sigma, rate_429=args.rate_429,
+                      rate_503=args.rate_503, fenced_ratio=args.fenced_ratio, seed=args.seed,
+                      first_chunk=args.first_chunk, low_confidence=args.low_confidence,
+                      pro_latency=args.pro_latency)
+    uvicorn.run(stub.app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def replica_binds(user, password, hosts, port, name):
+    binds = {}
+    for i, host in enumerate(h.strip() for h in str(hosts).split(',') if h.strip()):
+        address = host if ':' in host else f"{host}:{port}"
+        # FIX 2: Tambahkan juga di Replica
+        binds['replica' if i == 0 else f'replica_{i + 1}'] = f"postgresql://{user}:{password}@{address}/{name}?sslmode=require"
+    return binds
+
 class Config:
     # Primary Database (Write)
     DB_USER = os.getenv('POSTGRES_USER')
@@ -21,10 +29,100 @@ class Config:
     REP_PORT = os.getenv('POSTGRES_PORT_REPLICA') or DB_PORT
     REP_NAME = os.getenv('POSTGRES_DB_REPLICA') or DB_NAME
 
-    # FIX 2: Tambahkan juga di Replica
-    SQLALCHEMY_BINDS = {
-        'replica': f"postgresql://{REP_USER}:{REP_PASS}@{REP_HOST}:{REP_PORT}/{REP_NAME}?sslmode=require"
-    }
+    # POSTGRES_HOST_REPLICA may list several replicas (host1,host2:5433), bound as 'replica', 'replica_2', ...
+    SQLALCHEMY_BINDS = replica_binds(REP_USER, REP_PASS, REP_HOST, REP_PORT, REP_NAME)
+
+    # Read routing (replication.py)
+    REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 10))                  # Seconds; lagging replicas are skipped
+    REPLICA_PROBE_INTERVAL = float(os.getenv('REPLICA_PROBE_INTERVAL', 5))     # Seconds between health/lag probes
+    READ_YOUR_WRITES_WINDOW = float(os.getenv('READ_YOUR_WRITES_WINDOW', 10))  # Seconds reads stay on the primary after a write
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pools, per worker process and per bind (primary and every replica)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))     # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))     # Seconds; stay under proxy/load balancer idle timeouts
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+    # ASGI mode (asgi.py): asyncpg pools; one worker serves many concurrent requests so they are larger
+    ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', 20))
+    ASYNC_DB_MAX_OVERFLOW = int(os.getenv('ASYNC_DB_MAX_OVERFLOW', 20))
+    ASYNC_DB_COMMAND_TIMEOUT = float(os.getenv('ASYNC_DB_COMMAND_TIMEOUT', 30))   # Seconds per statement
     SECRET_KEY = os.getenv('SECRET_KEY', 'default_secret_key_for_poc')
+
+    # When the extraction agent is imported (ocr.py): 'preload' (gunicorn master before forking,
+    # shared by the workers), 'background' (thread started with each worker) or 'lazy' (first extraction)
+    OCR_AGENT_LOAD = os.getenv('OCR_AGENT_LOAD', 'preload')
+
+    # Kemendagri regency/district table for the NIK checks (ktp_validator.py); the image sets this to true
+    KTP_REGION_TABLE_REQUIRED = os.getenv('KTP_REGION_TABLE_REQUIRED', 'false').lower() in ('1', 'true', 'yes')
+
+    # OCR job queue (POST /api/ocr/extract?mode=job)
+    OCR_JOB_WORKERS = int(os.getenv('OCR_JOB_WORKERS', 8))          # Concurrent process_document calls per worker process
+    OCR_JOB_QUEUE_SIZE = int(os.getenv('OCR_JOB_QUEUE_SIZE', 100))  # Uploads waiting for a free slot before returning 503
+    OCR_JOB_TTL = int(os.getenv('OCR_JOB_TTL', 3600))               # Seconds a finished job and its result are kept
+    OCR_JOB_HEARTBEAT = int(os.getenv('OCR_JOB_HEARTBEAT', 30))     # Seconds between heartbeats; jobs silent for 4x this are failed
+    OCR_JOB_MAX_WAIT = float(os.getenv('OCR_JOB_MAX_WAIT', 25))     # Long-poll cap, kept below the gunicorn timeout
+
+    # Multi-page PDFs and TIFFs (documents.py): pages are cut into cards and extracted separately
+    OCR_SPLIT_ENABLED = os.getenv('OCR_SPLIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    OCR_PAGE_CONCURRENCY = int(os.getenv('OCR_PAGE_CONCURRENCY', 4))   # Pages rendered and extracted at once per document
+    OCR_MAX_PAGES = int(os.getenv('OCR_MAX_PAGES', 20))                # Longer documents are rejected with 400
+
+    # OCR extraction result cache (keyed by hash of the uploaded file)
+    OCR_CACHE_ENABLED = os.getenv('OCR_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', 256))          # In-process LRU entries per worker
+    OCR_CACHE_TTL = int(os.getenv('OCR_CACHE_TTL', 86400))          # Seconds, for both the LRU and the ocr_extraction_cache table
+    OCR_CACHE_PERSISTENT = os.getenv('OCR_CACHE_PERSISTENT', 'true').lower() in ('1', 'true', 'yes')
+    OCR_CACHE_FOLLOWER_TIMEOUT = float(os.getenv('OCR_CACHE_FOLLOWER_TIMEOUT', 300))  # Seconds an identical upload waits for the extraction already running
+
+    # Single-record cache for GET /api/ktp/<nik> (ktp_cache.py)
+    KTP_CACHE_ENABLED = os.getenv('KTP_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    KTP_CACHE_SIZE = int(os.getenv('KTP_CACHE_SIZE', 10000))        # Records per worker
+    KTP_CACHE_TTL = int(os.getenv('KTP_CACHE_TTL', 60))             # Seconds; capped at REPLICA_MAX_LAG when invalidation is 'local'
+    KTP_CACHE_INVALIDATION = os.getenv('KTP_CACHE_INVALIDATION', '')   # 'postgres' (NOTIFY to all pods) or 'local' (this worker); empty picks postgres on Postgres
+
+    # Admission control for Gemini calls shared by all workers (admission.py)
+    GEMINI_ADMISSION_ENABLED = os.getenv('GEMINI_ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    GEMINI_ADMISSION_STORE = os.getenv('GEMINI_ADMISSION_STORE', 'file')     # 'local' (worker), 'file' (pod) or 'postgres' (all pods)
+    GEMINI_ADMISSION_FILE = os.getenv('GEMINI_ADMISSION_FILE', '/tmp/ktp-gemini-admission.json')
+    GEMINI_RPM = float(os.getenv('GEMINI_RPM', 300))                        # Model calls per minute across the store (tiered and the LLM fallback make several per extraction); match the Vertex quota
+    GEMINI_BURST = int(os.getenv('GEMINI_BURST', 20))                       # Calls that may start at once after an idle period
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 32))   # Upper bound of the adaptive concurrency limit
+    GEMINI_MIN_CONCURRENCY = int(os.getenv('GEMINI_MIN_CONCURRENCY', 1))
+    GEMINI_LATENCY_TARGET = float(os.getenv('GEMINI_LATENCY_TARGET', 15))   # Seconds; slower calls shrink the concurrency limit
+    GEMINI_THROTTLE_BACKOFF = float(os.getenv('GEMINI_THROTTLE_BACKOFF', 5))  # Seconds nothing is admitted after a 429
+    GEMINI_BATCH_SHARE = float(os.getenv('GEMINI_BATCH_SHARE', 0.5))        # Fraction of concurrency and burst that jobs and batches may use
+    GEMINI_INTERACTIVE_MAX_WAIT = float(os.getenv('GEMINI_INTERACTIVE_MAX_WAIT', 2))   # Seconds before POST /api/ocr/extract answers 503
+    GEMINI_BATCH_MAX_WAIT = float(os.getenv('GEMINI_BATCH_MAX_WAIT', 120))  # Seconds a job or batch item waits before failing
+
+    # Batch OCR (POST /api/ocr/extract/batch)
+    OCR_BATCH_CONCURRENCY = int(os.getenv('OCR_BATCH_CONCURRENCY', 4))   # Max process_document calls in flight per batch
+    OCR_BATCH_MAX_RPS = float(os.getenv('OCR_BATCH_MAX_RPS', 2))         # Max Gemini call starts per second per batch, 0 = unlimited
+    OCR_BATCH_MAX_FILES = int(os.getenv('OCR_BATCH_MAX_FILES', 100))
+    OCR_BATCH_ITEM_TIMEOUT = float(os.getenv('OCR_BATCH_ITEM_TIMEOUT', 300))  # Seconds without any item finishing before the rest are reported failed
+    OCR_BATCH_MAX_BYTES = int(os.getenv('OCR_BATCH_MAX_BYTES', 200 * 1024 * 1024))  # Uncompressed size of all zip members in a batch, 0 = unlimited
+
+    # DataTables listing: below this many (estimated) rows counts are exact, above they come from the planner
+    LISTING_EXACT_COUNT_BELOW = int(os.getenv('LISTING_EXACT_COUNT_BELOW', 10000))
+
+    # Streaming export (GET /api/ktp/export): rows fetched per server-side cursor round trip and per response chunk
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 2000))
+    EXPORT_MAX_SECONDS = int(os.getenv('EXPORT_MAX_SECONDS', 1800))  # An export still streaming after this is aborted, 0 = unlimited
+
+    # Dashboard counts (GET /api/ktp/stats): seconds between folds of ktp_stats_delta into ktp_stats
+    KTP_STATS_FOLD_INTERVAL = float(os.getenv('KTP_STATS_FOLD_INTERVAL', 5))
+
+    # Bulk import (POST /api/ktp/import, flask import-ktp)
+    IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))   # Rows per COPY + merge transaction
+    IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', 1000))   # Per-row errors kept in the import status
+    IMPORT_HEARTBEAT = int(os.getenv('IMPORT_HEARTBEAT', 30))       # Seconds between heartbeats; imports silent for 4x this are failed
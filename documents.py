@@ -0,0 +1,126 @@
+import asyncio
+import os
+import tempfile
+
+import metrics
+import preprocess
+
+
+class DocumentError(ValueError):
+    """Raised for a PDF or TIFF that cannot be read or has too many pages."""
+
+
+class DocumentSplitter:
+    """
+    Splits multi-page documents in front of `process_document`.
+
+    PDFs and TIFFs may hold several KTPs: one per page, or several cards
+    scanned onto one page. The upload is spooled to a temporary file once,
+    then every page is rendered in the preprocess pool and cut into its cards
+    (preprocess.render_cards). Each card goes through `process` on its own
+    (normally ExtractionCache.process_document, so cards are cached and
+    admitted individually). At most OCR_PAGE_CONCURRENCY pages are rendered and
+    extracted at a time, so long documents never sit rasterized in memory.
+
+    A document with a single card is passed to `process` unchanged, as before.
+    Otherwise the result is `{'pages': n, 'cards': [{'page', 'card', 'data'}]}`
+    in page order, one entry per card.
+    """
+
+    def __init__(self, app=None, process=None):
+        self.process = process
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('OCR_SPLIT_ENABLED', True)
+        self.concurrency = max(1, app.config.get('OCR_PAGE_CONCURRENCY', 4))
+        self.max_pages = app.config.get('OCR_MAX_PAGES', 20)
+        app.extensions['ocr_documents'] = self
+
+    async def process_document(self, file_bytes, mime_type, user_id="system", engine=None):
+        """Drop-in replacement for `process_document` that splits PDFs and TIFFs into cards."""
+        if not self.enabled or not file_bytes or mime_type not in preprocess.PAGED_MIME_TYPES:
+            return await self.process(file_bytes=file_bytes, mime_type=mime_type, user_id=user_id, engine=engine)
+
+        path = await asyncio.to_thread(_spool, file_bytes)
+        try:
+            try:
+                pages = await preprocess.run_in_pool(preprocess.page_count, path, mime_type)
+                first = await self._render(path, mime_type, 0) if pages == 1 else None
+            except Exception as e:
+                raise DocumentError(f'Could not read the document: {e}')
+            if pages > self.max_pages:
+                raise DocumentError(f'Documents may have at most {self.max_pages} pages')
+            if first is not None and len(first) == 1:
+                # One card: same request (and cache entry) as before splitting
+                return await self.process(file_bytes=file_bytes, mime_type=mime_type, user_id=user_id, engine=engine)
+            cards = await self._extract_pages(path, mime_type, pages, first, user_id, engine)
+        finally:
+            await asyncio.to_thread(os.unlink, path)
+        return {'pages': pages, 'cards': cards}
+
+    async def check_single_card(self, file_bytes, mime_type):
+        """
+        Raises DocumentError for a PDF or TIFF with more than one card, for
+        routes that extract one record from the upload as a whole (the SSE
+        stream) and would otherwise send every card to Gemini at once.
+        """
+        if not self.enabled or not file_bytes or mime_type not in preprocess.PAGED_MIME_TYPES:
+            return
+        path = await asyncio.to_thread(_spool, file_bytes)
+        try:
+            try:
+                pages = await preprocess.run_in_pool(preprocess.page_count, path, mime_type)
+                cards = len(await self._render(path, mime_type, 0)) if pages == 1 else None
+            except Exception as e:
+                raise DocumentError(f'Could not read the document: {e}')
+        finally:
+            await asyncio.to_thread(os.unlink, path)
+        if pages > 1:
+            raise DocumentError(f'The document has {pages} pages; send it to /api/ocr/extract to get every card')
+        if cards > 1:
+            raise DocumentError(f'The document holds {cards} cards; send it to /api/ocr/extract to get every card')
+
+    # ------------------------------------------------------------------
+
+    async def _render(self, path, mime_type, index):
+        with metrics.stage('render'):
+            return await preprocess.run_in_pool(preprocess.render_cards, path, mime_type, index)
+
+    async def _extract_pages(self, path, mime_type, pages, first, user_id, engine):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def extract_page(index):
+            async with semaphore:
+                cards = first if index == 0 and first is not None else await self._render(path, mime_type, index)
+                results = await asyncio.gather(*(
+                    self.process(file_bytes=card, mime_type='image/jpeg', user_id=user_id, engine=engine)
+                    for card in cards
+                ), return_exceptions=True)
+            return [(index, n, result) for n, result in enumerate(results)]
+
+        per_page = await asyncio.gather(*(extract_page(index) for index in range(pages)))
+        results = [entry for page in per_page for entry in page]
+
+        # Every card failed (e.g. admission.SaturatedError): let the route answer for it
+        failures = [result for _, _, result in results if isinstance(result, Exception)]
+        if failures and len(failures) == len(results):
+            raise failures[0]
+        return [
+            {
+                'page': index + 1,
+                'card': n + 1,
+                'data': {'error': str(result)} if isinstance(result, Exception) else result
+            }
+            for index, n, result in results
+        ]
+
+
+def _spool(file_bytes):
+    # Pool workers open the document by path instead of receiving it with every page
+    with tempfile.NamedTemporaryFile(prefix='ktp-document-', delete=False) as f:
+        f.write(file_bytes)
+        return f.name
@@ -0,0 +1,124 @@
+"""
+Streaming export of ktp_records as NDJSON or CSV.
+
+Rows are read through a server-side cursor (`yield_per`) as plain column
+tuples, without building ORM objects, and written out in chunks, so memory
+stays constant regardless of table size.
+
+A large export streams for minutes. The gunicorn workers are threaded
+(gunicorn.conf.py), so the worker timeout does not cut it off; instead
+EXPORT_MAX_SECONDS bounds how long one export may hold a thread and a
+connection. An export that runs out of time is aborted, not finished early:
+the response ends without its last chunk, so the client sees a broken
+transfer rather than a file that looks complete.
+"""
+import csv
+import datetime
+import io
+import time
+
+from sqlalchemy import select
+
+from models import db, KtpRecord
+from serialization import KTP_FIELDS, dumps, projection
+
+class ExportTimeoutError(Exception):
+    """Raised inside the stream when an export runs past its max_seconds."""
+
+
+EXPORT_FIELDS = KTP_FIELDS
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} must be YYYY-MM-DD')
+
+
+def apply_ktp_filters(query, args):
+    """
+    Applies the export/stats filters from request args to a KtpRecord query or select:
+    district, village, gender, religion (exact), birth_date_from/to and
+    updated_from/to (YYYY-MM-DD, inclusive). Raises ValueError for bad dates.
+    """
+    for arg, column in (('district', KtpRecord.district_kecamatan),
+                        ('village', KtpRecord.village_kelurahan),
+                        ('gender', KtpRecord.gender),
+                        ('religion', KtpRecord.religion)):
+        if args.get(arg):
+            query = query.filter(column == args[arg])
+
+    birth_from, birth_to = _parse_date(args, 'birth_date_from'), _parse_date(args, 'birth_date_to')
+    if birth_from:
+        query = query.filter(KtpRecord.birth_date >= birth_from)
+    if birth_to:
+        query = query.filter(KtpRecord.birth_date <= birth_to)
+
+    updated_from, updated_to = _parse_date(args, 'updated_from'), _parse_date(args, 'updated_to')
+    if updated_from:
+        query = query.filter(KtpRecord.updated_at >= updated_from)
+    if updated_to:
+        query = query.filter(KtpRecord.updated_at < updated_to + datetime.timedelta(days=1))
+    return query
+
+
+def _plain(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def stream_export(fields, args, fmt='ndjson', chunk_rows=1000, max_seconds=0):
+    """
+    Generator of NDJSON (bytes) or CSV (str) chunks for the rows matching `args`.
+    Call apply_ktp_filters once beforehand to validate `args`. After
+    `max_seconds` (0 disables) it raises ExportTimeoutError before the next chunk.
+    """
+    stmt = select(*projection(fields)).order_by(KtpRecord.nik)
+    stmt = apply_ktp_filters(stmt, args).execution_options(yield_per=chunk_rows)
+
+    started = time.monotonic()
+    count = 0
+
+    def check_deadline():
+        if max_seconds and time.monotonic() - started > max_seconds:
+            print(f"[Export] Aborted after {count} rows ({fmt}): longer than {max_seconds}s")
+            raise ExportTimeoutError(f'Export took longer than {max_seconds}s')
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for row in db.session.execute(stmt):
+            writer.writerow([_plain(v) for v in row])
+            count += 1
+            if count % chunk_rows == 0:
+                check_deadline()
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        lines = []
+        for row in db.session.execute(stmt):
+            lines.append(dumps(dict(zip(fields, row))))
+            count += 1
+            if count % chunk_rows == 0:
+                check_deadline()
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+
+    elapsed = time.monotonic() - started
+    rate = count / elapsed if elapsed else 0
+    print(f"[Export] {count} rows ({fmt}) in {elapsed:.1f}s, {rate:.0f} rows/s")
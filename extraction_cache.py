@@ -0,0 +1,242 @@
+import asyncio
+import concurrent.futures
+import copy
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, OcrExtractionCache
+from ocr import resolve_engine
+
+
+class _LeaderGone(Exception):
+    """Set on a single-flight future whose leader was cancelled before it finished."""
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache in front of `process_document`.
+
+    Results are keyed by sha256(extraction version + engine + mime type + file
+    bytes) and looked up in a bounded in-process LRU first, then in the shared
+    `ocr_extraction_cache` table. Identical uploads that arrive while the first
+    one is still being extracted with the same engine wait for that extraction
+    instead of starting their own LLM call (single-flight, also across request
+    threads). Engines do not share entries: 'tiered' re-reads fields with Pro
+    and is asked for precisely when a Flash-only result is not good enough.
+    """
+
+    def __init__(self, app=None, process=None, version=''):
+        self.process = process
+        self.version = version
+        self.app = None
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._stores = 0
+        self.counters = {
+            'memory_hits': 0,
+            'persistent_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('OCR_CACHE_ENABLED', True)
+        self.max_entries = app.config.get('OCR_CACHE_SIZE', 256)
+        self.ttl = app.config.get('OCR_CACHE_TTL', 86400)
+        self.persistent = app.config.get('OCR_CACHE_PERSISTENT', True)
+        self.follower_timeout = app.config.get('OCR_CACHE_FOLLOWER_TIMEOUT', 300)
+        app.extensions['ocr_cache'] = self
+
+    def key(self, file_bytes, mime_type, engine=None):
+        h = hashlib.sha256()
+        h.update(self.version.encode())
+        h.update(b'\0')
+        h.update(resolve_engine(engine).encode())
+        h.update(b'\0')
+        h.update((mime_type or '').encode())
+        h.update(b'\0')
+        h.update(file_bytes or b'')
+        return h.hexdigest()
+
+    async def process_document(self, file_bytes, mime_type, user_id="system", engine=None):
+        """
+        Drop-in replacement for `agent.process_document` that goes through the cache.
+        """
+        if not self.enabled:
+            return await self.process(file_bytes=file_bytes, mime_type=mime_type, user_id=user_id, engine=engine)
+
+        key = self.key(file_bytes, mime_type, engine)
+        result = self._memory_get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return copy.deepcopy(result)
+
+        # Single-flight: the first caller for a key computes, the rest await its future
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            try:
+                # shield: a follower that gives up must not cancel the future the others share
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.follower_timeout)
+            except _LeaderGone:
+                # The leader's client went away (or it timed out); extract for this caller instead
+                return await self.process_document(file_bytes, mime_type, user_id=user_id, engine=engine)
+            return copy.deepcopy(result)
+
+        try:
+            result = await self._load_or_compute(key, file_bytes, mime_type, user_id, engine)
+            future.set_result(result)
+            return copy.deepcopy(result)
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            if not future.done():
+                # Cancelled (a BaseException): release the followers rather than leave them waiting
+                future.set_exception(_LeaderGone())
+                future.exception()
+
+    async def lookup(self, file_bytes, mime_type, engine=None):
+        """The cached result for this upload and engine, or None; never starts an extraction."""
+        if not self.enabled:
+            return None
+        key = self.key(file_bytes, mime_type, engine)
+        result = self._memory_get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return copy.deepcopy(result)
+        result = await self._persistent_lookup(key)
+        self._count('persistent_hits' if result is not None else 'misses')
+        return copy.deepcopy(result) if result is not None else None
+
+    async def store(self, file_bytes, mime_type, result, engine=None):
+        """Caches a result computed outside process_document (e.g. a streamed extraction)."""
+        if self.enabled and isinstance(result, dict) and 'error' not in result:
+            await self._store(self.key(file_bytes, mime_type, engine), mime_type, copy.deepcopy(result))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._memory)
+            stats['inflight'] = len(self._inflight)
+        lookups = stats['memory_hits'] + stats['persistent_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['memory_hits'] + stats['persistent_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    # ------------------------------------------------------------------
+
+    async def _load_or_compute(self, key, file_bytes, mime_type, user_id, engine):
+        result = await self._persistent_lookup(key)
+        if result is not None:
+            self._count('persistent_hits')
+            return result
+
+        self._count('misses')
+        result = await self.process(file_bytes=file_bytes, mime_type=mime_type, user_id=user_id, engine=engine)
+
+        # Failed extractions are not cached so a retry gets a fresh attempt
+        if isinstance(result, dict) and 'error' not in result:
+            await self._store(key, mime_type, result)
+        return result
+
+    async def _persistent_lookup(self, key):
+        if not self.persistent:
+            return None
+        try:
+            result = await asyncio.to_thread(self._persistent_get, key)
+        except Exception as e:
+            print(f"[ExtractionCache] Persistent lookup failed: {e}")
+            return None
+        if result is not None:
+            self._memory_put(key, result)
+        return result
+
+    async def _store(self, key, mime_type, result):
+        self._memory_put(key, result)
+        if self.persistent:
+            try:
+                await asyncio.to_thread(self._persistent_put, key, mime_type, result)
+            except Exception as e:
+                print(f"[ExtractionCache] Persistent store failed: {e}")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return result
+
+    def _memory_put(self, key, result):
+        with self._lock:
+            self._memory[key] = (time.time() + self.ttl, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def _persistent_get(self, key):
+        with self.app.app_context():
+            entry = OcrExtractionCache.query.filter(
+                OcrExtractionCache.key == key,
+                OcrExtractionCache.expires_at > _now()
+            ).first()
+            return entry.result if entry else None
+
+    def _persistent_put(self, key, mime_type, result):
+        now = _now()
+        with self.app.app_context():
+            try:
+                db.session.merge(OcrExtractionCache(
+                    key=key,
+                    mime_type=mime_type,
+                    result=result,
+                    created_at=now,
+                    expires_at=now + datetime.timedelta(seconds=self.ttl)
+                ))
+                db.session.commit()
+            except IntegrityError:
+                # Another pod stored the same key first
+                db.session.rollback()
+
+            self._stores += 1
+            if self._stores % 100 == 0:
+                OcrExtractionCache.query.filter(OcrExtractionCache.expires_at <= now).delete()
+                db.session.commit()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
@@ -0,0 +1,77 @@
+"""
+gunicorn settings shared by the sync (app:app) and ASGI (asgi:app) commands;
+gunicorn loads ./gunicorn.conf.py automatically.
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to files
+in that directory and /metrics adds them up (metrics.py). The directory is
+emptied when the master starts, and an exited worker's live gauges
+(in-flight requests, queue depth) are dropped so they do not linger.
+
+The app is imported once by the master and forked into the workers
+(preload_app, GUNICORN_PRELOAD=false to turn off), so workers start in
+milliseconds and share the imported modules copy-on-write. when_ready also
+imports the extraction agent in the master (OCR_AGENT_LOAD=preload, ocr.py),
+the bulk of a worker's memory; without preloading, post_worker_init has each
+worker load it in the background instead. Nothing in the app opens
+connections or starts threads at import time: pools, background loops and
+listeners are created per process on first use. post_fork still drops any
+pooled connection a worker inherited.
+
+Workers are threaded (gthread, GUNICORN_THREADS per worker) rather than
+sync. A sync worker only tells the master it is alive between requests, so
+a response that streams for longer than `timeout` (a batch of more than
+about OCR_BATCH_MAX_RPS * 30 cards, a large export, a multi-card PDF) was
+killed halfway. A gthread worker checks in from its main loop while its
+threads stream, and `timeout` still restarts workers that really hang.
+Keep GUNICORN_THREADS at or below DB_POOL_SIZE + DB_MAX_OVERFLOW; gunicorn
+only runs sync workers with GUNICORN_THREADS=1. The ASGI command's
+-k uvicorn.workers.UvicornWorker overrides worker_class.
+"""
+import glob
+import os
+import sys
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8005')   # containerPort, probes and PodMonitoring in k8s/
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))      # Seconds a worker may go without checking in
+
+# A preloaded app creates its metrics before on_starting runs
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.getenv('PROMETHEUS_MULTIPROC_DIR'), exist_ok=True)
+
+
+def on_starting(server):
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+
+def when_ready(server):
+    app_module = sys.modules.get('app')
+    if server.cfg.preload_app and app_module is not None:
+        app_module.ocr_agent.server_ready()
+
+
+def post_fork(server, worker):
+    app_module = sys.modules.get('app')
+    if app_module is None:
+        return
+    # Connections belong to the master; close=False leaves its sockets alone
+    with app_module.app.app_context():
+        for engine in app_module.db.engines.values():
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.ocr_agent.worker_started()
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,245 @@
+import asyncio
+import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+
+import async_runtime
+import metrics
+from models import db, OcrJob
+
+TERMINAL_STATUSES = ('done', 'failed')
+# Heartbeats a job may miss before its worker is presumed dead
+ORPHAN_HEARTBEATS = 4
+
+
+class QueueFullError(Exception):
+    """Raised when the OCR job queue has no room for another upload."""
+
+
+class OcrJobQueue:
+    """
+    Background queue for OCR extractions.
+
+    Uploads are pushed onto an asyncio queue on the worker's background loop
+    (see async_runtime), where a bounded pool of workers awaits `process`
+    (normally `agent.process_document`). Job status and results are kept in the
+    `ocr_jobs` table so any gunicorn worker or pod can answer a status poll.
+
+    The upload itself only lives in the process that accepted it, recorded as
+    the job's `owner`. That process refreshes `heartbeat_at` of its unfinished
+    jobs every OCR_JOB_HEARTBEAT seconds; when it dies (timeout kill, OOM,
+    scale-down) the heartbeats stop and the sweeper of any worker marks those
+    jobs failed, so pollers get a terminal status. Finished jobs are deleted
+    OCR_JOB_TTL seconds after they finished.
+    """
+
+    def __init__(self, app=None, process=None):
+        self.process = process
+        self.app = None
+        self._queue = None
+        self._pid = None
+        self._owner = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._local_events = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('OCR_JOB_WORKERS', 8)
+        self.max_queue = app.config.get('OCR_JOB_QUEUE_SIZE', 100)
+        self.job_ttl = app.config.get('OCR_JOB_TTL', 3600)
+        self.heartbeat = max(1, app.config.get('OCR_JOB_HEARTBEAT', 30))
+        app.extensions['ocr_jobs'] = self
+
+    # ------------------------------------------------------------------
+    # Public API (called from request handlers)
+    # ------------------------------------------------------------------
+
+    def submit(self, file_bytes, mime_type, user_id, filename=None, engine=None):
+        """Persist a queued job and hand the upload to the worker pool."""
+        self._ensure_started()
+
+        with self._lock:
+            if self._pending >= self.max_queue:
+                raise QueueFullError('OCR queue is full, try again later')
+            self._pending += 1
+        metrics.OCR_QUEUE_DEPTH.inc()
+
+        job_id = str(uuid.uuid4())
+        try:
+            job = OcrJob(id=job_id, user_id=user_id, status='queued', filename=filename,
+                         owner=self._owner, heartbeat_at=_now())
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self._pending -= 1
+            metrics.OCR_QUEUE_DEPTH.dec()
+            raise
+
+        self._local_events[job_id] = threading.Event()
+        async_runtime.call_soon(self._queue.put_nowait, (job_id, file_bytes, mime_type, user_id, engine))
+        return job
+
+    def get(self, job_id, user_id):
+        return OcrJob.query.filter_by(id=job_id, user_id=user_id).first()
+
+    def wait(self, job_id, user_id, timeout, poll_interval=0.5):
+        """
+        Long-poll a job until it reaches a terminal status or `timeout` expires.
+        Jobs owned by this process are awaited on an in-memory event, jobs
+        owned by other workers/pods are polled from the database.
+        """
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id, user_id)
+        while job is not None and job.status not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Release the connection while sleeping so long-polls don't pin the pool
+            db.session.rollback()
+            event = self._local_events.get(job_id)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(poll_interval, remaining))
+            db.session.expire_all()
+            job = self.get(job_id, user_id)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._pending,
+                'running': self._running,
+                'workers': self.workers,
+                'max_queue': self.max_queue
+            }
+
+    # ------------------------------------------------------------------
+    # Worker loop
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        # Started lazily so each forked gunicorn worker gets its own queue and workers
+        if self._queue is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._queue is not None and self._pid == os.getpid():
+                return
+            async_runtime.run(self._start())
+            self._pid = os.getpid()
+            self._owner = f'{socket.gethostname()}:{self._pid}'
+            self._pending = 0
+            self._running = 0
+            metrics.OCR_QUEUE_DEPTH.set(0)
+
+    async def _start(self):
+        self._queue = asyncio.Queue()
+        for i in range(self.workers):
+            asyncio.create_task(self._worker())
+        asyncio.create_task(self._sweeper())
+
+    async def _worker(self):
+        while True:
+            job_id, file_bytes, mime_type, user_id, engine = await self._queue.get()
+            with self._lock:
+                self._pending -= 1
+                self._running += 1
+            metrics.OCR_QUEUE_DEPTH.dec()
+            try:
+                await asyncio.to_thread(self._update, job_id, status='running', started_at=_now())
+                result = await self.process(
+                    file_bytes=file_bytes,
+                    mime_type=mime_type,
+                    user_id=str(user_id),
+                    engine=engine
+                )
+                if isinstance(result, dict) and 'error' in result:
+                    await asyncio.to_thread(self._update, job_id, status='failed',
+                                            error=result['error'], finished_at=_now())
+                else:
+                    await asyncio.to_thread(self._update, job_id, status='done',
+                                            result=result, finished_at=_now())
+            except Exception as e:
+                print(f"[OcrJobQueue] Job {job_id} failed: {e}")
+                try:
+                    await asyncio.to_thread(self._update, job_id, status='failed',
+                                            error=str(e), finished_at=_now())
+                except Exception as db_error:
+                    print(f"[OcrJobQueue] Could not record failure of job {job_id}: {db_error}")
+            finally:
+                del file_bytes
+                with self._lock:
+                    self._running -= 1
+                event = self._local_events.pop(job_id, None)
+                if event is not None:
+                    event.set()
+                self._queue.task_done()
+
+    async def _sweeper(self):
+        # First pass right away: jobs orphaned by the worker this one replaces
+        purged_at = 0
+        while True:
+            try:
+                await asyncio.to_thread(self._beat)
+                await asyncio.to_thread(self._fail_orphans)
+                # Results contain personal data, so finished jobs are only kept for OCR_JOB_TTL
+                if time.monotonic() - purged_at >= min(self.job_ttl, 300):
+                    await asyncio.to_thread(self._purge_expired)
+                    purged_at = time.monotonic()
+            except Exception as e:
+                print(f"[OcrJobQueue] Error sweeping jobs: {e}")
+            await asyncio.sleep(self.heartbeat)
+
+    def _update(self, job_id, **values):
+        with self.app.app_context():
+            OcrJob.query.filter_by(id=job_id).update(values)
+            db.session.commit()
+
+    def _beat(self):
+        with self._lock:
+            if not self._pending and not self._running:
+                return
+        with self.app.app_context():
+            OcrJob.query.filter(
+                OcrJob.owner == self._owner,
+                OcrJob.status.notin_(TERMINAL_STATUSES)
+            ).update({'heartbeat_at': _now()}, synchronize_session=False)
+            db.session.commit()
+
+    def _fail_orphans(self):
+        now = _now()
+        cutoff = now - datetime.timedelta(seconds=self.heartbeat * ORPHAN_HEARTBEATS)
+        with self.app.app_context():
+            orphaned = OcrJob.query.filter(
+                OcrJob.status.notin_(TERMINAL_STATUSES),
+                db.func.coalesce(OcrJob.heartbeat_at, OcrJob.created_at) < cutoff
+            ).update({
+                'status': 'failed',
+                'error': 'The worker processing this job stopped, please submit the file again',
+                'finished_at': now
+            }, synchronize_session=False)
+            db.session.commit()
+        if orphaned:
+            print(f"[OcrJobQueue] Marked {orphaned} orphaned job(s) failed")
+
+    def _purge_expired(self):
+        cutoff = _now() - datetime.timedelta(seconds=self.job_ttl)
+        with self.app.app_context():
+            OcrJob.query.filter(
+                OcrJob.status.in_(TERMINAL_STATUSES),
+                OcrJob.finished_at < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
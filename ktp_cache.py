@@ -0,0 +1,291 @@
+"""
+Read-through cache for single KTP records (GET /api/ktp/<nik>).
+
+Records are kept per NIK in a bounded in-process LRU with a TTL, as the
+full row (every serialization.KTP_FIELDS value), so any `?fields=`
+projection is served from the same entry. create_ktp, update_ktp,
+delete_ktp, batch saves and imports invalidate the NIKs they wrote after
+committing.
+
+Invalidation goes through a pluggable backend (KTP_CACHE_INVALIDATION):
+
+- 'postgres': the NIKs are also sent with NOTIFY on the primary, and every
+  worker LISTENs on a dedicated connection and drops them. The default
+  whenever the database is Postgres.
+- 'local': only this worker process forgets the entry. Other workers and
+  pods serve their copy until the TTL expires, so the TTL is capped at
+  REPLICA_MAX_LAG, the staleness a replica read may already have.
+
+A lagging replica could hand an old row back right after an invalidation;
+for REPLICA_MAX_LAG seconds after a NIK is invalidated, reads of it are
+served but not cached.
+
+Responses carry an ETag and Last-Modified derived from updated_at, so a
+client revalidating with If-None-Match / If-Modified-Since gets a 304
+without the record being serialized.
+"""
+import hashlib
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+from sqlalchemy.engine import make_url
+from werkzeug.http import http_date, parse_date, parse_etags
+
+NOTIFY_CHANNEL = 'ktp_record_cache'
+_CLEAR = '*'
+# NOTIFY payloads must stay under 8000 bytes
+_MAX_PAYLOAD = 7000
+
+
+class LocalInvalidation:
+    """Invalidates this process only."""
+
+    def start(self, callback):
+        self.callback = callback
+
+    def listen(self):
+        pass
+
+    def publish(self, niks):
+        self.callback(niks)
+
+
+class PostgresInvalidation:
+    """Broadcasts invalidations to every worker with LISTEN/NOTIFY on the primary."""
+
+    def __init__(self, url, channel=NOTIFY_CHANNEL, reconnect_delay=5):
+        # libpq understands the SQLAlchemy URL once the driver suffix is gone
+        self.dsn = make_url(url).set(drivername='postgresql').render_as_string(hide_password=False)
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._pid = None
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def start(self, callback):
+        self.callback = callback
+
+    def publish(self, niks):
+        # Drop locally right away; the notification comes back to this worker too, which is harmless
+        self.callback(niks)
+        self.listen()
+        with self._lock:
+            try:
+                if self._connection is None or self._connection.closed:
+                    self._connection = psycopg2.connect(self.dsn)
+                    self._connection.autocommit = True
+                with self._connection.cursor() as cursor:
+                    for payload in _payloads(niks):
+                        cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, payload))
+            except Exception:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+                raise
+
+    def listen(self):
+        # Started lazily so each forked gunicorn worker listens on its own connection
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._connection = None   # Inherited from the parent process; not ours to use
+        threading.Thread(target=self._listener, daemon=True, name='ktp-cache-listener').start()
+
+    def _listener(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                connection = psycopg2.connect(self.dsn)
+            except Exception as e:
+                print(f"[KtpCache] Could not connect for LISTEN: {str(e).strip().splitlines()[0]}")
+                time.sleep(self.reconnect_delay)
+                continue
+            try:
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                # Anything published while we were not listening is lost; start clean
+                self.callback(None)
+                while self._pid == pid:
+                    if select.select([connection], [], [], self.reconnect_delay) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        payload = connection.notifies.pop(0).payload
+                        self.callback(None if payload == _CLEAR else payload.split(','))
+            except Exception as e:
+                print(f"[KtpCache] LISTEN connection lost: {str(e).strip().splitlines()[0]}")
+                self.callback(None)
+                time.sleep(self.reconnect_delay)
+            finally:
+                connection.close()
+
+
+class KtpRecordCache:
+
+    def __init__(self, app=None, invalidation=None):
+        self.app = None
+        self.invalidation = invalidation
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._invalidated = OrderedDict()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'invalidations': 0,
+            'evictions': 0
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('KTP_CACHE_ENABLED', True)
+        self.max_entries = app.config.get('KTP_CACHE_SIZE', 10000)
+        self.ttl = app.config.get('KTP_CACHE_TTL', 60)
+        # Replicas further behind than this are not read from (replication.py)
+        self.hold = app.config.get('REPLICA_MAX_LAG', 10)
+        if self.invalidation is None:
+            url = app.config['SQLALCHEMY_DATABASE_URI']
+            mode = app.config.get('KTP_CACHE_INVALIDATION') or (
+                'postgres' if make_url(url).get_backend_name() == 'postgresql' else 'local')
+            if mode == 'postgres':
+                self.invalidation = PostgresInvalidation(url)
+            else:
+                self.invalidation = LocalInvalidation()
+        if isinstance(self.invalidation, LocalInvalidation) and self.ttl > self.hold:
+            # Other workers never hear of a write; serve them no older than a replica could
+            print(f"[KtpCache] Invalidation is local to each worker; capping the TTL at {self.hold}s")
+            self.ttl = self.hold
+        self.invalidation.start(self._drop)
+        app.extensions['ktp_cache'] = self
+
+    def get(self, nik):
+        """The cached record dict for `nik`, or None. Treat it as read-only."""
+        if not self.enabled:
+            return None
+        self.invalidation.listen()
+        with self._lock:
+            entry = self._records.get(nik)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._records[nik]
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._records.move_to_end(nik)
+            self.counters['hits'] += 1
+            return entry[1]
+
+    def put(self, nik, record, read_at):
+        """
+        Caches `record`, read from the database at `read_at` (time.time() taken
+        before the query), unless `nik` was invalidated since or recently.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            invalidated_at = max(self._invalidated.get(nik, 0), self._invalidated.get(_CLEAR, 0))
+            if invalidated_at > read_at - self.hold:
+                return
+            self._records[nik] = (time.monotonic() + self.ttl, record)
+            self._records.move_to_end(nik)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def invalidate(self, *niks):
+        """Forgets `niks` in every worker; call after the write committed."""
+        niks = [nik for nik in dict.fromkeys(niks) if nik]
+        if not niks or not self.enabled:
+            return
+        try:
+            self.invalidation.publish(niks)
+        except Exception as e:
+            # Other workers keep their copy until it expires
+            print(f"[KtpCache] Could not publish invalidation of {len(niks)} record(s): {e}")
+
+    def clear(self):
+        self._drop(None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._records)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def count_not_modified(self):
+        with self._lock:
+            self.counters['not_modified'] += 1
+
+    def _drop(self, niks):
+        """Invalidation callback; None drops everything."""
+        now = time.time()
+        with self._lock:
+            for nik in niks if niks is not None else [_CLEAR]:
+                if nik == _CLEAR:
+                    self._records.clear()
+                else:
+                    self._records.pop(nik, None)
+                self._invalidated[nik] = now
+                self._invalidated.move_to_end(nik)
+                self.counters['invalidations'] += 1
+            while self._invalidated and next(iter(self._invalidated.values())) <= now - self.hold:
+                self._invalidated.popitem(last=False)
+
+
+def _payloads(niks):
+    payload = []
+    size = 0
+    for nik in niks:
+        if payload and size + len(nik) + 1 > _MAX_PAYLOAD:
+            yield ','.join(payload)
+            payload, size = [], 0
+        payload.append(nik)
+        size += len(nik) + 1
+    if payload:
+        yield ','.join(payload)
+
+
+# ----------------------------------------------------------------------
+# Conditional GET
+# ----------------------------------------------------------------------
+
+def validators(record, fields):
+    """(ETag, Last-Modified) header values for `fields` of `record`; (None, None) without updated_at."""
+    updated_at = record.get('updated_at')
+    if updated_at is None:
+        return None, None
+    # The representation depends on the projection, so the tag does too
+    digest = hashlib.blake2b(f"{record['nik']}|{updated_at.isoformat()}|{','.join(fields)}".encode(),
+                             digest_size=12).hexdigest()
+    return f'"{digest}"', http_date(updated_at)
+
+
+def not_modified(etag, last_modified, if_none_match=None, if_modified_since=None):
+    """True when the request headers show the client already has this version (RFC 9110 13.2.2)."""
+    if etag is None:
+        return False
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag.strip('"'))
+    if if_modified_since:
+        since = parse_date(if_modified_since)
+        # Last-Modified only has second precision
+        return since is not None and parse_date(last_modified) <= since
+    return False
+
+
+def cache_headers(etag, last_modified):
+    if etag is None:
+        return {'Cache-Control': 'private, no-cache'}
+    return {'ETag': etag, 'Last-Modified': last_modified, 'Cache-Control': 'private, no-cache'}
@@ -0,0 +1,396 @@
+"""
+Bulk import of KTP records from CSV or NDJSON.
+
+Rows are checked with the same rules as create_ktp (models.parse_ktp_payload),
+COPYed in batches into a temporary staging table and merged into ktp_records
+with INSERT ... ON CONFLICT (nik) DO UPDATE, one transaction per batch. Bad
+rows are reported with their line number instead of aborting the file; if a
+batch is rejected by the database it is retried row by row to find the
+offending rows. Progress is stored in the `ktp_imports` table so any worker
+or pod can answer a status poll.
+
+A background import runs in the worker process that accepted the upload,
+recorded as its `owner`. That process refreshes `heartbeat_at` every
+IMPORT_HEARTBEAT seconds; when it dies the heartbeats stop and the sweeper
+of any worker marks the import failed and, on the same host, deletes the
+uploaded file it left behind.
+"""
+import csv
+import datetime
+import io
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from models import db, KtpImport, KtpRecord, parse_ktp_payload
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+COLUMNS = [
+    'nik', 'full_name', 'birth_place', 'birth_date', 'gender', 'blood_type', 'address', 'rt_rw',
+    'village_kelurahan', 'district_kecamatan', 'religion', 'marital_status', 'occupation',
+    'citizenship', 'expiry_date', 'registration_date'
+]
+STAGING_TABLE = 'ktp_import_staging'
+TERMINAL_STATUSES = ('done', 'failed')
+# Heartbeats an import may miss before its worker is presumed dead
+ORPHAN_HEARTBEATS = 4
+
+_STAGING_DDL = f"""
+CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+    line integer NOT NULL,
+    LIKE ktp_records INCLUDING DEFAULTS
+) ON COMMIT DELETE ROWS
+"""
+_MERGE_COLUMNS = ', '.join(COLUMNS)
+_MERGE_UPDATES = ', '.join(f'{c} = EXCLUDED.{c}' for c in COLUMNS if c != 'nik')
+# DISTINCT ON keeps the last occurrence of a NIK in the batch; xmax = 0 only for freshly inserted rows
+_MERGE_SQL = f"""
+INSERT INTO ktp_records ({_MERGE_COLUMNS})
+SELECT DISTINCT ON (nik) {_MERGE_COLUMNS} FROM {STAGING_TABLE} ORDER BY nik, line DESC
+ON CONFLICT (nik) DO UPDATE SET {_MERGE_UPDATES}, updated_at = now()
+RETURNING (xmax = 0)
+"""
+_UPSERT_ROW_SQL = f"""
+INSERT INTO ktp_records ({_MERGE_COLUMNS}) VALUES ({', '.join(['%s'] * len(COLUMNS))})
+ON CONFLICT (nik) DO UPDATE SET {_MERGE_UPDATES}, updated_at = now()
+RETURNING (xmax = 0)
+"""
+
+
+class ImportFileError(ValueError):
+    """Raised for files that cannot be imported at all (unknown format, missing header)."""
+
+
+def detect_format(filename, requested=None):
+    fmt = (requested or '').lower()
+    if not fmt and filename:
+        ext = os.path.splitext(filename)[1].lower()
+        fmt = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson'}.get(ext, '')
+    if fmt not in IMPORT_FORMATS:
+        raise ImportFileError(f"format must be one of: {', '.join(IMPORT_FORMATS)}")
+    return fmt
+
+
+class _CountingReader(io.RawIOBase):
+    """Binary file wrapper that counts the bytes read, for progress reporting."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        buffer[:len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def read_rows(stream, fmt):
+    """
+    Yields (line, data, error) for every record of a binary CSV/NDJSON stream.
+    `data` is a dict, or None when the line could not be parsed (`error` says why).
+    """
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or 'nik' not in reader.fieldnames:
+            raise ImportFileError('CSV header must include nik')
+        for data in reader:
+            # Empty CSV cells mean "not set", like a missing JSON key
+            yield reader.line_num, {k: v for k, v in data.items() if k and v not in ('', None)}, None
+        return
+
+    for line, raw in enumerate(text, start=1):
+        if not raw.strip():
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError as e:
+            yield line, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(data, dict):
+            yield line, None, 'Expected a JSON object'
+            continue
+        yield line, data, None
+
+
+def validate_row(data):
+    """parse_ktp_payload plus the column constraints COPY would otherwise reject the whole batch for."""
+    try:
+        row = parse_ktp_payload(data)
+    except KeyError as e:
+        raise ValueError(f'Missing field: {e}')
+    except TypeError as e:
+        raise ValueError(str(e))
+    for name in COLUMNS:
+        column = KtpRecord.__table__.c[name]
+        value = row[name]
+        if value is None:
+            if not column.nullable:
+                raise ValueError(f'Missing field: {name!r}')
+            continue
+        if not isinstance(value, datetime.date):
+            value = row[name] = str(value)
+            length = getattr(column.type, 'length', None)
+            if length and len(value) > length:
+                raise ValueError(f'{name} is longer than {length} characters')
+    return row
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class KtpImporter:
+    """
+    Runs imports synchronously (`run`, used by the CLI) or on a background
+    thread (`start`, used by POST /api/ktp/import).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._owner = None
+        self._lock = threading.Lock()
+        self._running = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('IMPORT_BATCH_SIZE', 5000)
+        self.max_errors = app.config.get('IMPORT_MAX_ERRORS', 1000)
+        self.heartbeat = max(1, app.config.get('IMPORT_HEARTBEAT', 30))
+        app.extensions['ktp_importer'] = self
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def start(self, path, fmt, user_id, filename=None):
+        """
+        Records a queued import and processes `path` on a background thread.
+        The file is deleted when the import finishes.
+        """
+        self._ensure_sweeper()
+        job = KtpImport(id=str(uuid.uuid4()), user_id=user_id, status='queued', filename=filename, format=fmt,
+                        owner=self._owner, heartbeat_at=_now(), path=path)
+        db.session.add(job)
+        db.session.commit()
+        with self._lock:
+            self._running.add(job.id)
+        threading.Thread(target=self._run_job, args=(job.id, path, fmt), daemon=True,
+                         name=f'ktp-import-{job.id[:8]}').start()
+        return job
+
+    def get(self, import_id, user_id):
+        # Status polls start the sweeper too, so imports of a dead worker are failed even if no new one starts
+        self._ensure_sweeper()
+        return KtpImport.query.filter_by(id=import_id, user_id=user_id).first()
+
+    def run(self, path, fmt, progress=None):
+        """
+        Imports `path` and returns the summary dict. `progress(summary)` is
+        called after every batch. Must be called inside an app context.
+        """
+        summary = {
+            'progress': 0.0, 'rows_processed': 0, 'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []
+        }
+        size = os.path.getsize(path) or 1
+        started = time.monotonic()
+
+        connection = db.engine.raw_connection()
+        try:
+            with open(path, 'rb') as f, connection.cursor() as cursor:
+                counter = _CountingReader(f)
+                cursor.execute(_STAGING_DDL)
+                connection.commit()
+
+                batch = []
+                for line, data, error in read_rows(counter, fmt):
+                    summary['rows_processed'] += 1
+                    if error is None:
+                        try:
+                            batch.append((line, validate_row(data)))
+                        except ValueError as e:
+                            error = str(e)
+                    if error is not None:
+                        self._record_error(summary, line, data, error)
+
+                    if len(batch) >= self.batch_size:
+                        self._load_batch(connection, cursor, batch, summary)
+                        batch = []
+                        summary['progress'] = min(counter.bytes_read / size, 0.99)
+                        if progress:
+                            progress(summary)
+
+                if batch:
+                    self._load_batch(connection, cursor, batch, summary)
+                summary['progress'] = 1.0
+                if progress:
+                    progress(summary)
+        finally:
+            connection.close()
+
+        elapsed = time.monotonic() - started
+        rate = summary['rows_processed'] / elapsed if elapsed else 0
+        print(f"[KtpImporter] {summary['rows_processed']} rows in {elapsed:.1f}s ({rate:.0f} rows/s): "
+              f"{summary['inserted']} inserted, {summary['updated']} updated, {summary['failed']} failed")
+        return summary
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _load_batch(self, connection, cursor, batch, summary):
+        buffer = io.StringIO()
+        for line, row in batch:
+            buffer.write('\t'.join([str(line)] + [_copy_value(row[c]) for c in COLUMNS]) + '\n')
+        buffer.seek(0)
+        try:
+            cursor.copy_expert(f"COPY {STAGING_TABLE} (line, {_MERGE_COLUMNS}) FROM STDIN", buffer)
+            cursor.execute(_MERGE_SQL)
+            inserted = [r[0] for r in cursor.fetchall()]
+            connection.commit()   # Also empties the staging table (ON COMMIT DELETE ROWS)
+            self._invalidate_cache(row['nik'] for _, row in batch)
+        except Exception as e:
+            connection.rollback()
+            reason = str(e).strip().splitlines()[0]
+            print(f"[KtpImporter] Batch at line {batch[0][0]} rejected ({reason}), retrying row by row")
+            self._load_rows(connection, cursor, batch, summary)
+            return
+        summary['inserted'] += sum(inserted)
+        summary['updated'] += len(inserted) - sum(inserted)
+
+    def _load_rows(self, connection, cursor, batch, summary):
+        for line, row in batch:
+            cursor.execute('SAVEPOINT import_row')
+            try:
+                cursor.execute(_UPSERT_ROW_SQL, [row[c] for c in COLUMNS])
+                inserted = cursor.fetchone()[0]
+            except Exception as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT import_row')
+                self._record_error(summary, line, row, str(e).strip().splitlines()[0])
+                continue
+            cursor.execute('RELEASE SAVEPOINT import_row')
+            summary['inserted' if inserted else 'updated'] += 1
+        connection.commit()
+        self._invalidate_cache(row['nik'] for _, row in batch)
+
+    def _invalidate_cache(self, niks):
+        cache = self.app.extensions.get('ktp_cache')
+        if cache is not None:
+            cache.invalidate(*niks)
+
+    def _record_error(self, summary, line, data, message):
+        summary['failed'] += 1
+        if len(summary['errors']) < self.max_errors:
+            nik = data.get('nik') if isinstance(data, dict) else None
+            summary['errors'].append({'line': line, 'nik': nik, 'message': message})
+
+    # ------------------------------------------------------------------
+    # Background jobs
+    # ------------------------------------------------------------------
+
+    def _run_job(self, import_id, path, fmt):
+        with self.app.app_context():
+            try:
+                self._update(import_id, status='running', started_at=_now())
+                summary = self.run(path, fmt, progress=lambda s: self._update(import_id, **s))
+                self._update(import_id, status='done', finished_at=_now(), **summary)
+            except Exception as e:
+                print(f"[KtpImporter] Import {import_id} failed: {e}")
+                db.session.rollback()
+                try:
+                    self._update(import_id, status='failed', error=str(e), finished_at=_now())
+                except Exception as db_error:
+                    print(f"[KtpImporter] Could not record failure of import {import_id}: {db_error}")
+            finally:
+                with self._lock:
+                    self._running.discard(import_id)
+                _remove(path)
+
+    def _update(self, import_id, **values):
+        if 'errors' in values:
+            values['errors'] = list(values['errors'])
+        KtpImport.query.filter_by(id=import_id).update(values)
+        db.session.commit()
+
+    def _ensure_sweeper(self):
+        # Started lazily so each forked gunicorn worker has its own owner id and sweeper
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f'{socket.gethostname()}:{self._pid}'
+            self._running = set()
+        threading.Thread(target=self._sweeper, daemon=True, name='ktp-import-sweeper').start()
+
+    def _sweeper(self):
+        # First pass right away: imports orphaned by the worker this one replaces
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                with self.app.app_context():
+                    self._beat()
+                    self._fail_orphans()
+            except Exception as e:
+                print(f"[KtpImporter] Error sweeping imports: {e}")
+            time.sleep(self.heartbeat)
+
+    def _beat(self):
+        with self._lock:
+            running = list(self._running)
+        if not running:
+            return
+        KtpImport.query.filter(
+            KtpImport.id.in_(running),
+            KtpImport.status.notin_(TERMINAL_STATUSES)
+        ).update({'heartbeat_at': _now()}, synchronize_session=False)
+        db.session.commit()
+
+    def _fail_orphans(self):
+        now = _now()
+        cutoff = now - datetime.timedelta(seconds=self.heartbeat * ORPHAN_HEARTBEATS)
+        orphaned = db.session.execute(
+            KtpImport.__table__.update().where(
+                KtpImport.status.notin_(TERMINAL_STATUSES),
+                db.func.coalesce(KtpImport.heartbeat_at, KtpImport.created_at) < cutoff
+            ).values(
+                status='failed',
+                error='The worker running this import stopped, please upload the file again',
+                finished_at=now
+            ).returning(KtpImport.id, KtpImport.owner, KtpImport.path)
+        ).all()
+        db.session.commit()
+        if not orphaned:
+            return
+        print(f"[KtpImporter] Marked {len(orphaned)} orphaned import(s) failed")
+        # The upload is on the local disk of the host that accepted it
+        host = socket.gethostname()
+        for _, owner, path in orphaned:
+            if path and (owner or '').rpartition(':')[0] == host:
+                _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
@@ -0,0 +1,339 @@
+"""
+Local, deterministic validation of extracted KTP data.
+
+Checks the mechanical NIK rules (16 digits, region prefix, DDMMYY birth date
+with +40 for women), the minimum age and the RT/RW format without any network
+call. The result is a list of structured flags; `decided` is False only when
+the rules alone cannot settle the record (currently: regency/district codes
+without a loaded Kemendagri table), which is when the opt-in LLM fallback in
+agent.py kicks in.
+
+The region table is not in the repository: build the image with
+KTP_REGION_TABLE_URL (see the Dockerfile) or run `write_region_table` once to
+store it as data/kemendagri_regions.csv. The image build fails without it,
+and the app refuses to start without it when KTP_REGION_TABLE_REQUIRED is set
+(warns otherwise).
+"""
+import csv
+import os
+import re
+import tempfile
+import urllib.request
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+
+# Bump when the rules change so cached extractions are re-validated
+RULES_VERSION = '3'
+
+MINIMUM_AGE = 17
+
+# Kode provinsi Kemendagri (including the 2022 Papua split, 91-96)
+PROVINCE_CODES = {
+    '11': 'ACEH', '12': 'SUMATERA UTARA', '13': 'SUMATERA BARAT', '14': 'RIAU',
+    '15': 'JAMBI', '16': 'SUMATERA SELATAN', '17': 'BENGKULU', '18': 'LAMPUNG',
+    '19': 'KEPULAUAN BANGKA BELITUNG', '21': 'KEPULAUAN RIAU', '31': 'DKI JAKARTA',
+    '32': 'JAWA BARAT', '33': 'JAWA TENGAH', '34': 'DI YOGYAKARTA', '35': 'JAWA TIMUR',
+    '36': 'BANTEN', '51': 'BALI', '52': 'NUSA TENGGARA BARAT', '53': 'NUSA TENGGARA TIMUR',
+    '61': 'KALIMANTAN BARAT', '62': 'KALIMANTAN TENGAH', '63': 'KALIMANTAN SELATAN',
+    '64': 'KALIMANTAN TIMUR', '65': 'KALIMANTAN UTARA', '71': 'SULAWESI UTARA',
+    '72': 'SULAWESI TENGAH', '73': 'SULAWESI SELATAN', '74': 'SULAWESI TENGGARA',
+    '75': 'GORONTALO', '76': 'SULAWESI BARAT', '81': 'MALUKU', '82': 'MALUKU UTARA',
+    '91': 'PAPUA', '92': 'PAPUA BARAT', '93': 'PAPUA SELATAN', '94': 'PAPUA TENGAH',
+    '95': 'PAPUA PEGUNUNGAN', '96': 'PAPUA BARAT DAYA',
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%d %m %Y', '%Y/%m/%d')
+
+# Characters OCR commonly confuses with digits on the NIK line
+_NIK_OCR_FIXES = str.maketrans({'O': '0', 'o': '0', 'I': '1', 'l': '1', '|': '1'})
+_NIK_SEPARATORS = re.compile(r'[\s.\-]')
+_RT_RW = re.compile(r'^\d{1,3}\s*/\s*\d{1,3}$')
+
+_FEMALE = ('PEREMPUAN', 'WANITA', 'P', 'F', 'FEMALE')
+_MALE = ('LAKI-LAKI', 'LAKI', 'PRIA', 'L', 'M', 'MALE')
+
+
+class RegionIndex:
+    """
+    Kemendagri region codes kept as sorted integer arrays.
+
+    Province codes are built in. Regency (4 digit) and district (6 digit) codes
+    are loaded from a CSV file whose first column is the code, either dotted
+    (`32.73.01`) or plain (`327301`); longer village codes are ignored.
+    """
+
+    def __init__(self, regencies=(), districts=()):
+        self.provinces = frozenset(PROVINCE_CODES)
+        self.regencies = array('L', sorted(set(regencies)))
+        self.districts = array('L', sorted(set(districts)))
+
+    @property
+    def has_regencies(self):
+        return len(self.regencies) > 0
+
+    @property
+    def has_districts(self):
+        return len(self.districts) > 0
+
+    @classmethod
+    def from_csv(cls, path):
+        regencies, districts = set(), set()
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                code = row[0].replace('.', '').strip()
+                if not code.isdigit():
+                    continue  # Header or comment line
+                if len(code) >= 4:
+                    regencies.add(int(code[:4]))
+                if len(code) >= 6:
+                    districts.add(int(code[:6]))
+        return cls(regencies, districts)
+
+    @staticmethod
+    def _contains(codes, value):
+        i = bisect_left(codes, value)
+        return i < len(codes) and codes[i] == value
+
+    def has_province(self, code):
+        return code[:2] in self.provinces
+
+    def has_regency(self, code):
+        return self._contains(self.regencies, int(code[:4]))
+
+    def has_district(self, code):
+        return self._contains(self.districts, int(code[:6]))
+
+
+_region_index = None
+
+# A real table has ~500 regencies and ~7,000 districts; anything much smaller is the wrong file
+_MIN_REGENCIES = 400
+_MIN_DISTRICTS = 5000
+
+
+def region_table_path():
+    return os.getenv('KTP_REGION_TABLE') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'kemendagri_regions.csv'
+    )
+
+
+def get_region_index(required=False):
+    """
+    Loads the region table once per process (KTP_REGION_TABLE, default
+    data/kemendagri_regions.csv). A missing or truncated table raises
+    RuntimeError when `required`, and is warned about otherwise.
+    """
+    global _region_index
+    if _region_index is None:
+        path = region_table_path()
+        index = RegionIndex.from_csv(path) if os.path.exists(path) else RegionIndex()
+        if len(index.regencies) < _MIN_REGENCIES or len(index.districts) < _MIN_DISTRICTS:
+            message = (f"Region table {path} is missing or has only {len(index.regencies)} regencies and "
+                       f"{len(index.districts)} districts")
+            if required:
+                raise RuntimeError(f"{message}; see write_region_table")
+            print(f"[KtpValidator] WARNING: {message}. Only province codes are checked and records with "
+                  f"an unverified region come back decided=False")
+        _region_index = index
+    return _region_index
+
+
+def write_region_table(source, path=None):
+    """
+    Stores the Kemendagri region codes from `source` (a CSV path or http(s)
+    URL whose first column is the code, dotted or plain, down to village
+    level) as the compact table get_region_index loads. Returns
+    (regencies, districts).
+    """
+    path = path or region_table_path()
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=60) as response, \
+                tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as f:
+            f.write(response.read())
+        try:
+            index = RegionIndex.from_csv(f.name)
+        finally:
+            os.unlink(f.name)
+    else:
+        index = RegionIndex.from_csv(source)
+    if len(index.regencies) < _MIN_REGENCIES or len(index.districts) < _MIN_DISTRICTS:
+        raise ValueError(f'{source} has {len(index.regencies)} regencies and {len(index.districts)} districts, '
+                         f'not a Kemendagri region table')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['code'])
+        # District codes cover their regencies too (RegionIndex.from_csv)
+        writer.writerows([str(code)] for code in index.districts)
+    return len(index.regencies), len(index.districts)
+
+
+def normalize_nik(value):
+    if value is None:
+        return None
+    return _NIK_SEPARATORS.sub('', str(value)).translate(_NIK_OCR_FIXES)
+
+
+def parse_date(value):
+    """Parses the date layouts seen on KTPs and in model output, returns a date or None."""
+    if isinstance(value, date):
+        return value
+    if not value:
+        return None
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def gender_from_text(value):
+    """Returns 'P' (perempuan), 'L' (laki-laki) or None if the text is not recognised."""
+    if not value:
+        return None
+    value = str(value).strip().upper()
+    if value in _FEMALE or value.startswith('PEREMPUAN'):
+        return 'P'
+    if value in _MALE or value.startswith('LAKI'):
+        return 'L'
+    return None
+
+
+def birth_date_from_nik(nik, today):
+    """
+    Decodes digits 7-12 (DDMMYY, DD + 40 for women).
+    Returns (date, gender) or (None, gender) when the digits are not a real date.
+    """
+    day, month, year = int(nik[6:8]), int(nik[8:10]), int(nik[10:12])
+    gender = 'L'
+    if day > 40:
+        day -= 40
+        gender = 'P'
+    century = 2000 if 2000 + year <= today.year else 1900
+    try:
+        return date(century + year, month, day), gender
+    except ValueError:
+        return None, gender
+
+
+def age_on(birth_date, today):
+    return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+
+
+def _flag(field, code, message, severity='error'):
+    return {'field': field, 'code': code, 'message': message, 'severity': severity}
+
+
+def validate_ktp(data, today=None, regions=None):
+    """
+    Validates and normalizes one extraction result.
+
+    Returns `(normalized, report)` where `normalized` is a copy of `data` with a
+    cleaned `nik` and `birth_date` in YYYY-MM-DD, and `report` is
+    `{'valid': bool, 'decided': bool, 'flags': [...]}`.
+    """
+    today = today or date.today()
+    regions = regions or get_region_index()
+    normalized = dict(data)
+    flags = []
+    decided = True
+
+    # 1. NIK structure
+    raw_nik = data.get('nik')
+    nik = normalize_nik(raw_nik)
+    if nik != raw_nik and raw_nik is not None:
+        flags.append(_flag('nik', 'NIK_NORMALIZED', f'NIK dinormalisasi dari {raw_nik!r}', 'info'))
+    normalized['nik'] = nik
+    nik_ok = bool(nik) and len(nik) == 16 and nik.isdigit()
+    if not nik_ok:
+        flags.append(_flag('nik', 'NIK_FORMAT', 'NIK harus terdiri dari tepat 16 digit'))
+
+    # 2. Region prefix (provinsi / kabupaten-kota / kecamatan)
+    if nik_ok:
+        if not regions.has_province(nik):
+            flags.append(_flag('nik', 'NIK_PROVINCE', f'Kode provinsi {nik[:2]} tidak dikenal'))
+        elif nik[2:4] == '00' or nik[4:6] == '00':
+            flags.append(_flag('nik', 'NIK_REGION', f'Kode wilayah {nik[:6]} tidak valid'))
+        elif regions.has_regencies and not regions.has_regency(nik):
+            flags.append(_flag('nik', 'NIK_REGENCY', f'Kode kabupaten/kota {nik[:4]} tidak dikenal'))
+        elif regions.has_districts and not regions.has_district(nik):
+            flags.append(_flag('nik', 'NIK_DISTRICT', f'Kode kecamatan {nik[:6]} tidak dikenal'))
+        elif not regions.has_districts:
+            decided = False
+            flags.append(_flag('nik', 'NIK_REGION_UNVERIFIED',
+                               'Tabel wilayah Kemendagri tidak dimuat, kode kecamatan tidak diverifikasi', 'info'))
+        if nik[12:16] == '0000':
+            flags.append(_flag('nik', 'NIK_SERIAL', 'Nomor urut NIK tidak boleh 0000'))
+
+    # 3. NIK <-> birth date / gender cross-check
+    nik_birth_date = nik_gender = None
+    if nik_ok:
+        nik_birth_date, nik_gender = birth_date_from_nik(nik, today)
+        if nik_birth_date is None:
+            flags.append(_flag('nik', 'NIK_BIRTH_DATE', f'Digit 7-12 NIK ({nik[6:12]}) bukan tanggal yang valid'))
+
+    birth_date = parse_date(data.get('birth_date'))
+    if birth_date is None:
+        if nik_birth_date is not None:
+            birth_date = nik_birth_date
+            flags.append(_flag('birth_date', 'BIRTH_DATE_FROM_NIK',
+                               'Tanggal lahir tidak terbaca, diambil dari NIK', 'warning'))
+        else:
+            flags.append(_flag('birth_date', 'BIRTH_DATE_FORMAT',
+                               f'Tanggal lahir {data.get("birth_date")!r} tidak dapat dibaca'))
+    normalized['birth_date'] = birth_date.isoformat() if birth_date else data.get('birth_date')
+
+    if birth_date is not None and nik_birth_date is not None:
+        if (birth_date.day, birth_date.month, birth_date.year % 100) != \
+                (nik_birth_date.day, nik_birth_date.month, nik_birth_date.year % 100):
+            flags.append(_flag('birth_date', 'NIK_BIRTH_DATE_MISMATCH',
+                               f'Tanggal lahir {birth_date.isoformat()} tidak sesuai dengan NIK ({nik[6:12]})'))
+
+    gender = gender_from_text(data.get('gender'))
+    if nik_gender is not None and gender is not None and gender != nik_gender:
+        flags.append(_flag('gender', 'NIK_GENDER_MISMATCH',
+                           'Jenis kelamin tidak sesuai dengan digit tanggal lahir pada NIK'))
+
+    # 4. Minimum age
+    if birth_date is not None:
+        if birth_date > today:
+            flags.append(_flag('birth_date', 'BIRTH_DATE_FUTURE', 'Tanggal lahir berada di masa depan'))
+        elif age_on(birth_date, today) < MINIMUM_AGE:
+            flags.append(_flag('birth_date', 'AGE_UNDER_17', f'Usia di bawah {MINIMUM_AGE} tahun'))
+
+    # 5. RT/RW, e.g. 003/007
+    rt_rw = data.get('rt_rw')
+    if rt_rw and not _RT_RW.match(str(rt_rw).strip()):
+        flags.append(_flag('rt_rw', 'RT_RW_FORMAT', f'RT/RW {rt_rw!r} tidak berformat angka/angka', 'warning'))
+
+    report = {
+        'valid': not any(f['severity'] == 'error' for f in flags),
+        'decided': decided,
+        'flags': flags
+    }
+    return normalized, report
+
+
+def apply_region_verdict(report, nik, valid, region=None):
+    """
+    Settles NIK_REGION_UNVERIFIED with an explicit verdict on the region code
+    from elsewhere (the search-grounded fallback in agent.py). Returns a new
+    report.
+    """
+    flags = [f for f in report['flags'] if f['code'] != 'NIK_REGION_UNVERIFIED']
+    if valid:
+        flags.append(_flag('nik', 'NIK_REGION_VERIFIED',
+                           f'Kode wilayah {nik[:6]} terverifikasi' + (f' ({region})' if region else ''), 'info'))
+    else:
+        flags.append(_flag('nik', 'NIK_DISTRICT', f'Kode kecamatan {nik[:6]} tidak dikenal'))
+    return dict(
+        report,
+        valid=not any(f['severity'] == 'error' for f in flags),
+        decided=True,
+        flags=flags
+    )
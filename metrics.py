@@ -0,0 +1,217 @@
+"""
+Prometheus metrics, served at /metrics.
+
+- ktp_http_request_duration_seconds{method,endpoint,status}: per route
+- ktp_http_requests_in_flight: requests being handled right now
+- ktp_ocr_stage_duration_seconds{stage}: where OCR time goes (upload_read,
+  preprocess, model_call, validate_callback, parse, render of a PDF/TIFF
+  page), and first_field: time to the first field of a streamed extraction
+- ktp_ocr_in_flight: process_document calls running right now
+- ktp_ocr_queue_depth: jobs waiting in the OCR job queue
+- ktp_db_query_duration_seconds{bind,kind}: every SQL statement
+- ktp_genai_retries_total{status} / ktp_genai_errors_total{status}: Gemini
+  calls retried by agent.retry_config, and calls that failed for good
+- ktp_genai_admission_total{priority,outcome}: Gemini calls admitted or
+  turned away by admission.py, ktp_genai_admission_wait_seconds{priority}
+  how long admitted calls waited, ktp_genai_concurrency_limit the current
+  adaptive (AIMD) limit
+- ktp_ocr_escalations_total{scope}: extractions of the tiered engine by how
+  far they went to Pro (none, fields, document), ktp_ocr_escalated_fields_total
+  {field} which fields were re-read, ktp_ocr_tier_duration_seconds{tier} the
+  model call latency of each tier
+
+Under gunicorn every worker has its own metrics. Set PROMETHEUS_MULTIPROC_DIR
+(the Dockerfile does) to have /metrics report the sum over all workers of
+the pod; gunicorn.conf.py empties the directory on start and cleans up
+after workers that exit.
+"""
+import contextlib
+import logging
+import os
+import re
+import time
+
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               generate_latest, multiprocess)
+
+# Requests and Gemini calls: milliseconds to a minute
+_SLOW_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60)
+_QUERY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = Histogram(
+    'ktp_http_request_duration_seconds', 'HTTP request duration', ['method', 'endpoint', 'status'],
+    buckets=_SLOW_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'ktp_http_requests_in_flight', 'HTTP requests being handled', multiprocess_mode='livesum'
+)
+OCR_STAGE_DURATION = Histogram(
+    'ktp_ocr_stage_duration_seconds', 'Duration of each OCR pipeline stage', ['stage'], buckets=_SLOW_BUCKETS
+)
+OCR_IN_FLIGHT = Gauge(
+    'ktp_ocr_in_flight', 'process_document calls running', multiprocess_mode='livesum'
+)
+OCR_QUEUE_DEPTH = Gauge(
+    'ktp_ocr_queue_depth', 'OCR jobs waiting for a free worker', multiprocess_mode='livesum'
+)
+DB_QUERY_DURATION = Histogram(
+    'ktp_db_query_duration_seconds', 'SQL statement duration', ['bind', 'kind'], buckets=_QUERY_BUCKETS
+)
+GENAI_RETRIES = Counter(
+    'ktp_genai_retries_total', 'Gemini requests retried by retry_config, by HTTP status', ['status']
+)
+GENAI_ERRORS = Counter(
+    'ktp_genai_errors_total', 'Gemini requests that failed after all retries, by HTTP status', ['status']
+)
+GENAI_ADMISSION = Counter(
+    'ktp_genai_admission_total', 'Gemini calls admitted, rejected or charged to an admitted extraction (extra_call) by admission control', ['priority', 'outcome']
+)
+GENAI_ADMISSION_WAIT = Histogram(
+    'ktp_genai_admission_wait_seconds', 'Time admitted Gemini calls waited for a slot', ['priority'],
+    buckets=_SLOW_BUCKETS
+)
+GENAI_CONCURRENCY_LIMIT = Gauge(
+    'ktp_genai_concurrency_limit', 'Adaptive limit on concurrent Gemini calls', multiprocess_mode='max'
+)
+
+OCR_ESCALATIONS = Counter(
+    'ktp_ocr_escalations_total', 'Tiered extractions by escalation to Pro (none, fields, document)', ['scope']
+)
+OCR_ESCALATED_FIELDS = Counter(
+    'ktp_ocr_escalated_fields_total', 'Fields re-read by the Pro tier', ['field']
+)
+OCR_TIER_DURATION = Histogram(
+    'ktp_ocr_tier_duration_seconds', 'Model call duration per tier of the tiered engine', ['tier'],
+    buckets=_SLOW_BUCKETS
+)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times an OCR pipeline stage: `with metrics.stage('preprocess'): ...`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        OCR_STAGE_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+def observe_query(bind, kind, seconds):
+    DB_QUERY_DURATION.labels(bind, kind).observe(seconds)
+
+
+def observe_request(method, endpoint, status, seconds):
+    REQUEST_DURATION.labels(method, endpoint or 'unmatched', str(status)).observe(seconds)
+
+
+def render():
+    """(body, content type) for GET /metrics."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class Metrics:
+    """Times every Flask request and serves /metrics."""
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        app.add_url_rule('/metrics', 'metrics', self._metrics)
+        app.extensions['metrics'] = self
+
+    def _before(self):
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    def _after(self, response):
+        started = g.get('metrics_started')
+        if started is not None:
+            rule = request.url_rule.rule if request.url_rule else None
+            observe_request(request.method, rule, response.status_code, time.perf_counter() - started)
+        return response
+
+    def _teardown(self, exc):
+        if g.pop('metrics_started', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+    def _metrics(self):
+        body, content_type = render()
+        return self.app.response_class(body, content_type=content_type)
+
+
+# ----------------------------------------------------------------------
+# Gemini retries
+# ----------------------------------------------------------------------
+
+# google-genai retries through tenacity and logs every retry on this logger:
+# "Retrying ... in 1.3 seconds as it raised ClientError: 429 RESOURCE_EXHAUSTED. ..."
+_GENAI_LOGGER = 'google_genai._api_client'
+_RETRY_STATUS = re.compile(r'as it raised \w+: (\d{3})')
+_retry_listeners = []
+
+
+class _RetryCounter(logging.Filter):
+    """
+    Counts the retry records, then lets through only what the logger would
+    have emitted at its own level, so counting does not change the log output.
+    """
+
+    def __init__(self, level):
+        super().__init__()
+        self.level = level   # The logger's own level before count_genai_retries
+
+    def filter(self, record):
+        if record.levelno == logging.INFO:
+            try:
+                message = record.getMessage()
+            except Exception:
+                message = ''
+            if message.startswith('Retrying'):
+                match = _RETRY_STATUS.search(message)
+                status = match.group(1) if match else 'other'
+                GENAI_RETRIES.labels(status).inc()
+                for callback in _retry_listeners:
+                    callback(status)
+        # An unset level follows the parents, which the app may configure later
+        level = self.level or logging.getLogger(_GENAI_LOGGER).parent.getEffectiveLevel()
+        return record.levelno >= level
+
+
+def count_genai_retries():
+    """
+    Counts retry_config retries from google-genai's retry log records.
+
+    tenacity logs them at INFO, below the usual WARNING, and records under the
+    logger's level are never created; the logger is opened up to INFO and the
+    filter drops everything its own level would have.
+    """
+    logger = logging.getLogger(_GENAI_LOGGER)
+    if not any(isinstance(f, _RetryCounter) for f in logger.filters):
+        logger.addFilter(_RetryCounter(logger.level))
+        if logger.getEffectiveLevel() > logging.INFO:
+            logger.setLevel(logging.INFO)
+
+
+def on_genai_retry(callback):
+    """
+    Calls `callback(status)` for every retry, synchronously in the task that
+    made the Gemini call (admission.py uses this to see 429s that were retried).
+    """
+    count_genai_retries()
+    _retry_listeners.append(callback)
+
+
+def count_genai_error(exc):
+    GENAI_ERRORS.labels(str(getattr(exc, 'code', None) or 'other')).inc()
@@ -0,0 +1,8 @@
+-- Composite index for the default DataTables order and keyset pagination
+-- (get_all_ktp: ORDER BY updated_at DESC, nik ASC).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ktp_records_updated_at_nik
+    ON ktp_records (updated_at DESC, nik ASC);
+
+-- Refresh planner statistics; recordsTotal is read from pg_class.reltuples
+ANALYZE ktp_records;
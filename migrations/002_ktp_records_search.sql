@@ -0,0 +1,24 @@
+-- Indexed search for get_all_ktp's search[value] (see search.py).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Words of full_name + address for multi-word and short-prefix queries.
+-- Adding a STORED generated column rewrites the table once.
+ALTER TABLE ktp_records
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(full_name, '') || ' ' || coalesce(address, ''))) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ktp_records_search_vector
+    ON ktp_records USING gin (search_vector);
+
+-- Substring (ILIKE '%term%') matches on names and addresses
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ktp_records_full_name_trgm
+    ON ktp_records USING gin (full_name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ktp_records_address_trgm
+    ON ktp_records USING gin (address gin_trgm_ops);
+
+-- NIK prefix (LIKE '3273%') regardless of the database collation
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ktp_records_nik_prefix
+    ON ktp_records (nik varchar_pattern_ops);
+
+ANALYZE ktp_records;
@@ -0,0 +1,7 @@
+-- Owner and heartbeat of OCR jobs, so jobs of dead workers are failed (see jobs.py).
+
+ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS owner varchar(128);
+ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS heartbeat_at timestamptz;
+
+-- Finished jobs are purged OCR_JOB_TTL seconds after finished_at
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ocr_jobs_finished_at ON ocr_jobs (finished_at);
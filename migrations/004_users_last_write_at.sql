@@ -0,0 +1,4 @@
+-- Time of each user's last write, shared by every worker and pod so reads
+-- right after a write go to the primary (replication.py).
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_write_at timestamptz;
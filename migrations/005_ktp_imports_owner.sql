@@ -0,0 +1,6 @@
+-- Owner, heartbeat and upload path of bulk imports, so imports of dead workers
+-- are failed and their files removed (see ktp_import.py).
+
+ALTER TABLE ktp_imports ADD COLUMN IF NOT EXISTS owner varchar(128);
+ALTER TABLE ktp_imports ADD COLUMN IF NOT EXISTS heartbeat_at timestamptz;
+ALTER TABLE ktp_imports ADD COLUMN IF NOT EXISTS path text;
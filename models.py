@@ -1,22 +1,38 @@
+import datetime
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy.session import Session
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 
 class RoutingSession(Session):
-    def get_bind(self, mapper=None, clause=None):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
         try:
             # If flushing (writing), use the default (primary) bind
             if self._flushing:
-                return super().get_bind(mapper, clause)
+                return super().get_bind(mapper, clause, **kwargs)
             
-            # If it's a SELECT statement (reading), try to use the replica
+            # Models that are polled right after being written (e.g. OCR jobs)
+            # must not be read from a lagging replica
+            if mapper is not None and getattr(mapper.class_, '__read_from_primary__', False):
+                return super().get_bind(mapper, clause, **kwargs)
+
+            # If it's a SELECT statement (reading), try to use a replica
             if clause is not None and hasattr(clause, 'is_select') and clause.is_select:
-                return self.db.engines['replica']
+                # ReplicaRouter (replication.py) handles lag, health and read-your-writes
+                router = current_app.extensions.get('replica_router') if has_app_context() else None
+                if router is None:
+                    return self._db.engines['replica']
+                bind = router.choose(self)
+                if bind is not None:
+                    return self._db.engines[bind]
         except (KeyError, AttributeError):
             # Fallback to default (primary) if replica is not configured or other error
             pass
             
-        return super().get_bind(mapper, clause)
+        return super().get_bind(mapper, clause, **kwargs)
 
 db = SQLAlchemy(session_options={'class_': RoutingSession})
 
@@ -41,6 +57,23 @@ class KtpRecord(db.Model):
     registration_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # Maintained by Postgres, only used by search.py; deferred so it is never loaded
+    search_vector = deferred(db.Column(
+        TSVECTOR,
+        db.Computed("to_tsvector('simple', coalesce(full_name, '') || ' ' || coalesce(address, ''))", persisted=True)
+    ))
+
+    __table_args__ = (
+        # Default DataTables order (updated_at DESC, nik ASC), also used for keyset pagination
+        db.Index('ix_ktp_records_updated_at_nik', updated_at.desc(), nik.asc()),
+        # Search (see search.py and migrations/002_ktp_records_search.sql)
+        db.Index('ix_ktp_records_nik_prefix', nik, postgresql_ops={'nik': 'varchar_pattern_ops'}),
+        db.Index('ix_ktp_records_full_name_trgm', full_name, postgresql_using='gin',
+                 postgresql_ops={'full_name': 'gin_trgm_ops'}),
+        db.Index('ix_ktp_records_address_trgm', address, postgresql_using='gin',
+                 postgresql_ops={'address': 'gin_trgm_ops'}),
+        db.Index('ix_ktp_records_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     def to_dict(self):
         return {
@@ -64,8 +97,294 @@ class KtpRecord(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class OcrExtractionCache(db.Model):
+    __tablename__ = 'ocr_extraction_cache'
+
+    key = db.Column(db.String(64), primary_key=True) # sha256 of version + mime type + file bytes
+    mime_type = db.Column(db.String(100))
+    result = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
 class User(db.Model):
     __tablename__ = 'users'
+    # Loaded on every authenticated request; last_write_at decides read routing (replication.py)
+    __read_from_primary__ = True
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False) # Storing plain/hashed password
+    last_write_at = db.Column(db.DateTime(timezone=True)) # Committed with the user's last write
+
+def user_wrote(user_id):
+    """UPDATE that records a write by `user_id`; run it in the writing transaction."""
+    return User.__table__.update().where(User.__table__.c.id == user_id).values(last_write_at=func.now())
+
+def parse_ktp_payload(data):
+    """
+    Maps a create_ktp style JSON payload to KtpRecord column values.
+    Raises KeyError for missing required fields and ValueError for bad dates.
+    """
+    return {
+        'nik': data['nik'],
+        'full_name': data['full_name'],
+        'birth_place': data['birth_place'],
+        'birth_date': datetime.datetime.strptime(data['birth_date'], '%Y-%m-%d').date(),
+        'gender': data.get('gender'),
+        'blood_type': data.get('blood_type'),
+        'address': data['address'],
+        'rt_rw': data.get('rt_rw'),
+        'village_kelurahan': data.get('village_kelurahan'),
+        'district_kecamatan': data.get('district_kecamatan'),
+        'religion': data.get('religion'),
+        'marital_status': data.get('marital_status'),
+        'occupation': data.get('occupation'),
+        'citizenship': data.get('citizenship', 'WNI'),
+        'expiry_date': data.get('expiry_date', 'SEUMUR HIDUP'),
+        'registration_date': datetime.datetime.strptime(data['registration_date'], '%Y-%m-%d').date() if data.get('registration_date') else None
+    }
+
+def apply_ktp_update(ktp, data):
+    """
+    Applies an update_ktp style partial JSON payload to a KtpRecord.
+    Raises ValueError for bad dates.
+    """
+    ktp.full_name = data.get('full_name', ktp.full_name)
+    ktp.birth_place = data.get('birth_place', ktp.birth_place)
+    if 'birth_date' in data:
+        ktp.birth_date = datetime.datetime.strptime(data['birth_date'], '%Y-%m-%d').date()
+    ktp.gender = data.get('gender', ktp.gender)
+    ktp.blood_type = data.get('blood_type', ktp.blood_type)
+    ktp.address = data.get('address', ktp.address)
+    ktp.rt_rw = data.get('rt_rw', ktp.rt_rw)
+    ktp.village_kelurahan = data.get('village_kelurahan', ktp.village_kelurahan)
+    ktp.district_kecamatan = data.get('district_kecamatan', ktp.district_kecamatan)
+    ktp.religion = data.get('religion', ktp.religion)
+    ktp.marital_status = data.get('marital_status', ktp.marital_status)
+    ktp.occupation = data.get('occupation', ktp.occupation)
+    ktp.citizenship = data.get('citizenship', ktp.citizenship)
+    ktp.expiry_date = data.get('expiry_date', ktp.expiry_date)
+    if 'registration_date' in data:
+        val = data['registration_date']
+        ktp.registration_date = datetime.datetime.strptime(val, '%Y-%m-%d').date() if val else None
+
+def upsert_ktp_records(rows):
+    """
+    Inserts or updates many KtpRecord rows (dicts from parse_ktp_payload) with a
+    single INSERT ... ON CONFLICT (nik) DO UPDATE. Caller commits.
+    """
+    if not rows:
+        return 0
+    # ON CONFLICT cannot touch the same row twice in one statement; last one wins
+    rows = list({row['nik']: row for row in rows}.values())
+    stmt = pg_insert(KtpRecord.__table__).values(rows)
+    update_columns = {
+        name: stmt.excluded[name] for name in rows[0] if name != 'nik'
+    }
+    update_columns['updated_at'] = func.now()
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['nik'], set_=update_columns))
+    return len(rows)
+
+# The trigram indexes need pg_trgm before ktp_records is created
+event.listen(
+    db.Model.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+class OcrJob(db.Model):
+    __tablename__ = 'ocr_jobs'
+    __read_from_primary__ = True
+
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    filename = db.Column(db.String(255))
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), index=True)
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True), index=True)
+    # Worker process (host:pid) that holds the upload, and its last sign of life (jobs.py)
+    owner = db.Column(db.String(128))
+    heartbeat_at = db.Column(db.DateTime(timezone=True))
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class KtpImport(db.Model):
+    __tablename__ = 'ktp_imports'
+    __read_from_primary__ = True
+
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, index=True)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    filename = db.Column(db.String(255))
+    format = db.Column(db.String(10))
+    progress = db.Column(db.Float, default=0) # Fraction of the file read, 0..1
+    rows_processed = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    errors = db.Column(db.JSON) # [{'line': n, 'nik': ..., 'message': ...}], capped at IMPORT_MAX_ERRORS
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), index=True)
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+    # Worker process (host:pid) running the import, its last sign of life and the uploaded file (ktp_import.py)
+    owner = db.Column(db.String(128))
+    heartbeat_at = db.Column(db.DateTime(timezone=True))
+    path = db.Column(db.Text)
+
+    def to_dict(self):
+        return {
+            'import_id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'format': self.format,
+            'progress': self.progress,
+            'rows_processed': self.rows_processed,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors or [],
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class GeminiAdmissionState(db.Model):
+    __tablename__ = 'gemini_admission'
+
+    # Shared token bucket and concurrency limit of admission.PostgresStore, one row per key
+    key = db.Column(db.String(64), primary_key=True)
+    state = db.Column(db.JSON, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class KtpStat(db.Model):
+    __tablename__ = 'ktp_stats'
+
+    # Record counts per dimension value for GET /api/ktp/stats (stats.py), folded in from
+    # ktp_stats_delta. level 0 is every record, 1 one district, 2 one village of it;
+    # '' stands for NULL (and for "all" in the scope columns of the levels above)
+    level = db.Column(db.SmallInteger, primary_key=True)
+    district_kecamatan = db.Column(db.String(100), primary_key=True)
+    village_kelurahan = db.Column(db.String(100), primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+
+class KtpStatDelta(db.Model):
+    __tablename__ = 'ktp_stats_delta'
+
+    # Changes to ktp_records not yet folded into ktp_stats, appended by the triggers below:
+    # one row per changed combination of the summarized columns ('' for NULL), n records more or less
+    id = db.Column(db.BigInteger, primary_key=True)
+    district_kecamatan = db.Column(db.String(100), nullable=False)
+    village_kelurahan = db.Column(db.String(100), nullable=False)
+    gender = db.Column(db.String(10), nullable=False)
+    religion = db.Column(db.String(20), nullable=False)
+    marital_status = db.Column(db.String(20), nullable=False)
+    birth_year = db.Column(db.String(4), nullable=False)
+    n = db.Column(db.BigInteger, nullable=False)
+
+KTP_STATS_COLUMNS = 'district_kecamatan, village_kelurahan, gender, religion, marital_status, birth_date'
+KTP_STATS_DELTA_COLUMNS = 'district_kecamatan, village_kelurahan, gender, religion, marital_status, birth_year'
+
+# Groups changed ktp_records rows ({source}: nik-less rows of KTP_STATS_COLUMNS plus
+# n = +1/-1) into one delta per combination; deltas that cancel out (e.g. an address edit) are skipped
+KTP_STATS_GROUP = """
+SELECT coalesce(district_kecamatan, '') AS district_kecamatan, coalesce(village_kelurahan, '') AS village_kelurahan,
+       coalesce(gender, '') AS gender, coalesce(religion, '') AS religion,
+       coalesce(marital_status, '') AS marital_status,
+       coalesce(extract(year FROM birth_date)::int::text, '') AS birth_year, sum(n) AS n
+FROM ({source}) AS changed
+GROUP BY 1, 2, 3, 4, 5, 6
+HAVING sum(n) <> 0
+"""
+
+# Fans grouped deltas ({combos}: rows of KTP_STATS_DELTA_COLUMNS plus n) out into
+# ktp_stats rows and adds them. Sorted so concurrent folds lock summary rows in the same order.
+KTP_STATS_UPSERT = """
+INSERT INTO ktp_stats AS s (level, district_kecamatan, village_kelurahan, dimension, value, count)
+SELECT scope.level, scope.district, scope.village, dim.dimension, dim.value, sum(c.n)
+FROM ({combos}) AS c
+CROSS JOIN LATERAL (VALUES (0, '', ''), (1, c.district_kecamatan, ''), (2, c.district_kecamatan, c.village_kelurahan))
+    AS scope(level, district, village)
+CROSS JOIN LATERAL (VALUES ('total', ''), ('district_kecamatan', c.district_kecamatan),
+                           ('village_kelurahan', c.village_kelurahan), ('gender', c.gender),
+                           ('religion', c.religion), ('marital_status', c.marital_status),
+                           ('birth_year', c.birth_year))
+    AS dim(dimension, value)
+WHERE (dim.dimension <> 'district_kecamatan' OR scope.level = 0)
+  AND (dim.dimension <> 'village_kelurahan' OR scope.level = 1)
+GROUP BY 1, 2, 3, 4, 5
+HAVING sum(c.n) <> 0
+ORDER BY 1, 2, 3, 4, 5
+ON CONFLICT (level, district_kecamatan, village_kelurahan, dimension, value)
+DO UPDATE SET count = s.count + EXCLUDED.count
+"""
+
+# Moves every committed delta into ktp_stats in one statement (stats.fold_ktp_stats)
+KTP_STATS_FOLD = (
+    f'WITH moved AS (DELETE FROM ktp_stats_delta RETURNING {KTP_STATS_DELTA_COLUMNS}, n)'
+    + KTP_STATS_UPSERT.format(combos=f'SELECT {KTP_STATS_DELTA_COLUMNS}, sum(n) AS n FROM moved GROUP BY 1, 2, 3, 4, 5, 6')
+)
+
+# Advisory lock of the fold; TRUNCATE takes it too so no fold re-adds what it cleared
+KTP_STATS_LOCK = 0x6b74707374
+
+# Statement-level, so a bulk upsert or import batch appends one aggregated delta.
+# Only appends: writers never wait for each other on the shared summary rows.
+KTP_STATS_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION ktp_stats_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO ktp_stats_delta ({KTP_STATS_DELTA_COLUMNS}, n)
+        {KTP_STATS_GROUP.format(source=f'SELECT {KTP_STATS_COLUMNS}, 1 AS n FROM new_rows')};
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO ktp_stats_delta ({KTP_STATS_DELTA_COLUMNS}, n)
+        {KTP_STATS_GROUP.format(source=f'SELECT {KTP_STATS_COLUMNS}, 1 AS n FROM new_rows '
+                                       f'UNION ALL SELECT {KTP_STATS_COLUMNS}, -1 FROM old_rows')};
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO ktp_stats_delta ({KTP_STATS_DELTA_COLUMNS}, n)
+        {KTP_STATS_GROUP.format(source=f'SELECT {KTP_STATS_COLUMNS}, -1 AS n FROM old_rows')};
+    ELSE
+        -- Not TRUNCATE: that would wait for (and block) every reader of ktp_stats
+        PERFORM pg_advisory_xact_lock({KTP_STATS_LOCK});
+        DELETE FROM ktp_stats_delta;
+        DELETE FROM ktp_stats;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ktp_stats_insert ON ktp_records;
+DROP TRIGGER IF EXISTS ktp_stats_update ON ktp_records;
+DROP TRIGGER IF EXISTS ktp_stats_delete ON ktp_records;
+DROP TRIGGER IF EXISTS ktp_stats_truncate ON ktp_records;
+CREATE TRIGGER ktp_stats_insert AFTER INSERT ON ktp_records
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION ktp_stats_apply();
+CREATE TRIGGER ktp_stats_update AFTER UPDATE ON ktp_records
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION ktp_stats_apply();
+CREATE TRIGGER ktp_stats_delete AFTER DELETE ON ktp_records
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION ktp_stats_apply();
+CREATE TRIGGER ktp_stats_truncate AFTER TRUNCATE ON ktp_records
+    FOR EACH STATEMENT EXECUTE FUNCTION ktp_stats_apply();
+"""
+
+# ktp_records, ktp_stats and ktp_stats_delta all exist once the metadata has been created
+event.listen(
+    db.Model.metadata,
+    'after_create',
+    DDL(KTP_STATS_TRIGGERS).execute_if(dialect='postgresql')
+)
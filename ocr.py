@@ -0,0 +1,148 @@
+"""
+The extraction agent (agent.py), loaded on demand.
+
+agent.py imports google-adk and google-genai: about 2.5 s and 100 MB of
+every worker's start-up, although most requests never extract anything.
+app.py and asgi.py import this module instead. It defines what the routes and
+the extraction cache need up front (engine names, models, the instruction
+and EXTRACTION_VERSION), and AgentLoader imports agent.py when it is first
+needed, off the event loop.
+
+OCR_AGENT_LOAD decides when that happens:
+
+- 'preload' (default): gunicorn with preload_app (GUNICORN_PRELOAD) imports
+  it once in the master before forking (gunicorn.conf.py when_ready), so the
+  workers share the loaded modules copy-on-write and none of them waits for
+  it. Workers that were not forked from a preloaded master load it as in
+  'background';
+- 'background': in a thread of each worker as soon as it runs
+  (gunicorn.conf.py post_worker_init, asgi.py lifespan), so the worker
+  answers right away and the agent is usually loaded by the first extraction;
+- 'lazy': on the first extraction of each worker, which waits for it.
+
+CLI commands and scripts that import the app never load the agent unless
+they extract something.
+"""
+import asyncio
+import hashlib
+import importlib
+import os
+import threading
+import time
+
+from ktp_validator import RULES_VERSION
+import preprocess
+
+GEMINI_FLASH = "gemini-2.5-flash"
+GEMINI_PRO = "gemini-2.5-pro"
+
+# 'adk' (LlmAgent through Runner), 'direct' (one structured-output call) or
+# 'tiered' (Flash, then Pro for what Flash got wrong), see agent.process_document
+ENGINES = ("adk", "direct", "tiered")
+
+AGENT_LOAD_MODES = ("preload", "background", "lazy")
+
+EXTRACTION_INSTRUCTION = (
+    "Anda adalah asisten OCR dan ekstraksi data yang ahli untuk Kartu Tanda Penduduk (KTP) Indonesia. "
+    "Tujuan Anda adalah mengekstrak field tertentu dari gambar atau teks KTP yang diberikan.\n\n"
+    "1. Analisis dokumen KTP yang disediakan.\n"
+    "2. Ekstrak field yang didefinisikan dalam skema output secara akurat.\n"
+    "3. **Tempat & Tanggal Lahir:** Di KTP, ini tertulis dalam satu baris (contoh: 'JAKARTA, 17-08-1945').\n"
+        "   - Anda WAJIB memisahkan teks ini.\n"
+        "   - Teks sebelum koma/angka adalah 'birth_place'.\n"
+        "   - Angka tanggal (DD-MM-YYYY) adalah 'birth_date'.\n"
+    "4. Pastikan tanggal diformat sebagai YYYY-MM-DD jika memungkinkan.\n"
+    "5. Isi dengan NULL jika informasi tidak tersedia atau tidak dapat diekstrak.\n"
+    "6. Field expiry_date harus SELALU diisi dengan 'SEUMUR HIDUP'.\n"
+    "7. Kembalikan HANYA objek JSON akhir yang sesuai dengan skema KTPExtractionResult."
+)
+
+# Identifies prompt + models + validation rules; part of the extraction cache
+# key, together with the engine (extraction_cache.py)
+EXTRACTION_VERSION = hashlib.sha256(
+    f"{GEMINI_FLASH}|{GEMINI_PRO}|{EXTRACTION_INSTRUCTION}|{RULES_VERSION}|{preprocess.VERSION}".encode()
+).hexdigest()[:16]
+
+
+def resolve_engine(engine=None):
+    """`engine`, or OCR_ENGINE when not given; raises ValueError for unknown names."""
+    engine = engine or os.getenv("OCR_ENGINE", "adk")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown OCR engine '{engine}', expected one of {', '.join(ENGINES)}")
+    return engine
+
+
+class AgentLoader:
+    """
+    Imports agent.py once per process, according to OCR_AGENT_LOAD (see the
+    module docstring). `process_document` is a drop-in for
+    `agent.process_document`.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = 'preload'
+        self._module = None
+        self._lock = threading.Lock()
+        self._warming_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('OCR_AGENT_LOAD', 'preload')
+        if self.mode not in AGENT_LOAD_MODES:
+            raise ValueError(f"OCR_AGENT_LOAD must be one of {', '.join(AGENT_LOAD_MODES)}, not '{self.mode}'")
+        app.extensions['ocr_agent'] = self
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """Imports agent.py unless this process already has, and returns it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module('agent')
+                    print(f"[AgentLoader] Agent loaded in {time.perf_counter() - started:.2f}s ({self.mode})")
+                    self._module = module
+        return self._module
+
+    async def get(self):
+        """The agent module; loading it runs in a thread so the event loop keeps serving."""
+        if self._module is not None:
+            return self._module
+        return await asyncio.to_thread(self.load)
+
+    def server_ready(self):
+        """Called in the gunicorn master after it preloaded the app, before any worker is forked."""
+        if self.mode == 'preload':
+            self.load()
+
+    def worker_started(self):
+        """Called once a worker runs: starts the load unless the worker inherited the agent."""
+        if self.mode != 'lazy':
+            self.warm_up()
+
+    def warm_up(self):
+        """Loads the agent in a daemon thread of this process, unless it is loaded or loading."""
+        pid = os.getpid()
+        if self._module is not None or self._warming_pid == pid:
+            return
+        self._warming_pid = pid
+        threading.Thread(target=self._warm_up, name='agent-warm-up', daemon=True).start()
+
+    async def process_document(self, file_bytes, mime_type, user_id="system", engine=None):
+        agent = await self.get()
+        return await agent.process_document(file_bytes, mime_type, user_id=user_id, engine=engine)
+
+    # ------------------------------------------------------------------
+
+    def _warm_up(self):
+        try:
+            self.load()
+        except Exception as e:
+            # The first extraction tries again and reports the error
+            print(f"[AgentLoader] Warm-up failed: {e}")
@@ -0,0 +1,183 @@
+"""
+Server-Sent Events variant of the OCR extraction (POST /api/ocr/extract/stream).
+
+The extraction is made with the direct engine's streaming call
+(agent.stream_extraction, loaded through ocr.AgentLoader). The partial JSON
+is parsed as it arrives, and every KTPExtractionResult field is pushed as
+soon as its value is complete:
+
+    event: field
+    data: {"name": "nik", "value": "3273015508900001"}
+
+followed by one final event with the validated record, the same payload as
+`data` in the non-streaming response (including the 'validation' verdict):
+
+    event: result
+    data: {"nik": "...", ..., "validation": {"valid": true, ...}}
+
+Errors after the stream started arrive as `event: error` with a message.
+Cache hits (entries of the direct engine) replay the cached fields
+immediately. Time to the first field is recorded as the 'first_field' OCR
+stage on /metrics.
+"""
+import contextlib
+import json
+import queue
+import time
+
+import metrics
+from serialization import dumps
+
+
+class FieldStream:
+    """
+    Incremental parser for a flat JSON object: feed() it text as it arrives
+    and get back the (name, value) members completed so far. Anything before
+    the opening brace (e.g. a ```json fence) is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            ch = buffer[i]
+            if self._member_start is None:
+                if ch == '{':
+                    self._depth = 1
+                    self._member_start = i + 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._member(buffer[self._member_start:i]))
+                    self.done = True
+            elif ch == ',' and self._depth == 1:
+                completed.extend(self._member(buffer[self._member_start:i]))
+                self._member_start = i + 1
+            i += 1
+        self._pos = i
+        return completed
+
+    def _member(self, text):
+        text = text.strip()
+        if not text:
+            return []
+        try:
+            member = json.loads('{' + text + '}')
+        except ValueError:
+            return []
+        self.fields.update(member)
+        return list(member.items())
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+async def extraction_events(file_bytes, mime_type, loader, cache=None, admission=None):
+    """
+    Async generator of (event, data) pairs for one upload; see the module
+    docstring. `loader` is the app's ocr.AgentLoader.
+    """
+    started = time.perf_counter()
+    if cache is not None:
+        cached = await cache.lookup(file_bytes, mime_type, engine='direct')
+        if cached is not None:
+            for name, value in cached.items():
+                if name != 'validation':
+                    yield 'field', {'name': name, 'value': value}
+            yield 'result', cached
+            return
+
+    agent = await loader.get()
+    parser = FieldStream()
+    first = True
+    slot = admission.slot() if admission is not None and admission.enabled else contextlib.nullcontext()
+    async with slot:
+        async for text in agent.stream_extraction(file_bytes, mime_type):
+            for name, value in parser.feed(text):
+                if first:
+                    metrics.OCR_STAGE_DURATION.labels('first_field').observe(time.perf_counter() - started)
+                    first = False
+                yield 'field', {'name': name, 'value': value}
+
+    if not parser.done:
+        # Truncated or not JSON at all
+        yield 'error', {'message': 'Failed to parse model response'}
+        return
+    with metrics.stage('validate_callback'):
+        result = await agent.validate_extraction(parser.fields)
+    yield 'result', result
+    if cache is not None:
+        await cache.store(file_bytes, mime_type, result, engine='direct')
+
+
+async def sse_events(events):
+    """
+    SSE strings for `events`. Errors before the first event are raised, so
+    the route can still answer e.g. 503 for admission.SaturatedError; later
+    ones become an 'error' event.
+    """
+    sent = False
+    try:
+        async for event, data in events:
+            yield sse(event, data)
+            sent = True
+    except Exception as e:
+        if not sent:
+            raise
+        yield sse('error', {'message': f'Processing error: {str(e)}'})
+
+
+def iterate_sync(stream, submit):
+    """
+    Consumes the async iterator `stream` on the background loop (`submit` is
+    async_runtime.submit) and yields its items in the calling thread, for
+    Flask's streaming responses. Exceptions are re-raised here; closing the
+    generator (client gone) cancels the extraction.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in stream:
+                items.put((item, None))
+        except Exception as e:
+            items.put((None, e))
+        finally:
+            items.put((done, None))
+
+    future = submit(pump())
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,195 @@
+"""
+Helpers for the DataTables listing in get_all_ktp: sort keys, keyset (seek)
+pagination with opaque cursors, and cheap row counts.
+
+Keyset pagination filters on the last row of the previous page instead of
+using OFFSET, so with a matching index every page costs the same. Counts
+come from planner estimates unless an exact count is requested or the
+table is small enough for count(*) to be cheap.
+"""
+import base64
+import datetime
+import hashlib
+import json
+
+from sqlalchemy import and_, func, or_, select, text
+
+from models import db, KtpRecord
+
+# DataTables column index -> sortable expression
+# 0: nik, 1: full_name, 2: gender, 3: birth_date, 4: address
+SORT_COLUMNS = [
+    KtpRecord.nik,
+    KtpRecord.full_name,
+    func.coalesce(KtpRecord.gender, ''),   # Nullable; coalesced so cursors can compare it
+    KtpRecord.birth_date,
+    KtpRecord.address
+]
+SORT_TYPES = [str, str, str, datetime.date, str]
+
+# Default (deterministic) order, served by ix_ktp_records_updated_at_nik
+DEFAULT_SORT = [(KtpRecord.updated_at, 'desc', datetime.datetime), (KtpRecord.nik, 'asc', str)]
+
+
+class CursorError(ValueError):
+    """Raised for cursors that are malformed or belong to a different sort order."""
+
+
+def sort_keys(order_column_index=None, order_dir=None):
+    """Returns the list of (expression, direction, python type) to order by, ending in nik."""
+    if order_column_index is None or not 0 <= order_column_index < len(SORT_COLUMNS):
+        return DEFAULT_SORT
+    direction = 'desc' if order_dir == 'desc' else 'asc'
+    keys = [(SORT_COLUMNS[order_column_index], direction, SORT_TYPES[order_column_index])]
+    if order_column_index != 0:
+        keys.append((KtpRecord.nik, direction, str))   # Tie-breaker, nik is unique
+    return keys
+
+
+def apply_order(query, keys):
+    return query.order_by(*[col.desc() if direction == 'desc' else col.asc() for col, direction, _ in keys])
+
+
+def apply_cursor(query, keys, values):
+    """
+    Restricts `query` to rows after `values` in `keys` order. The leading
+    `first <= v` / `first >= v` bound is redundant but lets Postgres start the
+    index scan at the cursor instead of filtering from the top.
+    """
+    first_col, first_dir, _ = keys[0]
+    bound = first_col <= values[0] if first_dir == 'desc' else first_col >= values[0]
+
+    alternatives = []
+    for i, (col, direction, _) in enumerate(keys):
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        after = col < values[i] if direction == 'desc' else col > values[i]
+        alternatives.append(and_(*equal, after))
+    return query.filter(bound, or_(*alternatives))
+
+
+def _signature(keys):
+    spec = '|'.join(f'{col}:{direction}' for col, direction, _ in keys)
+    return hashlib.sha1(spec.encode()).hexdigest()[:8]
+
+
+def encode_cursor(keys, values):
+    payload = {
+        's': _signature(keys),
+        'v': [v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v for v in values]
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(keys, cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = payload['v']
+    except (ValueError, KeyError, TypeError):
+        raise CursorError('Invalid cursor')
+    if payload.get('s') != _signature(keys) or len(values) != len(keys):
+        raise CursorError('Cursor does not match the requested sort order')
+
+    decoded = []
+    for value, (_, _, python_type) in zip(values, keys):
+        try:
+            if python_type is datetime.datetime:
+                value = datetime.datetime.fromisoformat(value)
+            elif python_type is datetime.date:
+                value = datetime.date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise CursorError('Invalid cursor')
+        decoded.append(value)
+    return decoded
+
+
+def cursor_values(keys, record):
+    """Reads the sort key values of a KtpRecord or projected row (for the next-page cursor)."""
+    values = []
+    for col, _, _ in keys:
+        if col is SORT_COLUMNS[2]:
+            values.append(record.gender or '')
+        else:
+            values.append(getattr(record, col.key))
+    return values
+
+
+_RELTUPLES_SQL = text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)")
+
+
+def _plan_rows(plan):
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def key_fields(keys):
+    """Names of the KtpRecord fields cursor_values reads, for column projections."""
+    return ['gender' if col is SORT_COLUMNS[2] else col.key for col, _, _ in keys]
+
+
+def estimated_total(exact_below):
+    """
+    Row count of ktp_records from the planner statistics (pg_class.reltuples).
+    Falls back to count(*) when the estimate is missing or below `exact_below`.
+    """
+    try:
+        estimate = db.session.execute(_RELTUPLES_SQL, {'table': KtpRecord.__tablename__}).scalar()
+    except Exception:
+        db.session.rollback()
+        estimate = None
+    if estimate is None or estimate < exact_below:
+        return KtpRecord.query.count()
+    return int(estimate)
+
+
+def estimated_count(query, exact_below):
+    """
+    Row count of a filtered query from EXPLAIN's top-level row estimate.
+    Falls back to an exact count when the estimate is unavailable or small.
+    """
+    stmt = query.order_by(None).statement
+    try:
+        compiled = stmt.compile(dialect=db.session.get_bind(clause=stmt).dialect)
+        plan = db.session.connection(bind_arguments={'clause': stmt}).exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params
+        ).scalar()
+        estimate = _plan_rows(plan)
+    except Exception:
+        db.session.rollback()
+        estimate = None
+    if estimate is None or estimate < exact_below:
+        return db.session.execute(select(func.count()).select_from(stmt.subquery())).scalar()
+    return estimate
+
+
+# Async variants for the ASGI mode (asgi.py), taking an AsyncSession and a select()
+
+async def estimated_total_async(session, exact_below):
+    try:
+        estimate = (await session.execute(_RELTUPLES_SQL, {'table': KtpRecord.__tablename__})).scalar()
+    except Exception:
+        await session.rollback()
+        estimate = None
+    if estimate is None or estimate < exact_below:
+        return (await session.execute(select(func.count()).select_from(KtpRecord))).scalar()
+    return int(estimate)
+
+
+async def estimated_count_async(session, stmt, exact_below):
+    stmt = stmt.order_by(None)
+    try:
+        connection = await session.connection()
+        compiled = stmt.compile(dialect=connection.dialect)
+        params = [compiled.params[name] for name in compiled.positiontup]
+        raw = await connection.get_raw_connection()
+        # asyncpg: numbered $n parameters, passed positionally
+        plan = await raw.driver_connection.fetchval('EXPLAIN (FORMAT JSON) ' + compiled.string, *params)
+        estimate = _plan_rows(plan)
+    except Exception:
+        await session.rollback()
+        estimate = None
+    if estimate is None or estimate < exact_below:
+        return (await session.execute(select(func.count()).select_from(stmt.subquery()))).scalar()
+    return estimate
@@ -0,0 +1,293 @@
+"""
+Image preprocessing stage that runs before a document is sent to Gemini.
+
+Phone photos of KTPs are typically 4-12 MB. Fixing the EXIF orientation,
+cropping to the card, downscaling and re-encoding them shrinks the upload,
+the input token count and the model latency. The Pillow work is CPU bound, so
+`preprocess_document` runs it in a process pool instead of on the event loop.
+
+The same pool renders the pages of PDFs and multi-frame TIFFs and cuts out
+the cards on them, one page per call (see documents.py).
+
+This module only depends on Pillow (and pypdfium2 for PDFs, imported when a
+PDF is rendered) so pool workers start quickly.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageChops, ImageOps
+
+ENABLED = os.getenv("OCR_PREPROCESS", "true").lower() in ("1", "true", "yes")
+MAX_SIDE = int(os.getenv("OCR_IMAGE_MAX_SIDE", 1600))
+OUTPUT_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "JPEG").upper()   # JPEG or WEBP
+QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", 85))
+# Per gunicorn worker; the pod has 4 of them and half a CPU (k8s/deployment.yaml)
+POOL_WORKERS = int(os.getenv("OCR_PREPROCESS_WORKERS", 1))
+
+# Identifies the settings above; part of the extraction cache key
+VERSION = f"{int(ENABLED)}-{MAX_SIDE}-{OUTPUT_FORMAT}-{QUALITY}"
+
+IMAGE_MIME_TYPES = ("image/jpeg", "image/png", "image/webp", "image/bmp", "image/tiff")
+PAGED_MIME_TYPES = ("application/pdf", "image/tiff")
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# ID-1 card is 85.60 x 53.98 mm
+CARD_ASPECT = 85.60 / 53.98
+CARD_ASPECT_TOLERANCE = 0.25
+CARD_MIN_AREA = 0.20        # Fraction of the photo the card must cover to be cropped
+DETECT_SIDE = 256           # Detection runs on a thumbnail of this size
+DETECT_THRESHOLD = 40       # Grey-level difference from the background colour
+
+PAGE_DPI = int(os.getenv("OCR_PAGE_DPI", 200))
+PAGE_MAX_SIDE = 4000        # Pixels; caps the rendering of oversized PDF pages
+PAGE_DETECT_SIDE = 512
+PAGE_CARD_MIN_AREA = 0.02   # Fraction of the page a card on it must cover
+PAGE_INK = 0.02             # Fraction of a row/column that must differ from the background
+
+
+def detect_card(image):
+    """
+    Finds the card as the bounding box of everything that differs from the
+    background colour sampled along the photo border. Returns a crop box in
+    `image` coordinates, or None when no card-shaped region stands out
+    (e.g. scans that are already tight, or busy backgrounds).
+    """
+    small, mask = _foreground(image, DETECT_SIDE)
+    width, height = small.size
+    if width < 16 or height < 16:
+        return None
+
+    box = mask.getbbox()
+    if not box:
+        return None
+
+    left, top, right, bottom = box
+    box_width, box_height = right - left, bottom - top
+    if box_width * box_height < CARD_MIN_AREA * width * height:
+        return None
+    if box_width * box_height > 0.95 * width * height:
+        return None   # Card already fills the frame
+    aspect = max(box_width, box_height) / max(1, min(box_width, box_height))
+    if abs(aspect - CARD_ASPECT) > CARD_ASPECT_TOLERANCE * CARD_ASPECT:
+        return None
+
+    return _scale_box(box, small.size, image.size)
+
+
+def _foreground(image, side):
+    """Greyscale thumbnail of `image` and the mask of what differs from its border colour."""
+    small = image.convert("L")
+    small.thumbnail((side, side))
+    width, height = small.size
+
+    border = [small.getpixel((x, 0)) for x in range(width)]
+    border += [small.getpixel((x, height - 1)) for x in range(width)]
+    border += [small.getpixel((0, y)) for y in range(height)]
+    border += [small.getpixel((width - 1, y)) for y in range(height)]
+    background = sorted(border)[len(border) // 2]
+
+    diff = ImageChops.difference(small, Image.new("L", small.size, background))
+    return small, diff.point(lambda v: 255 if v > DETECT_THRESHOLD else 0)
+
+
+def _scale_box(box, small_size, size):
+    # Scale back to full resolution with a small margin so edges aren't clipped
+    left, top, right, bottom = box
+    scale_x, scale_y = size[0] / small_size[0], size[1] / small_size[1]
+    margin_x, margin_y = (right - left) * 0.03, (bottom - top) * 0.03
+    return (
+        max(0, int((left - margin_x) * scale_x)),
+        max(0, int((top - margin_y) * scale_y)),
+        min(size[0], int((right + margin_x) * scale_x)),
+        min(size[1], int((bottom + margin_y) * scale_y)),
+    )
+
+
+def _runs(mask, axis):
+    """(start, end) spans of rows (axis 0) or columns (axis 1) of `mask` with ink, merging small gaps."""
+    width, height = mask.size
+    length = height if axis == 0 else width
+    profile = mask.resize((1, height) if axis == 0 else (width, 1), Image.BOX)
+    inked = [profile.getpixel((0, i) if axis == 0 else (i, 0)) > 255 * PAGE_INK for i in range(length)]
+    min_gap = max(2, length // 100)
+    runs = []
+    start = gap = None
+    for i, ink in enumerate(inked + [False] * min_gap):
+        if ink:
+            if start is None:
+                start = i
+            gap = None
+        elif start is not None:
+            gap = i if gap is None else gap
+            if i - gap >= min_gap - 1:
+                runs.append((start, gap))
+                start = gap = None
+    return runs
+
+
+def find_cards(image):
+    """
+    Boxes of the card-shaped regions on a scanned page, top to bottom and
+    left to right: rows of cards separated by blank bands, then the cards of
+    each row separated by blank columns. Fewer than two means the page is
+    one document and is sent whole.
+    """
+    small, mask = _foreground(image, PAGE_DETECT_SIDE)
+    width, height = small.size
+    boxes = []
+    for top, bottom in _runs(mask, 0):
+        band = mask.crop((0, top, width, bottom))
+        for left, right in _runs(band, 1):
+            box = band.crop((left, 0, right, bottom - top)).getbbox()
+            if not box:
+                continue
+            box = (left + box[0], top + box[1], left + box[2], top + box[3])
+            box_width, box_height = box[2] - box[0], box[3] - box[1]
+            if box_width * box_height < PAGE_CARD_MIN_AREA * width * height:
+                continue
+            aspect = max(box_width, box_height) / max(1, min(box_width, box_height))
+            if abs(aspect - CARD_ASPECT) > CARD_ASPECT_TOLERANCE * CARD_ASPECT:
+                continue
+            boxes.append(_scale_box(box, small.size, image.size))
+    return boxes
+
+
+def page_count(path, mime_type):
+    """Pages of the PDF or frames of the TIFF at `path`."""
+    if mime_type == "application/pdf":
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    with Image.open(path) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def render_page(path, mime_type, index, dpi=PAGE_DPI):
+    """Page `index` (0-based) of the PDF or TIFF at `path` as an RGB image."""
+    if mime_type == "application/pdf":
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            page = pdf[index]
+            try:
+                scale = min(dpi / 72, PAGE_MAX_SIDE / max(page.get_size()))
+                image = page.render(scale=scale).to_pil()
+            finally:
+                page.close()
+        finally:
+            pdf.close()
+    else:
+        with Image.open(path) as tiff:
+            tiff.seek(index)
+            image = ImageOps.exif_transpose(tiff.copy())
+    return image if image.mode in ("RGB", "L") else image.convert("RGB")
+
+
+def render_cards(path, mime_type, index, dpi=PAGE_DPI, quality=QUALITY):
+    """
+    Renders one page and returns its cards as JPEG bytes: one per card found
+    by find_cards, or the whole page. Runs in the pool, one page at a time, so
+    only the pages being extracted are ever held rasterized.
+    """
+    image = render_page(path, mime_type, index, dpi)
+    boxes = find_cards(image)
+    crops = [image.crop(box) for box in boxes] if len(boxes) >= 2 else [image]
+    cards = []
+    for crop in crops:
+        out = io.BytesIO()
+        crop.save(out, format="JPEG", quality=quality)
+        cards.append(out.getvalue())
+    return cards
+
+
+def preprocess_image(file_bytes, mime_type, max_side=MAX_SIDE, output_format=OUTPUT_FORMAT, quality=QUALITY):
+    """
+    Orientation fix, card crop, downscale and re-encode.
+    Returns (bytes, mime_type, info); the original bytes are returned when
+    nothing changed and re-encoding would not make the file smaller.
+    """
+    image = Image.open(io.BytesIO(file_bytes))
+    original_size = image.size
+    info = {"original_bytes": len(file_bytes), "original_size": original_size}
+
+    rotated = image.getexif().get(0x0112, 1) != 1   # EXIF Orientation tag
+    image = ImageOps.exif_transpose(image)
+
+    box = detect_card(image)
+    if box:
+        image = image.crop(box)
+    info["cropped"] = bool(box)
+
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    resized = image.size != original_size
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    out = io.BytesIO()
+    save_args = {"quality": quality}
+    if output_format == "JPEG":
+        save_args.update(optimize=True, progressive=True)
+    else:
+        save_args.update(method=4)
+    image.save(out, format=output_format, **save_args)
+    data = out.getvalue()
+
+    if not (rotated or box or resized) and len(data) >= len(file_bytes):
+        info.update(bytes=len(file_bytes), size=original_size, changed=False)
+        return file_bytes, mime_type, info
+
+    info.update(bytes=len(data), size=image.size, changed=True)
+    return data, OUTPUT_MIME_TYPES[output_format], info
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # One pool per (forked) worker process; spawned children only import this module
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+async def run_in_pool(fn, *args):
+    """Runs `fn(*args)` (a function of this module) in this worker's process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), fn, *args)
+
+
+async def preprocess_document(file_bytes, mime_type):
+    """
+    Async entry point used by `agent.process_document`. Non-image documents
+    (PDF, text) and failures pass through unchanged.
+    """
+    if not ENABLED or not file_bytes or mime_type not in IMAGE_MIME_TYPES:
+        return file_bytes, mime_type
+
+    try:
+        data, new_mime_type, info = await run_in_pool(preprocess_image, file_bytes, mime_type)
+    except Exception as e:
+        print(f"[Preprocess] Skipping preprocessing, could not process image: {e}")
+        return file_bytes, mime_type
+
+    if info["changed"]:
+        print(f"[Preprocess] {info['original_bytes']} -> {info['bytes']} bytes, "
+              f"{info['original_size']} -> {info['size']}, cropped={info['cropped']}")
+    return data, new_mime_type
@@ -0,0 +1,292 @@
+"""
+Replication-aware read routing for RoutingSession.
+
+ReplicaRouter decides which bind a SELECT goes to:
+
+- the primary while the current transaction has written, and for
+  READ_YOUR_WRITES_WINDOW seconds after a user's last write, so a GET right
+  after create_ktp/update_ktp sees the new row
+- otherwise one of the healthy replica binds ('replica', 'replica_2', ...),
+  round-robin, pinned for the rest of the transaction
+- the primary when no replica is reachable or within REPLICA_MAX_LAG
+
+A user's last write is committed with the write itself (users.last_write_at,
+models.user_wrote) and the user row is loaded from the primary by
+token_required, so every worker and pod sees it: the frontend authenticates
+with a Bearer token from another origin and never sends cookies back. This
+worker's memory and the ktp_last_write cookie are only consulted as well.
+
+Replica health and lag are probed on a background thread every
+REPLICA_PROBE_INTERVAL seconds; a disconnect error marks a replica down
+immediately. Statements executed per bind are counted for /api/db/stats
+and timed into ktp_db_query_duration_seconds (metrics.py).
+"""
+import datetime
+import os
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event, text
+
+import metrics
+from models import RoutingSession, user_wrote
+
+LAST_WRITE_COOKIE = 'ktp_last_write'
+
+# Seconds behind the primary; 0 when the replica has replayed everything it
+# received (an idle primary would otherwise look like growing lag)
+_LAG_SQL = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+
+class ReplicaRouter:
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._engines = {}
+        self._health = {}
+        self._round_robin = 0
+        self._last_write_by_user = {}
+        self._statements = {}
+        self._routes = {'replica': 0, 'primary_write': 0, 'primary_sticky': 0, 'primary_fallback': 0}
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.app = app
+        self.db = db or self.db
+        self.binds = sorted(k for k in app.config.get('SQLALCHEMY_BINDS', {}) if k.startswith('replica'))
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 10)
+        self.probe_interval = app.config.get('REPLICA_PROBE_INTERVAL', 5)
+        self.sticky_window = app.config.get('READ_YOUR_WRITES_WINDOW', 10)
+        app.extensions['replica_router'] = self
+        app.after_request(self._set_last_write_cookie)
+
+    # ------------------------------------------------------------------
+    # Routing (called from RoutingSession.get_bind)
+    # ------------------------------------------------------------------
+
+    def choose(self, session):
+        """Returns the replica bind key for a SELECT, or None to use the primary."""
+        self._ensure_started()
+        if session.info.get('wrote'):
+            return self._route('primary_write')
+        if self._is_sticky():
+            return self._route('primary_sticky')
+
+        pinned = session.info.get('replica')
+        if pinned is not None and self._is_usable(pinned):
+            return self._route('replica', pinned)
+
+        bind = self.pick_replica()
+        session.info['replica'] = bind
+        return bind
+
+    def read_bind(self, user_id=None, *last_writes):
+        """
+        Bind for a read outside a Flask request (ASGI mode): None (primary) if
+        `user_id` or `last_writes` (see recently_wrote) wrote recently, else a replica.
+        """
+        self._ensure_started()
+        if self.recently_wrote(user_id, *last_writes):
+            return self._route('primary_sticky')
+        return self.pick_replica()
+
+    def pick_replica(self):
+        """Round-robin over healthy replicas within REPLICA_MAX_LAG; None when there is none."""
+        usable = [bind for bind in self.binds if self._is_usable(bind)]
+        if not usable:
+            return self._route('primary_fallback')
+        with self._lock:
+            self._round_robin += 1
+            bind = usable[self._round_robin % len(usable)]
+        return self._route('replica', bind)
+
+    def note_write(self, user_id=None):
+        """Starts the read-your-writes window for `user_id`; returns the cookie value."""
+        now = time.time()
+        if user_id is not None:
+            self._last_write_by_user[user_id] = now
+        return now
+
+    def recently_wrote(self, user_id=None, *last_writes):
+        """
+        Whether `user_id` wrote in this worker, or any of `last_writes` (epoch
+        seconds, a ktp_last_write cookie value or users.last_write_at) is
+        within READ_YOUR_WRITES_WINDOW.
+        """
+        cutoff = time.time() - self.sticky_window
+        if user_id is not None and self._last_write_by_user.get(user_id, 0) > cutoff:
+            return True
+        for last_write in last_writes:
+            if isinstance(last_write, datetime.datetime):
+                last_write = last_write.timestamp()
+            try:
+                if float(last_write or 0) > cutoff:
+                    return True
+            except ValueError:
+                continue
+        return False
+
+    def record_write(self, session):
+        """Called after a commit that wrote something."""
+        if has_request_context():
+            g.last_write_at = self.note_write(g.get('current_user_id'))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'statements': {bind: dict(counts) for bind, counts in self._statements.items()},
+                'routes': dict(self._routes),
+                'replicas': {bind: dict(self._health.get(bind, {'healthy': None, 'lag': None}))
+                             for bind in self.binds}
+            }
+
+    def _route(self, route, bind=None):
+        with self._lock:
+            self._routes[route] += 1
+        return bind
+
+    def _is_usable(self, bind):
+        health = self._health.get(bind)
+        return bool(health and health['healthy'] and health['lag'] <= self.max_lag)
+
+    def _is_sticky(self):
+        if not has_request_context():
+            return False
+        return self.recently_wrote(g.get('current_user_id'), g.get('user_last_write_at'),
+                                   request.cookies.get(LAST_WRITE_COOKIE))
+
+    def _set_last_write_cookie(self, response):
+        last_write_at = g.get('last_write_at')
+        if last_write_at is not None:
+            response.set_cookie(LAST_WRITE_COOKIE, f'{last_write_at:.3f}', max_age=int(self.sticky_window),
+                                httponly=True, samesite='Lax')
+        return response
+
+    # ------------------------------------------------------------------
+    # Health and lag probing
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        # Started lazily so each forked gunicorn worker probes with its own connections
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            with self.app.app_context():
+                engines = self.db.engines
+            self._engines = {bind: engines[bind] for bind in self.binds}
+            self._statements = {}
+            self._health = {}
+            self._last_write_by_user = {}
+            self._listen(None, engines[None])
+            for bind, engine in self._engines.items():
+                self._listen(bind, engine)
+            self._pid = os.getpid()
+        threading.Thread(target=self._prober, daemon=True, name='replica-prober').start()
+
+    def watch_engine(self, bind, engine):
+        """Counts statements and disconnects of another engine for `bind` (e.g. the ASGI mode's asyncpg engines)."""
+        self._ensure_started()
+        with self._lock:
+            self._listen(bind, engine)
+
+    def _listen(self, bind, engine):
+        name = bind or 'primary'
+        self._statements.setdefault(name, {'select': 0, 'other': 0})
+        if getattr(engine, '_ktp_router_listening', False):
+            return
+        engine._ktp_router_listening = True
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if conn.get_execution_options().get('replica_probe'):
+                return
+            kind = 'select' if statement.lstrip()[:6].lower() == 'select' else 'other'
+            counts = self._statements.get(name)
+            if counts is not None:
+                counts[kind] += 1
+            # Overwritten by the next statement if this one fails (after_cursor_execute is skipped)
+            conn.info['query_started'] = (kind, time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def timed(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.pop('query_started', None)
+            if started is not None:
+                metrics.observe_query(name, started[0], time.perf_counter() - started[1])
+
+        if bind is not None:
+            @event.listens_for(engine, 'handle_error')
+            def on_error(context):
+                if context.is_disconnect:
+                    print(f"[ReplicaRouter] {bind} disconnected, routing reads elsewhere")
+                    self._health[bind] = {'healthy': False, 'lag': None, 'error': 'disconnected'}
+
+    def _prober(self):
+        pid = os.getpid()
+        # Reads go to the primary until the first probe has finished
+        while self._pid == pid:
+            self._probe_all()
+            time.sleep(self.probe_interval)
+
+    def _probe_all(self):
+        for bind, engine in list(self._engines.items()):
+            try:
+                with engine.connect().execution_options(replica_probe=True) as conn:
+                    lag = float(conn.execute(_LAG_SQL).scalar() or 0)
+                health = {'healthy': True, 'lag': round(lag, 3)}
+            except Exception as e:
+                health = {'healthy': False, 'lag': None, 'error': str(e).strip().splitlines()[0]}
+            previous = self._health.get(bind)
+            if previous and previous['healthy'] != health['healthy']:
+                print(f"[ReplicaRouter] {bind} is now {'healthy' if health['healthy'] else 'down'}")
+            if health['healthy'] and health['lag'] > self.max_lag:
+                print(f"[ReplicaRouter] {bind} is {health['lag']:.1f}s behind, reading from the primary")
+            self._health[bind] = health
+
+
+# Track whether a transaction wrote, so its own reads and the next requests
+# of the same user stay on the primary
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _record_user_write(session):
+    # Shared by every worker and pod, unlike the process memory and the cookie
+    # Runs before the final flush, so pending ORM changes count as a write too
+    wrote = session.info.get('wrote') or session.new or session.dirty or session.deleted
+    if wrote and has_request_context() and g.get('current_user_id') is not None:
+        session.execute(user_wrote(g.current_user_id))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    wrote = session.info.pop('wrote', False)
+    session.info.pop('replica', None)
+    if wrote and has_app_context() and 'replica_router' in current_app.extensions:
+        current_app.extensions['replica_router'].record_write(session)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('wrote', None)
+    session.info.pop('replica', None)
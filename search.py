@@ -0,0 +1,82 @@
+"""
+Search for the DataTables search[value] filter.
+
+The term is routed by shape so every route can use an index:
+
+- digits only (spaces/dots ignored) -> NIK prefix, btree varchar_pattern_ops index
+- one word of 3+ characters          -> ILIKE '%word%' on full_name/address, pg_trgm GIN indexes
+- shorter words or several words     -> prefix match on the search_vector tsvector, GIN index
+
+Each route also returns a relevance ordering used when the client did not
+ask for a specific column order.
+"""
+import re
+
+from sqlalchemy import false, func, or_
+
+from models import KtpRecord
+
+TSVECTOR_CONFIG = 'simple'
+TRIGRAM_MIN_LENGTH = 3   # pg_trgm cannot use the index for shorter patterns
+
+_NIK_LIKE = re.compile(r'^[\d\s.]*\d[\d\s.]*$')   # At least one digit, or '.' would match every NIK
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def classify(term):
+    """Returns 'nik', 'trigram', 'fulltext' or None for an empty term."""
+    term = term.strip()
+    if not term:
+        return None
+    if _NIK_LIKE.match(term):
+        return 'nik'
+    words = _WORD.findall(term)
+    if len(words) == 1 and len(words[0]) >= TRIGRAM_MIN_LENGTH and words[0] == term:
+        return 'trigram'
+    return 'fulltext'
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def prefix_tsquery(term):
+    """'budi merd' -> 'budi:* & merd:*' (words only, so user input cannot inject tsquery syntax)."""
+    return ' & '.join(f'{word.lower()}:*' for word in _WORD.findall(term))
+
+
+def apply_search(query, term):
+    """
+    Filters `query` (a KtpRecord query or select) by `term`.
+    Returns (query, ranking) where ranking is a list of ORDER BY clauses, most
+    relevant first, or (query, None) when the term is empty.
+    """
+    route = classify(term)
+    if route is None:
+        return query, None
+
+    term = term.strip()
+    if route == 'nik':
+        prefix = re.sub(r'[\s.]', '', term)
+        query = query.filter(KtpRecord.nik.like(_escape_like(prefix) + '%', escape='\\'))
+        return query, [KtpRecord.nik.asc()]   # All prefix matches are equally relevant
+
+    if route == 'trigram':
+        pattern = f'%{_escape_like(term)}%'
+        query = query.filter(or_(
+            KtpRecord.full_name.ilike(pattern, escape='\\'),
+            KtpRecord.address.ilike(pattern, escape='\\')
+        ))
+        rank = func.greatest(
+            func.similarity(KtpRecord.full_name, term),
+            func.similarity(KtpRecord.address, term)
+        )
+        return query, [rank.desc(), KtpRecord.nik.asc()]
+
+    words = prefix_tsquery(term)
+    if not words:
+        # Only punctuation: nothing can match
+        return query.filter(false()), [KtpRecord.nik.asc()]
+    tsquery = func.to_tsquery(TSVECTOR_CONFIG, words)
+    query = query.filter(KtpRecord.search_vector.op('@@')(tsquery))
+    return query, [func.ts_rank(KtpRecord.search_vector, tsquery).desc(), KtpRecord.nik.asc()]
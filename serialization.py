@@ -0,0 +1,79 @@
+"""
+Fast serialization of KTP records.
+
+List and detail endpoints select only the requested columns (`?fields=`)
+as plain rows instead of hydrating KtpRecord objects, and responses are
+encoded with orjson, which writes dates and datetimes as ISO 8601 itself,
+so rows need no per-field conversion before encoding.
+"""
+import decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+
+from models import KtpRecord
+
+# Keys of KtpRecord.to_dict(), in the same order
+KTP_FIELDS = [
+    'nik', 'full_name', 'birth_place', 'birth_date', 'gender', 'blood_type', 'address', 'rt_rw',
+    'village_kelurahan', 'district_kecamatan', 'religion', 'marital_status', 'occupation',
+    'citizenship', 'expiry_date', 'registration_date', 'created_at', 'updated_at'
+]
+
+
+def parse_fields(value):
+    """'nik,full_name' -> ['nik', 'full_name']; all fields when empty. Raises ValueError for unknown fields."""
+    if not value:
+        return list(KTP_FIELDS)
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in KTP_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return list(dict.fromkeys(fields))
+
+
+def projection(fields, extra=()):
+    """
+    Columns to select for `fields`, followed by any `extra` field names that
+    are needed internally (e.g. sort keys for cursors) but not returned.
+    """
+    names = list(fields) + [f for f in extra if f not in fields]
+    return [getattr(KtpRecord, name) for name in names]
+
+
+def row_to_dict(fields, row):
+    # zip stops after `fields`, so trailing extra columns are dropped
+    return dict(zip(fields, row))
+
+
+def rows_to_dicts(fields, rows):
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """JSON-encodes `obj` to bytes."""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (`app.json = OrjsonProvider(app)`)."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
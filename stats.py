@@ -0,0 +1,230 @@
+"""
+Demographic counts for dashboards (GET /api/ktp/stats).
+
+ktp_stats (models.KtpStat) holds the number of records per value of every
+dimension at three levels: all records, one district, one village of it.
+Statement-level triggers on ktp_records append the delta of each INSERT,
+UPDATE and DELETE from its transition tables to ktp_stats_delta
+(models.KtpStatDelta), so ORM writes, upsert_ktp_records, the import merge
+and the async routes all keep it current without anything rescanning
+ktp_records. The triggers only append: adding to ktp_stats directly would
+have every write wait for the row lock on the shared total rows until the
+previous writer committed. KtpStatsFolder moves the deltas into ktp_stats
+every KTP_STATS_FOLD_INTERVAL seconds, one process at a time, and requests
+add the deltas not folded yet, in the same statement, so counts are exact
+either way. ktp_stats' size depends on the number of districts, villages
+and distinct values, not on the number of records, and a request reads one
+index range of it (from a replica, like every read).
+
+Ages are bucketed at query time from the birth year, so the buckets follow
+the calendar without rewriting the table (by calendar year: everyone born in
+2000 counts as 26 throughout 2026).
+
+Filters the summary is not broken down by (gender, religion and the date
+ranges of export.apply_ktp_filters) are answered with a live GROUP BY over
+the matching ktp_records instead; the response says which via 'source'.
+
+Existing databases: `flask rebuild-ktp-stats` creates the table and the
+triggers and fills it with one scan.
+"""
+import datetime
+import os
+import threading
+import time
+
+from sqlalchemy import extract, func, literal, select, text, union_all
+
+from export import apply_ktp_filters
+from models import (db, KtpRecord, KtpStat, KtpStatDelta, KTP_STATS_COLUMNS, KTP_STATS_FOLD, KTP_STATS_GROUP,
+                    KTP_STATS_LOCK, KTP_STATS_TRIGGERS, KTP_STATS_UPSERT)
+
+DIMENSIONS = ('district_kecamatan', 'village_kelurahan', 'gender', 'religion', 'marital_status', 'age')
+# apply_ktp_filters args that ktp_stats has no level for
+LIVE_FILTERS = ('gender', 'religion', 'birth_date_from', 'birth_date_to', 'updated_from', 'updated_to')
+
+# (lowest age, highest age, label); None is open-ended
+AGE_BUCKETS = (
+    (None, 16, '<17'), (17, 25, '17-25'), (26, 35, '26-35'), (36, 45, '36-45'),
+    (46, 55, '46-55'), (56, 65, '56-65'), (66, None, '66+')
+)
+
+
+def available_dimensions(district=None, village=None):
+    # Village names repeat across districts, so villages are only counted within one
+    return [
+        d for d in DIMENSIONS
+        if not (d == 'district_kecamatan' and district)
+        and not (d == 'village_kelurahan' and (village or not district))
+    ]
+
+
+def parse_dimensions(value, available):
+    """Validated ?dimensions=a,b (default: every available one)."""
+    if not value:
+        return list(available)
+    dimensions = [d.strip() for d in value.split(',') if d.strip()]
+    invalid = [d for d in dimensions if d not in available]
+    if invalid:
+        raise ValueError(f"Unknown dimensions: {', '.join(invalid)}. Available here: {', '.join(available)}")
+    return dimensions
+
+
+def ktp_stats(args, limit=100):
+    """
+    Counts for request `args`: district and village narrow the scope,
+    dimensions picks the breakdowns and every breakdown but age keeps its
+    `limit` largest values. Returns {'total', 'source', 'stats': {dimension:
+    [{'value', 'count'}]}}. Raises ValueError for bad args.
+    """
+    district, village = args.get('district') or None, args.get('village') or None
+    if village and not district:
+        raise ValueError('village requires district')
+    dimensions = parse_dimensions(args.get('dimensions'), available_dimensions(district, village))
+
+    if any(args.get(name) for name in LIVE_FILTERS):
+        source = 'live'
+        total, counts = _live_counts(args, dimensions)
+    else:
+        source = 'summary'
+        total, counts = _summary_counts(district, village, dimensions)
+
+    stats = {}
+    for dimension in dimensions:
+        values = counts.get(dimension, {})
+        if dimension == 'age':
+            stats['age'] = _age_buckets(values)
+        else:
+            top = sorted(values.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            stats[dimension] = [{'value': value or None, 'count': count} for value, count in top]
+    return {'total': total, 'source': source, 'stats': stats}
+
+
+def rebuild_ktp_stats():
+    """
+    (Re)installs the triggers and recomputes ktp_stats from ktp_records in one
+    transaction; writes to ktp_records wait until it commits, dashboards keep
+    reading the old counts until then. Returns the total.
+    """
+    KtpStat.__table__.create(db.engine, checkfirst=True)
+    KtpStatDelta.__table__.create(db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        conn.execute(text('LOCK TABLE ktp_records IN SHARE MODE'))
+        conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': KTP_STATS_LOCK})
+        conn.exec_driver_sql(KTP_STATS_TRIGGERS)
+        conn.execute(text('DELETE FROM ktp_stats_delta'))
+        conn.execute(text('DELETE FROM ktp_stats'))
+        conn.exec_driver_sql(KTP_STATS_UPSERT.format(
+            combos=KTP_STATS_GROUP.format(source=f'SELECT {KTP_STATS_COLUMNS}, 1 AS n FROM ktp_records')
+        ))
+        return conn.execute(
+            select(KtpStat.count).where(KtpStat.level == 0, KtpStat.dimension == 'total')
+        ).scalar() or 0
+
+
+def fold_ktp_stats():
+    """
+    Adds the committed ktp_stats_delta rows to ktp_stats and deletes them, in
+    one transaction on the primary. Returns the number of summary rows
+    changed, or None when another process is folding.
+    """
+    with db.engine.begin() as conn:
+        if not conn.execute(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': KTP_STATS_LOCK}).scalar():
+            return None
+        return conn.exec_driver_sql(KTP_STATS_FOLD).rowcount
+
+
+class KtpStatsFolder:
+    """
+    Runs fold_ktp_stats every KTP_STATS_FOLD_INTERVAL seconds in a daemon
+    thread of each worker process, started by its first request (or by
+    `start`, e.g. from the ASGI lifespan). The advisory lock lets one process
+    fold at a time; the others skip that round.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = max(0.1, app.config.get('KTP_STATS_FOLD_INTERVAL', 5))
+        app.before_request(self.start)
+        app.extensions['ktp_stats_folder'] = self
+
+    def start(self):
+        # One thread per forked worker; the preloading master never serves a request
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='ktp-stats-fold', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    fold_ktp_stats()
+            except Exception as e:
+                print(f"[KtpStatsFolder] Error folding ktp_stats_delta: {e}")
+
+
+# ----------------------------------------------------------------------
+
+def _summary_counts(district, village, dimensions):
+    names = ['total'] + ['birth_year' if d == 'age' else d for d in dimensions]
+    # Folded counts plus the deltas not folded yet, read in one statement (one snapshot)
+    parts = [select(KtpStat.dimension, KtpStat.value, KtpStat.count.label('n')).where(
+        KtpStat.level == (2 if village else 1 if district else 0),
+        KtpStat.district_kecamatan == (district or ''),
+        KtpStat.village_kelurahan == (village or ''),
+        KtpStat.dimension.in_(names)
+    )]
+    scope = []
+    if district:
+        scope.append(KtpStatDelta.district_kecamatan == district)
+    if village:
+        scope.append(KtpStatDelta.village_kelurahan == village)
+    for name in names:
+        value = literal('') if name == 'total' else getattr(KtpStatDelta, name)
+        parts.append(select(literal(name).label('dimension'), value.label('value'), KtpStatDelta.n).where(*scope))
+    merged = union_all(*parts).subquery()
+    rows = db.session.execute(
+        select(merged.c.dimension, merged.c.value, func.sum(merged.c.n))
+        .group_by(merged.c.dimension, merged.c.value)
+        .having(func.sum(merged.c.n) > 0)
+    ).all()
+    counts = {}
+    for dimension, value, count in rows:
+        counts.setdefault('age' if dimension == 'birth_year' else dimension, {})[value] = int(count)
+    return counts.pop('total', {}).get('', 0), counts
+
+
+def _live_counts(args, dimensions):
+    total = db.session.execute(apply_ktp_filters(select(func.count()).select_from(KtpRecord), args)).scalar()
+    counts = {}
+    for dimension in dimensions:
+        column = extract('year', KtpRecord.birth_date) if dimension == 'age' else getattr(KtpRecord, dimension)
+        rows = db.session.execute(apply_ktp_filters(select(column, func.count()).group_by(column), args)).all()
+        counts[dimension] = {str(int(value)) if dimension == 'age' else (value or ''): count
+                             for value, count in rows if value is not None or dimension != 'age'}
+    return total, counts
+
+
+def _age_buckets(years):
+    this_year = datetime.date.today().year
+    totals = dict.fromkeys([label for _, _, label in AGE_BUCKETS], 0)
+    for year, count in years.items():
+        if not year:
+            continue
+        age = this_year - int(year)
+        for low, high, label in AGE_BUCKETS:
+            if (low is None or age >= low) and (high is None or age <= high):
+                totals[label] += count
+                break
+    return [{'value': label, 'count': count} for label, count in totals.items()]
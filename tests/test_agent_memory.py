@@ -0,0 +1,14 @@
+"""Short run of benchmarks/bench_agent_memory.py: every extraction must leave no ADK session behind."""
+import os
+
+# agent.py copies these into os.environ at import
+for name, value in (('GOOGLE_GENAI_USE_VERTEXAI', 'false'), ('GOOGLE_CLOUD_PROJECT', 'test'),
+                    ('GOOGLE_CLOUD_LOCATION', 'test')):
+    os.environ.setdefault(name, value)
+
+from benchmarks.bench_agent_memory import leftover_sessions, run_calls  # noqa: E402
+
+
+def test_sessions_are_evicted():
+    run_calls(30)
+    assert leftover_sessions() == (0, 0)
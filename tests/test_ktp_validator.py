@@ -0,0 +1,86 @@
+import csv
+from datetime import date
+
+import pytest
+
+import ktp_validator
+from ktp_validator import PROVINCE_CODES, RegionIndex, get_region_index, validate_ktp, write_region_table
+
+TODAY = date(2024, 1, 1)
+RECORD = {'birth_date': '2000-05-05', 'gender': 'LAKI-LAKI', 'rt_rw': '003/007'}
+
+
+@pytest.fixture
+def region_table(tmp_path):
+    """A synthetic Kemendagri export: 15 regencies of 10 districts with 2 villages each, per province."""
+    source = tmp_path / 'villages.csv'
+    with open(source, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['kode', 'nama'])
+        for province in PROVINCE_CODES:
+            for regency in range(1, 16):
+                for district in range(1, 11):
+                    for village in (1001, 1002):
+                        writer.writerow([f'{province}.{regency:02d}.{district:02d}.{village}', 'DESA'])
+    path = tmp_path / 'kemendagri_regions.csv'
+    assert write_region_table(str(source), str(path)) == (38 * 15, 38 * 15 * 10)
+    return path
+
+
+@pytest.fixture
+def regions(region_table):
+    return RegionIndex.from_csv(str(region_table))
+
+
+def _codes(report):
+    return [flag['code'] for flag in report['flags']]
+
+
+def test_known_district_is_decided(regions):
+    normalized, report = validate_ktp(dict(RECORD, nik='3201100505000001'), TODAY, regions)
+    assert report == {'valid': True, 'decided': True, 'flags': []}
+    assert normalized['birth_date'] == '2000-05-05'
+
+
+def test_unknown_regency(regions):
+    _, report = validate_ktp(dict(RECORD, nik='3216010505000001'), TODAY, regions)
+    assert _codes(report) == ['NIK_REGENCY']
+    assert not report['valid'] and report['decided']
+
+
+def test_unknown_district(regions):
+    _, report = validate_ktp(dict(RECORD, nik='3215110505000001'), TODAY, regions)
+    assert _codes(report) == ['NIK_DISTRICT']
+    assert not report['valid'] and report['decided']
+
+
+def test_without_table_only_province_is_checked():
+    _, report = validate_ktp(dict(RECORD, nik='3299990505000001'), TODAY, RegionIndex())
+    assert _codes(report) == ['NIK_REGION_UNVERIFIED']
+    assert report['valid'] and not report['decided']
+    _, report = validate_ktp(dict(RECORD, nik='9999990505000001'), TODAY, RegionIndex())
+    assert 'NIK_PROVINCE' in _codes(report)
+
+
+def test_write_region_table_rejects_a_partial_table(tmp_path):
+    source = tmp_path / 'jabar.csv'
+    source.write_text('\n'.join(f'32.{regency:02d}.01' for regency in range(1, 28)))
+    with pytest.raises(ValueError):
+        write_region_table(str(source), str(tmp_path / 'out.csv'))
+
+
+def test_get_region_index_loads_the_configured_table(region_table, monkeypatch):
+    monkeypatch.setenv('KTP_REGION_TABLE', str(region_table))
+    monkeypatch.setattr(ktp_validator, '_region_index', None)
+    regions = get_region_index(required=True)
+    assert regions.has_district('9615100000000000')
+    _, report = validate_ktp(dict(RECORD, nik='3215110505000001'), TODAY)
+    assert _codes(report) == ['NIK_DISTRICT']
+
+
+def test_get_region_index_required_without_table(tmp_path, monkeypatch):
+    monkeypatch.setenv('KTP_REGION_TABLE', str(tmp_path / 'missing.csv'))
+    monkeypatch.setattr(ktp_validator, '_region_index', None)
+    with pytest.raises(RuntimeError):
+        get_region_index(required=True)
+    assert not get_region_index().has_districts